@@ -0,0 +1,301 @@
+# api.py
+#
+# Async HTTP service over the processing pipeline.
+#
+#   uvicorn api:app --host 0.0.0.0 --port 8000
+#
+# Uploads are streamed to a spooled file and processed by the shared worker
+# process pool (see batch.py), so the event loop only moves bytes. When
+# TRANSFORMO_API_MAX_IN_FLIGHT documents are already being processed, new
+# uploads are rejected with 429 and a Retry-After estimate before their body
+# is read.
+#
+# Document endpoints require a bearer token from POST /api/auth/login unless
+# TRANSFORMO_API_AUTH=0 (see auth.py).
+
+import asyncio
+import math
+import os
+import tempfile
+import time
+import uuid
+from urllib.parse import quote
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+import auth
+import database
+from batch import BATCH_WORKERS, file_result, get_pool, keyword_snapshot, process_file
+from exporter import EXPORT_FORMATS, iter_export_bytes
+from formats import BINARY_FORMATS, binary_formats
+from metrics import increment, merge_trace, render_prometheus
+from processor import restore_result
+from sniffer import MAX_DOCUMENT_BYTES
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT = int(os.environ.get("TRANSFORMO_API_MAX_IN_FLIGHT", "0")) or 2 * BATCH_WORKERS
+MAX_UPLOAD_BYTES = MAX_DOCUMENT_BYTES
+CUSTOM_FIELDS = ["persons", "organizations", "locations", "dates"]
+TEMPLATES = ["data_only", "analytics_only", "specific_entities"]
+AUTH_ENABLED = os.environ.get("TRANSFORMO_API_AUTH", "1") != "0"
+
+app = FastAPI(title="Transformo Docs API")
+
+_users = None
+
+_in_flight = 0
+# Moving average of processing time, used for Retry-After
+_average_seconds = 1.0
+
+
+class _Backpressure(Exception):
+    pass
+
+
+class Credentials(BaseModel):
+    username: str
+    password: str
+
+
+def _user_store():
+    global _users
+    if _users is None:
+        _users = auth.UserStore()
+    return _users
+
+
+async def require_user(authorization: str = Header(None)):
+    # async so it runs on the event loop; a sync dependency would cost a threadpool hop per request
+    if not AUTH_ENABLED:
+        return None
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Missing bearer token.", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return auth.verify_token(token)["sub"]
+    except auth.AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+
+protected = [Depends(require_user)]
+
+
+def _acquire_slot():
+    # Runs on the event loop thread only, so a plain counter is enough
+    global _in_flight
+    if _in_flight >= MAX_IN_FLIGHT:
+        increment("api.rejected")
+        raise _Backpressure()
+    _in_flight += 1
+
+
+def _release_slot(seconds):
+    global _in_flight, _average_seconds
+    _in_flight -= 1
+    _average_seconds = 0.8 * _average_seconds + 0.2 * seconds
+
+
+def _retry_after():
+    # Time until enough queued work has drained for a slot to free up
+    return max(1, min(60, math.ceil(_average_seconds * _in_flight / max(1, BATCH_WORKERS))))
+
+
+@app.exception_handler(_Backpressure)
+async def _backpressure_handler(request, exc):
+    return JSONResponse(
+        {"detail": "Server is busy processing other documents. Retry later."},
+        status_code=429,
+        headers={"Retry-After": str(_retry_after())},
+    )
+
+
+def _media_type(export_format):
+    if export_format in BINARY_FORMATS:
+        return BINARY_FORMATS[export_format]
+    return f"{EXPORT_FORMATS[export_format]}; charset=utf-8"
+
+
+def _check_format(export_format):
+    if export_format not in EXPORT_FORMATS and export_format not in binary_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {export_format}")
+
+
+def _check_document_id(document_id):
+    # Document ids are uuid4 strings; anything else never names a stored file
+    try:
+        uuid.UUID(document_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Document not found.")
+
+
+def _stream_result(result, export_format, headers):
+    # Sync generator; Starlette iterates it in a worker thread so rendering never blocks the event loop
+    return StreamingResponse(iter_export_bytes(result, export_format), media_type=_media_type(export_format), headers=headers)
+
+
+async def _spool_body(request, filename):
+    # Streams the request body to a temporary file without holding it in memory
+    declared = request.headers.get("content-length")
+    if declared and int(declared) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes.")
+    fd, path = tempfile.mkstemp(prefix="transformo-", suffix=os.path.splitext(filename)[1])
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes.")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    increment("api.upload_bytes", size)
+    return path
+
+
+async def _wait_or_cancel(request, future, poll_seconds=1.0):
+    # Kills the worker if the client goes away instead of finishing a result nobody will read
+    waiter = asyncio.wrap_future(future)
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=poll_seconds)
+        if done:
+            return
+        if await request.is_disconnected():
+            get_pool().cancel(future)
+            increment("api.cancelled")
+            raise HTTPException(status_code=499, detail="Client closed the request.")
+
+
+@app.post("/api/documents", dependencies=protected)
+async def process_upload(
+    request: Request,
+    filename: str = Query(..., description="Original file name; its extension selects the extractor."),
+    template: str = Query(None, enum=TEMPLATES),
+    fields: str = Query(None, description="Comma-separated custom fields: " + ", ".join(CUSTOM_FIELDS)),
+    output_format: str = Query("json", alias="format"),
+    incremental: bool = False,
+    reuse_duplicates: bool = True,
+    save: bool = False,
+):
+    """Processes the request body as a document and streams the result.
+
+    Send the raw file as the body. The result is returned in ``format``;
+    ``X-Result-Id`` and, with ``save=true``, ``X-Document-Id`` identify it.
+    """
+    _check_format(output_format)
+    custom_fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    if custom_fields and any(field not in CUSTOM_FIELDS for field in custom_fields):
+        raise HTTPException(status_code=400, detail=f"Custom fields must be among: {', '.join(CUSTOM_FIELDS)}")
+
+    _acquire_slot()
+    started = time.perf_counter()
+    path = None
+    try:
+        path = await _spool_body(request, filename)
+        frequencies = await run_in_threadpool(keyword_snapshot)
+        future = get_pool().submit(process_file, filename, path, template, custom_fields, incremental, reuse_duplicates,
+                                   os.path.abspath(database.STORAGE_DIR), frequencies)
+        await _wait_or_cancel(request, future)
+        packed, trace, reused = await run_in_threadpool(file_result, future, filename, template, custom_fields)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to process '{filename}': {e}")
+        raise HTTPException(status_code=422, detail=f"Failed to process document: {e}")
+    finally:
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+        _release_slot(time.perf_counter() - started)
+
+    merge_trace(trace)
+    result = await run_in_threadpool(restore_result, packed, False)
+    headers = {"X-Result-Id": result["result_id"]}
+    if reused:
+        headers["X-Reused-From"] = quote(reused)
+    if save:
+        headers["X-Document-Id"] = await run_in_threadpool(database.save_to_database, result, filename)
+    increment("api.documents_processed")
+    return _stream_result(result, output_format, headers)
+
+
+@app.get("/api/documents", dependencies=protected)
+async def list_documents():
+    # Metadata only; payloads are fetched one at a time
+    return await run_in_threadpool(database.get_document_metadata)
+
+
+@app.get("/api/documents/{document_id}", dependencies=protected)
+async def get_stored_document(document_id: str, output_format: str = Query("json", alias="format")):
+    _check_format(output_format)
+    _check_document_id(document_id)
+
+    def load():
+        stored = database.get_document(document_id)
+        return stored, restore_result(database.load_payload(stored), render_outputs=False)
+
+    try:
+        stored, result = await run_in_threadpool(load)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _stream_result(result, output_format, {"X-Filename": quote(stored["filename"])})
+
+
+@app.get("/api/documents/{document_id}/pages/{number}", dependencies=protected)
+async def get_stored_page(document_id: str, number: int):
+    # One page of text with the entities and sentences on it; the rest of the document is not read
+    _check_document_id(document_id)
+    try:
+        return await run_in_threadpool(database.get_document_page, document_id, number)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.delete("/api/documents/{document_id}", dependencies=protected)
+async def delete_stored_document(document_id: str):
+    _check_document_id(document_id)
+    try:
+        await run_in_threadpool(database.delete_document, document_id)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"deleted": document_id}
+
+
+@app.get("/api/duplicates", dependencies=protected)
+async def duplicate_report():
+    return await run_in_threadpool(database.dedup_report)
+
+
+@app.post("/api/auth/register", status_code=201)
+async def register(credentials: Credentials):
+    try:
+        await auth.register_user(_user_store(), credentials.username, credentials.password)
+    except auth.UserExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except auth.AuthError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"username": credentials.username}
+
+
+@app.post("/api/auth/login")
+async def login(credentials: Credentials):
+    try:
+        token = await auth.login_user(_user_store(), credentials.username, credentials.password)
+    except auth.AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return {"access_token": token, "token_type": "bearer", "expires_in": auth.TOKEN_TTL_SECONDS}
+
+
+@app.get("/healthz")
+async def health():
+    return {"status": "ok", "in_flight": _in_flight, "max_in_flight": MAX_IN_FLIGHT, "workers": BATCH_WORKERS}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
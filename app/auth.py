@@ -0,0 +1,198 @@
+# auth.py
+#
+# Authentication for the HTTP API: users in SQLite, scrypt password hashes
+# computed off the event loop, and HS256 JWTs whose verification is cached so
+# authenticated hot paths cost a dictionary lookup.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import jwt
+from metrics import increment
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TTL_SECONDS = int(float(os.environ.get("TRANSFORMO_TOKEN_TTL_HOURS", "24")) * 3600)
+# Verified tokens are trusted for at most this long before being decoded again
+TOKEN_CACHE_SECONDS = int(os.environ.get("TRANSFORMO_TOKEN_CACHE_SECONDS", "60"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TRANSFORMO_TOKEN_CACHE_SIZE", "10000"))
+USER_DB = os.environ.get("TRANSFORMO_USER_DB", os.path.join("local_storage", "users.db"))
+HASH_WORKERS = int(os.environ.get("TRANSFORMO_HASH_WORKERS", "4"))
+ALGORITHM = "HS256"
+
+# scrypt cost: ~16 MB and tens of milliseconds per hash
+_SCRYPT_N = 2 ** 14
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+
+_secret = os.environ.get("TRANSFORMO_JWT_SECRET")
+if not _secret:
+    _secret = secrets.token_urlsafe(32)
+    logger.warning("TRANSFORMO_JWT_SECRET is not set; using a random secret, so tokens expire on restart "
+                   "and are not shared between server processes.")
+
+# Bounded so concurrent registrations/logins cannot exhaust memory with scrypt buffers
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+class AuthError(Exception):
+    pass
+
+
+class UserExistsError(AuthError):
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, salt=None):
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P, dklen=32)
+    return f"scrypt${_SCRYPT_N}${_SCRYPT_R}${_SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, stored):
+    try:
+        scheme, n, r, p, salt, expected = stored.split("$")
+    except ValueError:
+        return False
+    if scheme != "scrypt":
+        return False
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p), dklen=32)
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+# Compared against when the user does not exist, so unknown and known users take the same time
+_DUMMY_HASH = hash_password(secrets.token_urlsafe(16))
+
+
+async def hash_password_async(password):
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, hash_password, password)
+
+
+async def verify_password_async(password, stored):
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, verify_password, password, stored)
+
+
+class UserStore:
+    # SQLite user table; one connection per thread
+    def __init__(self, path=USER_DB):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash TEXT NOT NULL, created TEXT NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def add_user(self, username, password_hash):
+        try:
+            with self._connection() as conn:
+                conn.execute("INSERT INTO users (username, password_hash, created) VALUES (?, ?, ?)",
+                             (username, password_hash, datetime.now().isoformat()))
+        except sqlite3.IntegrityError:
+            raise UserExistsError(f"User '{username}' already exists.")
+
+    def password_hash(self, username):
+        row = self._connection().execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+
+class TokenCache:
+    """Bounded LRU of verified tokens with a per-entry deadline.
+
+    An entry expires after TOKEN_CACHE_SECONDS or at the token's own ``exp``,
+    whichever comes first, so a cached token is never accepted past expiry.
+    """
+
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            claims, deadline = entry
+            if deadline <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims
+
+    def put(self, token, claims):
+        deadline = min(time.time() + self.ttl, claims.get("exp", float("inf")))
+        with self._lock:
+            self._entries[token] = (claims, deadline)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def issue_token(username):
+    now = int(time.time())
+    claims = {"sub": username, "iat": now, "exp": now + TOKEN_TTL_SECONDS, "jti": secrets.token_hex(8)}
+    return jwt.encode(claims, _secret, algorithm=ALGORITHM)
+
+
+def verify_token(token):
+    """Claims of a valid token; raises AuthError otherwise.
+
+    Cache hits skip signature verification and JSON decoding entirely.
+    """
+    claims = token_cache.get(token)
+    if claims is not None:
+        increment("auth.token_cache_hits")
+        return claims
+    increment("auth.token_cache_misses")
+    try:
+        claims = jwt.decode(token, _secret, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
+    except jwt.PyJWTError as e:
+        raise AuthError(f"Invalid token: {e}")
+    token_cache.put(token, claims)
+    return claims
+
+
+async def register_user(store, username, password):
+    if not username or not password:
+        raise AuthError("Username and password are required.")
+    password_hash = await hash_password_async(password)
+    await asyncio.get_running_loop().run_in_executor(None, store.add_user, username, password_hash)
+
+
+async def login_user(store, username, password):
+    stored = await asyncio.get_running_loop().run_in_executor(None, store.password_hash, username)
+    valid = await verify_password_async(password, stored or _DUMMY_HASH)
+    if stored is None or not valid:
+        raise AuthError("Invalid username or password.")
+    return issue_token(username)
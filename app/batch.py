@@ -0,0 +1,148 @@
+# batch.py
+#
+# Processes many uploads in parallel. Each file is spooled to disk and handed
+# to a worker process by path, so large files are never pickled; workers
+# return the compact stored form of the result (see compact.pack_result).
+# Workers are supervised (see supervisor.py): a file that runs past
+# TRANSFORMO_JOB_TIMEOUT or the worker memory limit, or is cancelled, stops
+# its worker, and if its text was already extracted a partial result is
+# returned instead.
+
+import os
+import threading
+import time
+from compact import pack_result
+import database
+from dedup import text_fingerprint
+from extractor import validate_document, extract_text
+from metrics import document_trace
+from processor import partial_result, process_document
+from supervisor import JobAborted, SupervisedPool, checkpoint
+from uploads import SpooledUpload
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.environ.get("TRANSFORMO_BATCH_WORKERS", "0")) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One pool per server process; workers load the spaCy model once and are reused across batches
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SupervisedPool(max_workers=BATCH_WORKERS, initializer=_warm_up)
+        return _pool
+
+
+def _warm_up():
+    # Importing this module in a worker loads the spaCy model before the worker takes its first job
+    pass
+
+
+def process_file(name, path, template=None, custom_fields=None, incremental=False, reuse_duplicates=False,
+                 storage_dir=None, frequencies=None):
+    """Worker: validates, extracts and processes one spooled file.
+
+    ``frequencies`` is the keyword document frequency snapshot to rank
+    against (see keyword_snapshot). Returns the packed result, the metrics
+    trace, and the filename of the saved duplicate that was reused (or None).
+    """
+    if storage_dir is not None:
+        database.STORAGE_DIR = storage_dir
+    reused = None
+    with document_trace(name) as trace:
+        upload = SpooledUpload.from_path(path, name)
+        file_type = validate_document(upload)
+        extracted_text = extract_text(upload, file_type)
+        # Kept by the supervisor so a timeout during NLP still returns the text
+        checkpoint(extracted_text)
+
+        # Computed once here and carried in the packed result for duplicate lookups and the index
+        fingerprint = text_fingerprint(extracted_text)
+        reusable = None
+        if reuse_duplicates:
+            duplicates = database.find_duplicates(fingerprint=fingerprint)
+            reusable = database.load_duplicate_result(duplicates, {"template": template, "custom_fields": custom_fields})
+        if reusable is not None:
+            match, packed = reusable
+            reused = match["filename"]
+        else:
+            result = process_document(extracted_text, template, custom_fields, incremental, render_outputs=False,
+                                      frequencies=frequencies)
+            packed = pack_result(result)
+        packed["fingerprint"] = fingerprint
+    return packed, trace, reused
+
+
+def keyword_snapshot():
+    # Taken once per batch in the server and sent with each job, so workers never load the keyword index;
+    # an unreadable store only loses the IDF weighting
+    try:
+        return database.keyword_frequencies().snapshot()
+    except Exception as e:
+        logger.warning(f"Keyword document frequencies unavailable: {e}")
+        return None
+
+
+def file_result(future, name, template=None, custom_fields=None):
+    """(packed, trace, reused) of a finished process_file future.
+
+    A job aborted after extraction yields a partial result that has the
+    extracted text and the reason as a warning; other failures are raised.
+    """
+    try:
+        return future.result()
+    except JobAborted as e:
+        if e.partial is None:
+            raise
+        with document_trace(name) as trace:
+            result = partial_result(e.partial, template, custom_fields, f"Warning: {e} Only the extracted text is available.",
+                                    render_outputs=False)
+        return pack_result(result), trace, None
+
+
+def cancel_jobs(jobs):
+    for _, _, _, future in jobs:
+        if not future.done():
+            get_pool().cancel(future)
+
+
+def submit_batch(uploaded_files, template=None, custom_fields=None, incremental=False, reuse_duplicates=False):
+    """Spools each upload to disk and submits it to the worker pool.
+
+    Returns a list of (name, size, upload, future). Close the uploads once the
+    futures are done to remove the spooled files.
+    """
+    pool = get_pool()
+    frequencies = keyword_snapshot()
+    jobs = []
+    for uploaded_file in uploaded_files:
+        # A negative threshold spools every file, including empty ones
+        upload = SpooledUpload.from_upload(uploaded_file, threshold=-1)
+        future = pool.submit(process_file, upload.name, upload.path, template, custom_fields, incremental,
+                             reuse_duplicates, os.path.abspath(database.STORAGE_DIR), frequencies)
+        jobs.append((upload.name, upload.size, upload, future))
+    logger.info(f"Submitted a batch of {len(jobs)} files to {BATCH_WORKERS} workers.")
+    return jobs
+
+
+def wait_for_batch(jobs, on_update=None, poll_seconds=0.2, on_poll=None):
+    # Calls on_update(index, state) as files start and finish; state is "queued", "running" or "done".
+    # on_poll() runs on every poll, e.g. to give Streamlit a point to stop the script when the user cancels.
+    states = ["queued"] * len(jobs)
+    while True:
+        if on_poll is not None:
+            on_poll()
+        for index, (_, _, _, future) in enumerate(jobs):
+            state = "done" if future.done() else "running" if future.running() else "queued"
+            if state != states[index]:
+                states[index] = state
+                if on_update is not None:
+                    on_update(index, state)
+        if all(state == "done" for state in states):
+            return
+        time.sleep(poll_seconds)
@@ -0,0 +1,550 @@
+# benchmark.py
+#
+# Offline benchmark harness for the processing pipeline. Generates a
+# reproducible synthetic corpus and drives it through the same calls the
+# Streamlit UI makes, then writes per-stage latency percentiles, throughput and
+# peak RSS as JSON so runs can be compared.
+#
+#   python benchmark.py --documents 20 --paragraphs 40 --output bench.json
+#   python benchmark.py --suite clean_text --paragraphs 400
+#   python benchmark.py --suite formats --paragraphs 200
+#   python benchmark.py --suite storage --documents 500 --paragraphs 20
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+FILE_TYPES = ["pdf", "docx", "txt", "xlsx"]
+
+_FIRST_NAMES = ["Alice", "Rahul", "Maria", "Chen", "Fatima", "John", "Priya", "Lucas", "Aiko", "Omar"]
+_LAST_NAMES = ["Sharma", "Smith", "Garcia", "Wang", "Khan", "Müller", "Rossi", "Tanaka", "Okafor", "Silva"]
+_ORGANIZATIONS = ["Acme Corporation", "Globex Ltd", "Initech", "Tata Consultancy Services", "the World Bank",
+                  "Stark Industries", "Umbrella Holdings", "the Ministry of Finance"]
+_PLACES = ["New Delhi", "London", "Berlin", "Tokyo", "São Paulo", "Nairobi", "Toronto", "Mumbai"]
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+           "October", "November", "December"]
+_NOUNS = ["agreement", "invoice", "payment", "contract", "shipment", "report", "policy", "license",
+          "warranty", "schedule", "obligation", "termination", "amendment", "clause", "party"]
+_VERBS = ["signed", "approved", "reviewed", "terminated", "renewed", "submitted", "audited", "amended"]
+
+
+class BenchmarkFile(io.BytesIO):
+    # Mimics the parts of Streamlit's UploadedFile the pipeline relies on
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def _sentence(rng):
+    person = f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+    date = f"{rng.randint(1, 28)} {rng.choice(_MONTHS)} {rng.randint(1990, 2030)}"
+    amount = f"${rng.randint(1, 999)},{rng.randint(100, 999)}"
+    return rng.choice([
+        f"{person} of {rng.choice(_ORGANIZATIONS)} {rng.choice(_VERBS)} the {rng.choice(_NOUNS)} on {date}.",
+        f"The {rng.choice(_NOUNS)} between {rng.choice(_ORGANIZATIONS)} and {rng.choice(_ORGANIZATIONS)} was {rng.choice(_VERBS)} in {rng.choice(_PLACES)}.",
+        f"A {rng.choice(_NOUNS)} of {amount} is due to {person} before {date}.",
+        f"Each {rng.choice(_NOUNS)} must be {rng.choice(_VERBS)} by the {rng.choice(_NOUNS)} committee in {rng.choice(_PLACES)}.",
+    ])
+
+
+def generate_paragraphs(rng, paragraphs, sentences_per_paragraph=6):
+    return [" ".join(_sentence(rng) for _ in range(sentences_per_paragraph)) for _ in range(paragraphs)]
+
+
+def _pdf_escape(text):
+    return text.encode("latin-1", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def build_pdf(paragraphs, lines_per_page=40, line_width=90):
+    # Hand-written PDF so the corpus needs nothing beyond the standard library
+    lines = []
+    for paragraph in paragraphs:
+        words, current = paragraph.split(), ""
+        for word in words:
+            if current and len(current) + len(word) + 1 > line_width:
+                lines.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        lines.append(current)
+        lines.append("")
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_lines in pages:
+        stream = b"BT /F1 10 Tf 14 TL 40 800 Td " + b" ".join(b"(" + _pdf_escape(line) + b") '" for line in page_lines) + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_id)
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % i for i in page_ids) + b"] /Count %d >>" % len(page_ids)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def build_docx(paragraphs):
+    from docx import Document
+    doc = Document()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def build_txt(paragraphs):
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+
+def build_xlsx(paragraphs):
+    import pandas as pd
+    rows = [{"section": i + 1, "text": paragraph, "length": len(paragraph)} for i, paragraph in enumerate(paragraphs)]
+    out = io.BytesIO()
+    pd.DataFrame(rows).to_excel(out, index=False)
+    return out.getvalue()
+
+
+BUILDERS = {"pdf": build_pdf, "docx": build_docx, "txt": build_txt, "xlsx": build_xlsx}
+
+
+def generate_corpus(file_types=FILE_TYPES, documents=5, paragraphs=20, seed=0):
+    # Each document gets its own seeded generator so corpora are reproducible
+    # regardless of which file types are selected
+    corpus = []
+    for file_type in file_types:
+        for index in range(documents):
+            rng = random.Random(f"{seed}-{file_type}-{index}")
+            data = BUILDERS[file_type](generate_paragraphs(rng, paragraphs))
+            corpus.append((f"synthetic_{index:04d}.{file_type}", data))
+    return corpus
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def summarize(samples):
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "total_seconds": round(sum(values), 6),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def temporary_store():
+    # Points the document store, its indexes and the shared block cache at a temporary directory, so no suite
+    # touches ./local_storage
+    import database
+    import processor
+    from incremental import BlockCache
+    previous = database.STORAGE_DIR, processor.block_cache
+    with tempfile.TemporaryDirectory() as storage_dir:
+        database.STORAGE_DIR = storage_dir
+        processor.block_cache = BlockCache(namespace=previous[1].namespace, path=os.path.join(storage_dir, "block_cache.db"))
+        try:
+            yield storage_dir
+        finally:
+            database.STORAGE_DIR, processor.block_cache = previous
+
+
+def run_pipeline_benchmark(corpus, template=None, custom_fields=None, save=True):
+    import database
+    from extractor import validate_document, extract_text
+    from metrics import document_trace
+    from processor import process_document
+
+    stage_samples = {}
+    failures = []
+
+    def record(stage, seconds):
+        stage_samples.setdefault(stage, []).append(seconds)
+
+    with temporary_store():
+        input_bytes = 0
+        started = time.perf_counter()
+        for name, data in corpus:
+            upload = BenchmarkFile(data, name)
+            input_bytes += upload.size
+            try:
+                with document_trace(name) as trace:
+                    t0 = time.perf_counter()
+                    file_type = validate_document(upload)
+                    t1 = time.perf_counter()
+                    extracted_text = extract_text(upload, file_type)
+                    t2 = time.perf_counter()
+                    result = process_document(extracted_text, template, custom_fields)
+                    t3 = time.perf_counter()
+                    if save:
+                        database.save_to_database(result, name)
+                    t4 = time.perf_counter()
+            except Exception as e:
+                failures.append({"document": name, "error": str(e)})
+                continue
+
+            kind = name.rsplit(".", 1)[-1]
+            record("validate_document", t1 - t0)
+            record(f"extract_text.{kind}", t2 - t1)
+            record("process_document", t3 - t2)
+            if save:
+                record("save_to_database", t4 - t3)
+            record("end_to_end", t4 - t0)
+            # Inner stages (spaCy parse, rendering, storage writes) come from the metrics trace
+            for stage, wall, _ in trace["stages"]:
+                record(f"stage.{stage}", wall)
+        elapsed = time.perf_counter() - started
+
+    processed = len(corpus) - len(failures)
+    return {
+        "documents": len(corpus),
+        "processed": processed,
+        "failures": failures,
+        "elapsed_seconds": round(elapsed, 6),
+        "throughput": {
+            "documents_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+            "input_mb_per_second": round(input_bytes / (1024 * 1024) / elapsed, 3) if elapsed else 0.0,
+        },
+        "input_bytes": input_bytes,
+        "stages": {stage: summarize(samples) for stage, samples in sorted(stage_samples.items())},
+    }
+
+
+def _legacy_clean_text(text):
+    text = ''.join(char for char in text if char.isprintable())
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text
+
+
+def _best_of(repeat, func, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _clean_text_case(text, spans, repeat):
+    from sanitizer import clean_text
+
+    def legacy_spans():
+        return [_legacy_clean_text(text[start:end]) for start, end in spans]
+
+    def vectorized_spans():
+        return [clean_text(text[start:end]) for start, end in spans]
+
+    if legacy_spans() != vectorized_spans() or _legacy_clean_text(text) != clean_text(text):
+        raise AssertionError("clean_text implementations disagree")
+
+    timings = {
+        "legacy_full_text": _best_of(repeat, _legacy_clean_text, text),
+        "clean_text_full_text": _best_of(repeat, clean_text, text),
+        "legacy_per_span": _best_of(repeat, legacy_spans),
+        "clean_text_per_span": _best_of(repeat, vectorized_spans),
+    }
+    return {
+        "text_chars": len(text),
+        "spans": len(spans),
+        "timings_ms": {name: round(seconds * 1000, 3) for name, seconds in timings.items()},
+        "speedup": {
+            "full_text": round(timings["legacy_full_text"] / timings["clean_text_full_text"], 2),
+            "spans": round(timings["legacy_per_span"] / timings["clean_text_per_span"], 2),
+        },
+    }
+
+
+def run_clean_text_benchmark(paragraphs=200, seed=0, repeat=5):
+    rng = random.Random(seed)
+    # Line breaks, tabs and markup characters exercise every replacement path
+    texts = {
+        "latin1_controls": "\n\n".join(p.replace(". ", ".\n", 2) + " <b>R&D</b>\t" for p in generate_paragraphs(rng, paragraphs)),
+        "unicode_controls": "\n\n".join(p.replace(". ", ".\u2028", 2) + " <b>R&D</b>\u200b" for p in generate_paragraphs(rng, paragraphs)),
+    }
+    cases = {}
+    for case, text in texts.items():
+        spans = []
+        position = 0
+        while position < len(text):
+            end = min(len(text), position + rng.randint(20, 200))
+            spans.append((position, end))
+            position = end
+        cases[case] = _clean_text_case(text, spans, repeat)
+    return {"best_of": repeat, "cases": cases}
+
+
+def _entity_row(row):
+    return {key: row[key] for key in ("text", "label", "start", "end", "page")}
+
+
+def _check_round_trip(export_format, result, decoded):
+    # Raises if a decoded export does not reproduce the entities/sentences it was written from
+    entities = list(result["structured_data"]["entities"])
+    sentences = list(result["structured_data"]["sentences"])
+    if export_format == "json":
+        recovered = decoded["entities"], decoded["sentences"]
+    elif export_format == "xml":
+        recovered = (
+            [{"text": item.findtext("text"), "label": item.findtext("label"),
+              **{key: int(item.findtext(key)) for key in ("start", "end", "page")}} for item in decoded.find("entities")],
+            [item.text or "" for item in decoded.find("sentences")],
+        )
+    elif export_format == "jsonl":
+        _, entity_rows, sentence_rows = decoded
+        recovered = [_entity_row(row) for row in entity_rows], [row["text"] for row in sentence_rows]
+    elif export_format == "parquet":
+        rows = decoded[1].to_pylist()
+        recovered = (
+            [_entity_row(row) for row in rows if row["kind"] == "entity"],
+            [row["text"] for row in rows if row["kind"] == "sentence"],
+        )
+    else:
+        recovered = list(decoded["structured_data"]["entities"]), list(decoded["structured_data"]["sentences"])
+        if decoded["extracted_text"] != result["extracted_text"]:
+            raise AssertionError(f"{export_format} round trip changed the extracted text")
+    if list(recovered[0]) != entities or list(recovered[1]) != sentences:
+        raise AssertionError(f"{export_format} round trip does not reproduce the entities and sentences")
+
+
+def run_formats_benchmark(paragraphs=200, seed=0, repeat=3):
+    import io
+    import xml.etree.ElementTree as ET
+    from formats import binary_formats, read_jsonl, read_parquet, unpack_msgpack
+    from pages import join_pages
+    from processor import generate_machine_readable_output, process_document
+
+    # Ten paragraphs per page, so page numbers are part of the round trip
+    blocks = generate_paragraphs(random.Random(seed), paragraphs)
+    text = join_pages("\n\n".join(blocks[i:i + 10]) for i in range(0, len(blocks), 10))
+    with temporary_store():
+        result = process_document(text, render_outputs=False)
+    decoders = {
+        "json": json.loads,
+        "xml": ET.fromstring,
+        "jsonl": lambda output: read_jsonl(output.splitlines()),
+        "parquet": lambda output: read_parquet(io.BytesIO(output)),
+        "msgpack": unpack_msgpack,
+    }
+    # ElementTree rejects a str with an encoding declaration, so XML is parsed as bytes
+    to_input = {"xml": lambda output: output.encode("utf-8")}
+
+    formats = {}
+    for export_format in ["json", "xml", "jsonl"] + binary_formats():
+        output = generate_machine_readable_output(result, export_format)
+        data = to_input.get(export_format, lambda value: value)(output)
+        decode = decoders[export_format]
+        _check_round_trip(export_format, result, decode(data))
+        size = len(output) if isinstance(output, bytes) else len(output.encode("utf-8"))
+        formats[export_format] = {
+            "bytes": size,
+            "encode_ms": round(_best_of(repeat, generate_machine_readable_output, result, export_format) * 1000, 3),
+            "decode_ms": round(_best_of(repeat, decode, data) * 1000, 3),
+        }
+    for stats in formats.values():
+        stats["size_vs_json"] = round(stats["bytes"] / formats["json"]["bytes"], 3)
+        stats["size_vs_xml"] = round(stats["bytes"] / formats["xml"]["bytes"], 3)
+    return {
+        "best_of": repeat,
+        "text_chars": len(text),
+        "entities": len(result["structured_data"]["entities"]),
+        "sentences": len(result["structured_data"]["sentences"]),
+        "round_trip": "ok",
+        "formats": formats,
+    }
+
+
+def _storage_records(count, data):
+    import uuid
+    stamp = datetime.now().isoformat()
+    return [{"id": str(uuid.uuid4()), "filename": f"synthetic_{index:05d}.txt", "date": stamp, "data": data}
+            for index in range(count)]
+
+
+def _throughput(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def run_storage_benchmark(documents=200, paragraphs=20, seed=0, backends=None, threads=8):
+    """Saves, reads, lists and deletes the same records through each backend.
+
+    Records carry a real stored payload. PostgreSQL is included when
+    TRANSFORMO_POSTGRES_DSN is set; the records it inserts are deleted again.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from compact import pack_result
+    from processor import process_document
+    from storage import SQLiteBackend, available_backends, create_backend
+
+    text = "\n\n".join(generate_paragraphs(random.Random(seed), paragraphs))
+    with temporary_store():
+        data = json.dumps(pack_result(process_document(text, render_outputs=False)))
+    results = {}
+    for kind in backends or available_backends():
+        with tempfile.TemporaryDirectory() as storage_dir:
+            # SQLite ignores TRANSFORMO_SQLITE_PATH here so the benchmark never writes to a configured database
+            backend = SQLiteBackend(f"{storage_dir}/documents.db") if kind == "sqlite" else create_backend(kind, storage_dir)
+            try:
+                single = _storage_records(documents, data)
+                latencies = []
+                started = time.perf_counter()
+                for record in single:
+                    t0 = time.perf_counter()
+                    backend.save(record)
+                    latencies.append(time.perf_counter() - t0)
+                save_seconds = time.perf_counter() - started
+
+                batched = _storage_records(documents, data)
+                started = time.perf_counter()
+                backend.save_many(batched)
+                save_many_seconds = time.perf_counter() - started
+
+                ids = [record["id"] for record in single + batched]
+                order = random.Random(seed).sample(ids, len(ids))
+                started = time.perf_counter()
+                for document_id in order:
+                    backend.get(document_id)
+                get_seconds = time.perf_counter() - started
+
+                # Concurrent readers share the backend's connections
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    list(executor.map(backend.get, order))
+                concurrent_get_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                listed = len(backend.list())
+                list_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                for document_id in ids:
+                    backend.delete(document_id)
+                delete_seconds = time.perf_counter() - started
+            finally:
+                backend.close()
+        results[kind] = {
+            "documents_listed": listed,
+            "save_per_second": _throughput(documents, save_seconds),
+            "save_latency_ms": summarize(latencies),
+            "save_many_per_second": _throughput(documents, save_many_seconds),
+            "get_per_second": _throughput(len(ids), get_seconds),
+            f"get_per_second_{threads}_threads": _throughput(len(ids), concurrent_get_seconds),
+            "list_all_seconds": round(list_seconds, 6),
+            "delete_per_second": _throughput(len(ids), delete_seconds),
+        }
+    return {"documents": documents, "payload_bytes": len(data), "backends": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Transformo Docs processing pipeline.")
+    parser.add_argument("--suite", choices=["pipeline", "clean_text", "formats", "storage"], default="pipeline", help="Benchmark to run.")
+    parser.add_argument("--types", nargs="+", choices=FILE_TYPES, default=FILE_TYPES, help="File types to generate.")
+    parser.add_argument("--documents", type=int, default=5, help="Documents generated per file type.")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per document (controls size).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus.")
+    parser.add_argument("--template", default=None, help="Template passed to process_document.")
+    parser.add_argument("--no-save", action="store_true", help="Skip save_to_database.")
+    parser.add_argument("--backends", nargs="+", default=None, help="Storage backends for --suite storage (default: all available).")
+    parser.add_argument("--output", default=None, help="Write results JSON to this path (default: stdout).")
+    args = parser.parse_args(argv)
+
+    if args.suite == "clean_text":
+        results = {
+            "benchmark": "clean_text",
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            **run_clean_text_benchmark(args.paragraphs, args.seed),
+        }
+        return _write_results(results, args.output)
+
+    if args.suite == "formats":
+        results = {
+            "benchmark": "formats",
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            **run_formats_benchmark(args.paragraphs, args.seed),
+        }
+        return _write_results(results, args.output)
+
+    if args.suite == "storage":
+        results = {
+            "benchmark": "storage",
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            **run_storage_benchmark(args.documents, args.paragraphs, args.seed, args.backends),
+        }
+        return _write_results(results, args.output)
+
+    corpus_started = time.perf_counter()
+    corpus = generate_corpus(args.types, args.documents, args.paragraphs, args.seed)
+    corpus_seconds = time.perf_counter() - corpus_started
+
+    results = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "types": args.types,
+            "documents_per_type": args.documents,
+            "paragraphs": args.paragraphs,
+            "seed": args.seed,
+            "template": args.template,
+            "save": not args.no_save,
+        },
+        "corpus_generation_seconds": round(corpus_seconds, 6),
+        **run_pipeline_benchmark(corpus, args.template, save=not args.no_save),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    return _write_results(results, args.output)
+
+
+def _write_results(results, path):
+    output = json.dumps(results, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
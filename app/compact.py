@@ -0,0 +1,272 @@
+# compact.py
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Sequence
+from heapq import merge
+from pages import page_of, page_span, page_starts
+from sanitizer import clean_text
+
+
+class CompactDocument:
+    """Entities and sentences of a parsed text stored as integer offsets.
+
+    The text is held once; each entity is a (start, end, label id) row and each
+    sentence a (start, end) row in typed arrays. Strings are only materialized
+    (and sanitized) when a row is read, e.g. while exporting.
+
+    Entities are also indexed by label as they are added, so per-label lists
+    and counts cost O(k) for k matching entities instead of a full scan.
+    ``word_counts`` holds the word frequencies gathered during the same parse,
+    ``term_counts`` the keyword candidates and ``keyword_scores`` their
+    ranking (see keywords.py). ``page_starts`` is the page index of the text
+    (see pages.py), so every span can be placed on its page.
+    """
+
+    __slots__ = ("text", "labels", "_label_ids", "ent_starts", "ent_ends", "ent_labels", "sent_starts", "sent_ends",
+                 "_by_label", "word_counts", "term_counts", "keyword_scores", "page_starts")
+
+    def __init__(self, text, labels=()):
+        self.text = text
+        self.labels = list(labels)
+        self._label_ids = {label: i for i, label in enumerate(self.labels)}
+        self.ent_starts = array("I")
+        self.ent_ends = array("I")
+        self.ent_labels = array("H")
+        self.sent_starts = array("I")
+        self.sent_ends = array("I")
+        self._by_label = [array("I") for _ in self.labels]
+        self.word_counts = None
+        self.term_counts = None
+        self.keyword_scores = None
+        self.page_starts = page_starts(text)
+
+    def label_id(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            label_id = self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+            self._by_label.append(array("I"))
+        return label_id
+
+    def add_entity(self, start, end, label):
+        label_id = self.label_id(label)
+        self._by_label[label_id].append(len(self.ent_starts))
+        self.ent_starts.append(start)
+        self.ent_ends.append(end)
+        self.ent_labels.append(label_id)
+
+    def label_counts(self):
+        # Labels in order of first appearance, which keeps most_common() ties
+        # ordered the same way as counting the entity list would
+        return Counter({label: len(self._by_label[i]) for i, label in enumerate(self.labels) if self._by_label[i]})
+
+    def entity_texts(self, labels):
+        # Texts of all entities with any of the given labels, in document order
+        indexes = [self._by_label[self._label_ids[label]] for label in labels if label in self._label_ids]
+        if len(indexes) > 1:
+            indexes = [merge(*indexes)]
+        return [self.entity_text(i) for i in indexes[0]] if indexes else []
+
+    def add_sentence(self, start, end):
+        self.sent_starts.append(start)
+        self.sent_ends.append(end)
+
+    def entity_text(self, index):
+        return clean_text(self.text[self.ent_starts[index]:self.ent_ends[index]])
+
+    def entity(self, index):
+        start = self.ent_starts[index]
+        return {"text": self.entity_text(index), "label": self.labels[self.ent_labels[index]], "start": start,
+                "end": self.ent_ends[index], "page": page_of(self.page_starts, start)}
+
+    def sentence(self, index):
+        return clean_text(self.text[self.sent_starts[index]:self.sent_ends[index]])
+
+    @property
+    def page_count(self):
+        return len(self.page_starts)
+
+    def page_of(self, offset):
+        return page_of(self.page_starts, offset)
+
+    def page_text(self, number):
+        start, end = page_span(self.page_starts, number, len(self.text))
+        return self.text[start:end]
+
+    def page_spans(self, number):
+        # Entities and sentences starting on page ``number`` (1-based), see spans_on_page
+        start, end = page_span(self.page_starts, number, len(self.text))
+        return spans_on_page(self.text[start:end], start, number, self.labels, self.ent_starts, self.ent_ends,
+                             self.ent_labels, self.sent_starts, self.sent_ends)
+
+    def to_rows(self):
+        # Flattened rows keep the stored form small: [start, end, label, start, end, label, ...]
+        entities = array("I", bytes(4 * 3 * len(self.ent_starts)))
+        entities[0::3] = self.ent_starts
+        entities[1::3] = self.ent_ends
+        entities[2::3] = array("I", self.ent_labels)
+        sentences = array("I", bytes(4 * 2 * len(self.sent_starts)))
+        sentences[0::2] = self.sent_starts
+        sentences[1::2] = self.sent_ends
+        return {
+            "labels": self.labels,
+            "entities": entities.tolist(),
+            "sentences": sentences.tolist(),
+            # Lets a single stored page be placed without the rest of the text
+            "pages": self.page_starts.tolist(),
+        }
+
+    @classmethod
+    def from_rows(cls, text, rows):
+        document = cls(text, rows["labels"])
+        entities = array("I", rows["entities"])
+        document.ent_starts = entities[0::3]
+        document.ent_ends = entities[1::3]
+        document.ent_labels = array("H", entities[2::3])
+        for index, label_id in enumerate(document.ent_labels):
+            document._by_label[label_id].append(index)
+        sentences = array("I", rows["sentences"])
+        document.sent_starts = sentences[0::2]
+        document.sent_ends = sentences[1::2]
+        return document
+
+
+def spans_on_page(page_text, start, number, labels, ent_starts, ent_ends, ent_labels, sent_starts, sent_ends):
+    """Entities and sentences that start on one page, as (entities, sentences).
+
+    ``page_text`` is the page, beginning at document offset ``start``. Span
+    offsets are sorted, so each page is found by bisection; items carry
+    document offsets, cut to the page. A span starting on the page break
+    before the page (a sentence often does) belongs to the page.
+    """
+    end = start + len(page_text)
+
+    def window(starts, ends):
+        first, last = bisect_left(starts, max(start - 1, 0)), bisect_left(starts, end)
+        for index in range(first, last):
+            span_start, span_end = max(starts[index], start), min(ends[index], end)
+            yield index, span_start, span_end, clean_text(page_text[span_start - start:span_end - start])
+
+    entities = [{"text": text, "label": labels[ent_labels[index]], "start": span_start, "end": span_end, "page": number}
+                for index, span_start, span_end, text in window(ent_starts, ent_ends)]
+    sentences = [{"text": text, "start": span_start, "end": span_end, "page": number}
+                 for _, span_start, span_end, text in window(sent_starts, sent_ends)]
+    return entities, sentences
+
+
+def stored_page_spans(rows, page_text, start, number):
+    # spans_on_page over the offset rows of a stored payload (see CompactDocument.to_rows)
+    entities, sentences = rows["entities"], rows["sentences"]
+    return spans_on_page(page_text, start, number, rows["labels"], entities[0::3], entities[1::3], entities[2::3],
+                         sentences[0::2], sentences[1::2])
+
+
+class SpanList(Sequence):
+    # Read-only list view over a CompactDocument; behaves like the list of
+    # dicts/strings structure_text used to return
+    __slots__ = ("document",)
+    kind = None
+
+    def __init__(self, document):
+        self.document = document
+
+    def _item(self, index):
+        raise NotImplementedError
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"{self.kind} index out of range")
+        return self._item(index)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, SpanList)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} of {len(self)} {self.kind}>"
+
+
+class EntityList(SpanList):
+    __slots__ = ()
+    kind = "entities"
+
+    def __len__(self):
+        return len(self.document.ent_starts)
+
+    def _item(self, index):
+        return self.document.entity(index)
+
+
+class SentenceList(SpanList):
+    __slots__ = ()
+    kind = "sentences"
+
+    def __len__(self):
+        return len(self.document.sent_starts)
+
+    def _item(self, index):
+        return self.document.sentence(index)
+
+
+def json_default(obj):
+    # json.dumps(..., default=json_default) materializes views only while exporting
+    if isinstance(obj, SpanList):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def pack_result(result):
+    """Returns a JSON-serializable copy of a processing result for storage.
+
+    Entity/sentence views are replaced by markers and stored once as offset
+    rows next to the extracted text. The rendered JSON/XML outputs are derived
+    from the rest of the result and are not stored again.
+    """
+    packed = {key: value for key, value in result.items() if key not in ("document", "json_output", "xml_output")}
+    document = result.get("document")
+    if document is not None:
+        packed["compact"] = document.to_rows()
+    if isinstance(result.get("structured_data"), dict):
+        packed["structured_data"] = {
+            key: {"$compact": value.kind} if isinstance(value, SpanList) else value
+            for key, value in result["structured_data"].items()
+        }
+    return packed
+
+
+def unpack_result(packed):
+    # Inverse of pack_result; payloads saved before the compact format pass through unchanged
+    result = dict(packed)
+    rows = result.pop("compact", None)
+    if rows is None:
+        return result
+    document = CompactDocument.from_rows(result.get("extracted_text", ""), rows)
+    views = {"entities": EntityList(document), "sentences": SentenceList(document)}
+    result["document"] = document
+    if isinstance(result.get("structured_data"), dict):
+        result["structured_data"] = {
+            key: views[value["$compact"]] if isinstance(value, dict) and "$compact" in value else value
+            for key, value in result["structured_data"].items()
+        }
+    return result
+
+
+def materialize_result(packed):
+    # Plain dicts and lists only, e.g. for downloading a stored result
+    result = unpack_result(packed)
+    result.pop("document", None)
+    if isinstance(result.get("structured_data"), dict):
+        result["structured_data"] = {
+            key: list(value) if isinstance(value, SpanList) else value
+            for key, value in result["structured_data"].items()
+        }
+    return result
@@ -0,0 +1,235 @@
+# corpus_export.py
+#
+# Exports every saved document as one dataset: documents, entities and
+# sentences tables, each partitioned by save date and split into shards.
+#
+#   python corpus_export.py --output corpus --format parquet
+#
+# The result loads with pandas.read_parquet("corpus/entities") or, for JSON
+# Lines, pandas.read_json(path, lines=True) per shard.
+
+import argparse
+import json
+import os
+from compact import unpack_result
+from database import iter_saved_documents, load_payload
+from formats import PARQUET_AVAILABLE
+from metrics import timed, increment
+import logging
+
+if PARQUET_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Shards are cut by estimated size rather than row count: one documents row
+# carries a whole extracted text, an entity row a few words
+SHARD_BYTES = int(os.environ.get("TRANSFORMO_CORPUS_SHARD_MB", "64")) * 1024 * 1024
+# Upper bound on estimated row bytes held in memory across all tables and partitions
+MAX_BUFFERED_BYTES = int(os.environ.get("TRANSFORMO_CORPUS_BUFFER_MB", "256")) * 1024 * 1024
+ROW_OVERHEAD = 64
+CORPUS_FORMATS = ["jsonl", "parquet"]
+
+TABLES = ["documents", "entities", "sentences"]
+_SCHEMAS = {
+    "documents": [
+        ("id", "string"), ("filename", "string"), ("date", "string"), ("template", "string"),
+        ("word_count", "int64"), ("sentence_count", "int64"), ("entity_count", "int64"),
+        ("keyword_count", "int64"), ("average_sentence_length", "float64"), ("keywords", "list<string>"),
+        ("text", "string"),
+    ],
+    "entities": [
+        ("document_id", "string"), ("label", "string"), ("text", "string"), ("start", "int64"), ("end", "int64"),
+        ("page", "int64"),
+    ],
+    "sentences": [
+        ("document_id", "string"), ("text", "string"), ("start", "int64"), ("end", "int64"), ("page", "int64"),
+    ],
+}
+
+
+def _arrow_schema(table):
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "list<string>": pa.list_(pa.string())}
+    return pa.schema([(name, types[kind]) for name, kind in _SCHEMAS[table]])
+
+
+def row_bytes(row):
+    # Estimated in-memory size of a row: its text and string values dominate
+    size = ROW_OVERHEAD
+    for value in row.values():
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, list):
+            size += sum(len(item) + 8 for item in value if isinstance(item, str))
+        else:
+            size += 8
+    return size
+
+
+def document_rows(stored):
+    """Rows for one stored document: (date partition, {table: rows}).
+
+    Entity and sentence rows are read straight from the compact offsets.
+    Runs in the reader threads so parsing overlaps with writing.
+    """
+    result = unpack_result(load_payload(stored))
+    document_id = stored["id"]
+    analytics = result.get("analytics") or {}
+    structured = result.get("structured_data") or {}
+    document = result.get("document")
+    keywords = structured.get("keywords")
+
+    entities = []
+    sentences = []
+    if document is not None:
+        labels = document.labels
+        for index, (start, end, label_id) in enumerate(zip(document.ent_starts, document.ent_ends, document.ent_labels)):
+            entities.append({"document_id": document_id, "label": labels[label_id], "text": document.entity_text(index), "start": start, "end": end,
+                             "page": document.page_of(start)})
+        for index, (start, end) in enumerate(zip(document.sent_starts, document.sent_ends)):
+            sentences.append({"document_id": document_id, "text": document.sentence(index), "start": start, "end": end,
+                              "page": document.page_of(start)})
+    else:
+        # Payloads saved before the compact format have no offsets
+        for entity in structured.get("entities") or []:
+            entities.append({"document_id": document_id, "label": entity.get("label"), "text": entity.get("text"), "start": None, "end": None,
+                             "page": None})
+        for sentence in structured.get("sentences") or []:
+            sentences.append({"document_id": document_id, "text": sentence, "start": None, "end": None, "page": None})
+
+    documents = [{
+        "id": document_id,
+        "filename": stored.get("filename"),
+        "date": stored.get("date"),
+        "template": (result.get("options") or {}).get("template"),
+        "word_count": analytics.get("word_count"),
+        "sentence_count": analytics.get("sentence_count"),
+        "entity_count": analytics.get("entity_count"),
+        "keyword_count": analytics.get("keyword_count"),
+        "average_sentence_length": analytics.get("average_sentence_length"),
+        "keywords": list(keywords) if isinstance(keywords, list) else None,
+        "text": result.get("extracted_text"),
+    }]
+    partition = (stored.get("date") or "unknown")[:10]
+    return partition, {"documents": documents, "entities": entities, "sentences": sentences}
+
+
+class _ShardWriter:
+    # Buffers rows per (table, partition) and writes numbered shards under
+    # <output>/<table>/saved_on=<partition>/. A buffer is written as one shard
+    # once it reaches shard_bytes, or earlier (largest first) when all buffers
+    # together exceed max_buffered_bytes.
+    def __init__(self, output_dir, export_format, shard_bytes, max_buffered_bytes):
+        self.output_dir = output_dir
+        self.export_format = export_format
+        self.shard_bytes = shard_bytes
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffers = {}
+        self.buffer_bytes = {}
+        self.buffered = 0
+        self.shards = {}
+        self.files = []
+
+    def add(self, table, partition, rows):
+        if not rows:
+            return
+        key = (table, partition)
+        size = sum(map(row_bytes, rows))
+        self.buffers.setdefault(key, []).extend(rows)
+        self.buffer_bytes[key] = self.buffer_bytes.get(key, 0) + size
+        self.buffered += size
+        if self.buffer_bytes[key] >= self.shard_bytes:
+            self.flush(table, partition)
+        while self.buffered > self.max_buffered_bytes:
+            self.flush(*max(self.buffer_bytes, key=self.buffer_bytes.get))
+
+    def flush(self, table, partition):
+        rows = self.buffers.pop((table, partition), None)
+        self.buffered -= self.buffer_bytes.pop((table, partition), 0)
+        if rows:
+            self._write(table, partition, rows)
+
+    def close(self):
+        for table, partition in list(self.buffers):
+            self.flush(table, partition)
+
+    def _write(self, table, partition, rows):
+        shard = self.shards.get((table, partition), 0)
+        self.shards[(table, partition)] = shard + 1
+        directory = os.path.join(self.output_dir, table, f"saved_on={partition}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{shard:05d}.{self.export_format}")
+        with timed(f"corpus_export.write_{self.export_format}"):
+            if self.export_format == "parquet":
+                pq.write_table(pa.Table.from_pylist(rows, schema=_arrow_schema(table)), path, compression="zstd")
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+                        f.write("\n")
+        self.files.append(path)
+
+
+def export_corpus(output_dir, export_format="parquet", workers=4, shard_bytes=SHARD_BYTES,
+                  max_buffered_bytes=MAX_BUFFERED_BYTES):
+    """Writes all saved documents to ``output_dir`` and returns a summary.
+
+    Documents are read and parsed by ``workers`` threads and streamed into
+    date-partitioned shards of about ``shard_bytes`` each; memory use is
+    bounded by ``max_buffered_bytes`` (estimated from the row texts) rather
+    than by the size of the store.
+    """
+    if export_format not in CORPUS_FORMATS:
+        raise ValueError(f"Unsupported corpus export format: {export_format}")
+    if export_format == "parquet" and not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow is required for Parquet output. Install it with 'pip install pyarrow'.")
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        raise ValueError(f"Output directory '{output_dir}' is not empty.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    writer = _ShardWriter(output_dir, export_format, shard_bytes, max_buffered_bytes)
+    counts = dict.fromkeys(TABLES, 0)
+    failures = []
+
+    def parse(stored):
+        try:
+            return document_rows(stored)
+        except Exception as e:
+            logger.error(f"Skipping document '{stored.get('id')}' in corpus export: {e}")
+            failures.append(stored.get("id"))
+            return None
+
+    with timed("corpus_export"):
+        for parsed in iter_saved_documents(parse, workers):
+            if parsed is None:
+                continue
+            partition, tables = parsed
+            for table, rows in tables.items():
+                writer.add(table, partition, rows)
+                counts[table] += len(rows)
+        writer.close()
+    increment("corpus_export.documents", counts["documents"])
+    logger.info(f"Exported {counts['documents']} documents to '{output_dir}' as {export_format}.")
+    return {"output_dir": output_dir, "format": export_format, "rows": counts, "files": len(writer.files), "failures": failures}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export all saved documents as one partitioned dataset.")
+    parser.add_argument("--output", required=True, help="Output directory; must be empty or missing.")
+    parser.add_argument("--format", choices=CORPUS_FORMATS, default="parquet" if PARQUET_AVAILABLE else "jsonl")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel document readers.")
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES // (1024 * 1024), help="Approximate shard size in MB.")
+    parser.add_argument("--storage-dir", default=None, help="Document store to export (default: local_storage).")
+    args = parser.parse_args(argv)
+
+    if args.storage_dir:
+        import database
+        database.STORAGE_DIR = args.storage_dir
+    summary = export_corpus(args.output, args.format, args.workers, args.shard_mb * 1024 * 1024)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,59 @@
 
 import json
 import os
+import sqlite3
 from datetime import datetime
 import uuid
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from metrics import timed, increment
+from compact import pack_result, stored_page_spans
+from dedup import MinHashIndex, text_fingerprint
+from entity_index import EntityIndex, document_entity_counts
+from index_store import IndexStore
+from keywords import DocumentFrequencies, stored_terms
+from pages import join_pages, page_span, page_starts, split_pages
+from storage import create_backend
 
 # Configure logging for the module
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 STORAGE_DIR = "local_storage"
+INDEX_DIR = "indexes"
+# Where documents are stored; see storage.py
+STORAGE_BACKEND = os.environ.get("TRANSFORMO_STORAGE", "filesystem")
+
+# Serializes updates of the in-memory indexes across threads; the index store serializes its writes across processes
+_index_lock = threading.RLock()
+_index_store = None
+
+_backend = None
+_backend_key = None
+_backend_lock = threading.Lock()
 
 def ensure_storage_dir():
     if not os.path.exists(STORAGE_DIR):
         os.makedirs(STORAGE_DIR)
         logger.info(f"Created storage directory at '{STORAGE_DIR}'.")
 
+def get_backend():
+    # Created on first use and again whenever STORAGE_DIR or STORAGE_BACKEND is changed (e.g. by a worker or benchmark)
+    global _backend, _backend_key
+    key = (STORAGE_BACKEND, STORAGE_DIR)
+    with _backend_lock:
+        if _backend_key != key:
+            if _backend is not None:
+                _backend.close()
+            ensure_storage_dir()
+            _backend = create_backend(STORAGE_BACKEND, STORAGE_DIR)
+            _backend_key = key
+            logger.info(f"Using {STORAGE_BACKEND} storage.")
+        return _backend
+
 def save_to_database(data, filename):
     ensure_storage_dir()
     logger.info(f"Saving document '{filename}' to database.")
@@ -27,46 +65,296 @@ def save_to_database(data, filename):
         logger.error(f"Failed to generate document ID: {e}")
         raise Exception(f"Failed to generate document ID: {e}")
     try:
-        save_data = {
-            "id": document_id,
-            "filename": filename,
-            "date": datetime.now().isoformat(),
-            "data": json.dumps(data)  # Store data as-is (assuming it's serializable)
-        }
-        file_path = os.path.join(STORAGE_DIR, f"{document_id}.json")
-        with open(file_path, "w") as f:
-            json.dump(save_data, f, indent=4)
+        with timed("storage.serialize"):
+            packed = pack_result(data)
+            # The text is stored page by page next to the payload (see load_payload and get_document_page)
+            text = packed.get("extracted_text")
+            pages = split_pages(text) if isinstance(text, str) else None
+            # The duplicate fingerprint only feeds the index below
+            payload = {key: value for key, value in packed.items() if key != "fingerprint" and (key != "extracted_text" or pages is None)}
+            if pages is not None:
+                payload["page_count"] = len(pages)
+            save_data = {
+                "id": document_id,
+                "filename": filename,
+                "date": datetime.now().isoformat(),
+                "data": json.dumps(payload),  # Entities/sentences are stored as offsets into the text
+                "pages": pages,
+            }
+        with timed("storage.write"):
+            written = get_backend().save(save_data)
+        increment("storage.documents_saved")
+        increment("storage.bytes_written", written)
         logger.info(f"Document '{filename}' saved with ID '{document_id}'.")
-        return document_id
     except Exception as e:
         logger.error(f"Failed to save document '{filename}': {e}")
         raise Exception(f"Failed to save document: {e}")
+    _index_saved_document(document_id, filename, save_data["date"], packed)
+    return document_id
+
+def get_document(document_id):
+    try:
+        with timed("storage.read"):
+            document = get_backend().get(document_id)
+    except Exception as e:
+        logger.error(f"Failed to read document '{document_id}': {e}")
+        raise Exception(f"Failed to read document: {e}")
+    if document is None:
+        logger.warning(f"Attempted to read non-existent document ID '{document_id}'.")
+        raise Exception("Document not found.")
+    return document
+
+def load_payload(document):
+    """Stored payload of a saved document with its extracted text.
+
+    The text is reassembled from the page store; documents saved before
+    pages were stored separately keep it in the payload.
+    """
+    packed = json.loads(document["data"])
+    if "extracted_text" not in packed and "page_count" in packed:
+        with timed("storage.read_pages"):
+            packed["extracted_text"] = join_pages(get_backend().get_pages(document["id"]))
+    return packed
+
+def get_document_page(document_id, number):
+    """One page of a saved document with the entities and sentences that start on it.
+
+    Only that page is read from the page store. Entity and sentence offsets
+    refer to the whole text, and ``start`` is where the page begins in it.
+    """
+    packed = json.loads(get_document(document_id)["data"])
+    rows = packed.get("compact")
+    if "extracted_text" in packed:
+        text = packed["extracted_text"]
+        starts = page_starts(text)
+        start, end = page_span(starts, number, len(text))
+        page_text = text[start:end]
+    else:
+        starts = rows["pages"] if rows and "pages" in rows else [0]
+        with timed("storage.read_page"):
+            page_text = get_backend().get_page(document_id, number)
+        if page_text is None:
+            raise Exception(f"Page {number} of document '{document_id}' not found.")
+        start = starts[number - 1]
+    entities, sentences = stored_page_spans(rows, page_text, start, number) if rows else ([], [])
+    return {
+        "page": number,
+        "page_count": packed.get("page_count", len(starts)),
+        "start": start,
+        "text": page_text,
+        "entities": entities,
+        "sentences": sentences,
+    }
 
 def get_saved_documents():
-    ensure_storage_dir()
-    documents = []
-    for filename in os.listdir(STORAGE_DIR):
-        if filename.endswith(".json"):
-            file_path = os.path.join(STORAGE_DIR, filename)
-            try:
-                with open(file_path, "r") as f:
-                    documents.append(json.load(f))
-            except json.JSONDecodeError:
-                logger.warning(f"Corrupted file detected and skipped: {filename}")
-            except Exception as e:
-                logger.error(f"Error reading file '{filename}': {e}")
+    with timed("storage.read_all"):
+        documents = get_backend().list()
+    increment("storage.documents_read", len(documents))
     return documents
 
+def get_document_metadata():
+    # id, filename and date of every saved document; no payload is read
+    with timed("storage.list_metadata"):
+        return get_backend().list_metadata()
+
+def iter_saved_documents(transform=None, workers=4):
+    """Yields saved documents one at a time, read by a pool of threads.
+
+    ``transform`` (e.g. a payload parser) also runs in the readers. At most
+    ``2 * workers`` documents are in flight, so memory stays bounded however
+    large the store is.
+    """
+    backend = get_backend()
+
+    def read(handle):
+        document = backend.load(handle)
+        return document if document is None or transform is None else transform(document)
+
+    handles = backend.iter_handles()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(executor.submit(read, handle) for handle in islice(handles, 2 * workers))
+        while pending:
+            document = pending.popleft().result()
+            for handle in islice(handles, 1):
+                pending.append(executor.submit(read, handle))
+            if document is not None:
+                increment("storage.documents_read")
+                yield document
+
 def delete_document(document_id):
-    file_path = os.path.join(STORAGE_DIR, f"{document_id}.json")
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            logger.info(f"Document with ID '{document_id}' deleted successfully.")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to delete document '{document_id}': {e}")
-            raise Exception(f"Failed to delete document: {e}")
-    else:
+    try:
+        with timed("storage.delete"):
+            deleted = get_backend().delete(document_id)
+    except Exception as e:
+        logger.error(f"Failed to delete document '{document_id}': {e}")
+        raise Exception(f"Failed to delete document: {e}")
+    if not deleted:
         logger.warning(f"Attempted to delete non-existent document ID '{document_id}'.")
         raise Exception("Document not found.")
+    increment("storage.documents_deleted")
+    logger.info(f"Document with ID '{document_id}' deleted successfully.")
+    _unindex_deleted_document(document_id)
+    return True
+
+# The index store lives in a subdirectory so get_saved_documents never reads it as a document
+def _index_store_path():
+    if STORAGE_BACKEND == "filesystem":
+        return os.path.join(STORAGE_DIR, INDEX_DIR, "indexes.db")
+    # Each backend holds different documents, so each has its own indexes
+    return os.path.join(STORAGE_DIR, INDEX_DIR, STORAGE_BACKEND, "indexes.db")
+
+def get_index_store():
+    # Opened on first use and again whenever STORAGE_DIR or STORAGE_BACKEND is changed, like get_backend
+    global _index_store
+    path = _index_store_path()
+    with _index_lock:
+        if _index_store is None or _index_store.path != path:
+            if _index_store is not None:
+                _index_store.close()
+            ensure_storage_dir()
+            try:
+                _index_store = IndexStore(path)
+            except sqlite3.DatabaseError:
+                logger.warning(f"Corrupted index store '{path}' detected; it will be rebuilt.")
+                os.remove(path)
+                _index_store = IndexStore(path)
+        return _index_store
+
+def _load_index(name, factory, rebuild):
+    # Loaded once per process, then kept current with the changes other processes write
+    with _index_lock:
+        return get_index_store().get(name, factory, rebuild)
+
+def _store_entry(name, index, document_id):
+    # Writes only this document's entry (or its removal), never the whole index
+    with timed("storage.index_write"):
+        get_index_store().put(name, document_id, index.documents.get(document_id))
+
+def _stored_payloads(with_text=False):
+    for document in get_saved_documents():
+        try:
+            yield document, load_payload(document) if with_text else json.loads(document["data"])
+        except (KeyError, TypeError, json.JSONDecodeError):
+            logger.warning(f"Skipping unreadable payload of document '{document.get('id')}'.")
+
+def result_fingerprint(packed):
+    # The fingerprint computed where the text was extracted (see batch.process_file), or computed now from the text
+    fingerprint = packed.get("fingerprint")
+    if fingerprint is None and isinstance(packed.get("extracted_text"), str):
+        fingerprint = text_fingerprint(packed["extracted_text"])
+    return fingerprint
+
+def _rebuild_minhash_index():
+    index = MinHashIndex()
+    for document, payload in _stored_payloads(with_text=True):
+        fingerprint = result_fingerprint(payload)
+        if fingerprint is not None:
+            index.add(document["id"], fingerprint["digest"], fingerprint["signature"], document.get("filename"))
+    return index
+
+def _minhash_index():
+    ensure_storage_dir()
+    return _load_index("minhash", MinHashIndex, _rebuild_minhash_index)
+
+def _rebuild_entity_index():
+    index = EntityIndex()
+    for document, payload in _stored_payloads(with_text=True):
+        index.add(document["id"], document.get("filename"), document.get("date"), document_entity_counts(payload))
+    return index
+
+def _entity_index():
+    ensure_storage_dir()
+    return _load_index("entities", EntityIndex, _rebuild_entity_index)
+
+def _rebuild_keyword_index():
+    frequencies = DocumentFrequencies()
+    for document, payload in _stored_payloads():
+        frequencies.add(document["id"], stored_terms(payload))
+    return frequencies
+
+def _keyword_index():
+    ensure_storage_dir()
+    return _load_index("keywords", DocumentFrequencies, _rebuild_keyword_index)
+
+def _index_saved_document(document_id, filename, date, packed):
+    # Index maintenance never fails a save; a broken index is rebuilt on next load
+    with _index_lock:
+        try:
+            fingerprint = result_fingerprint(packed)
+            if fingerprint is not None:
+                index = _minhash_index()
+                index.add(document_id, fingerprint["digest"], fingerprint["signature"], filename)
+                _store_entry("minhash", index, document_id)
+        except Exception as e:
+            logger.error(f"Failed to add document '{document_id}' to the duplicate index: {e}")
+        try:
+            with timed("storage.entity_index"):
+                index = _entity_index()
+                index.add(document_id, filename, date, document_entity_counts(packed))
+                _store_entry("entities", index, document_id)
+        except Exception as e:
+            logger.error(f"Failed to add document '{document_id}' to the entity index: {e}")
+        try:
+            index = _keyword_index()
+            index.add(document_id, stored_terms(packed))
+            _store_entry("keywords", index, document_id)
+        except Exception as e:
+            logger.error(f"Failed to add document '{document_id}' to the keyword index: {e}")
+
+def _unindex_deleted_document(document_id):
+    with _index_lock:
+        for name, load in (("minhash", _minhash_index), ("entities", _entity_index), ("keywords", _keyword_index)):
+            try:
+                index = load()
+                if index.remove(document_id):
+                    _store_entry(name, index, document_id)
+            except Exception as e:
+                logger.error(f"Failed to remove document '{document_id}' from the '{name}' index: {e}")
+
+def keyword_frequencies():
+    """Keyword document frequencies over all saved documents, for TF-IDF ranking.
+
+    Kept up to date by save_to_database/delete_document.
+    """
+    with _index_lock:
+        return _keyword_index()
+
+def find_duplicates(text=None, fingerprint=None):
+    """Saved documents whose text is identical or nearly identical to ``text``.
+
+    Runs on the extracted text before any NLP, using the MinHash/LSH index.
+    Pass the ``fingerprint`` of a processed result instead of its text to
+    skip computing the signature again.
+    """
+    with timed("dedup.lookup"):
+        if fingerprint is None:
+            fingerprint = text_fingerprint(text)
+        with _index_lock:
+            return _minhash_index().query(fingerprint["digest"], fingerprint["signature"])
+
+def load_duplicate_result(duplicates, options):
+    # Stored payload of the first exact duplicate processed with the same options, as (match, payload)
+    for match in duplicates:
+        if not match["exact"]:
+            continue
+        try:
+            packed = load_payload(get_document(match["id"]))
+        except Exception:
+            continue
+        # Partial results (processing stopped after extraction) are never reused
+        if packed.get("options") == options and not packed.get("partial"):
+            return match, packed
+    return None
+
+def dedup_report():
+    with _index_lock:
+        return _minhash_index().report()
+
+def corpus_entity_index():
+    """Entity postings over all saved documents, for corpus-level queries.
+
+    Kept up to date by save_to_database/delete_document, so queries never
+    read the stored payloads.
+    """
+    with _index_lock:
+        return _entity_index()
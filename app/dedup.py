@@ -0,0 +1,176 @@
+# dedup.py
+
+import hashlib
+import re
+import zlib
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_CHUNK = 1 << 15
+_WORD = re.compile(r'\w+')
+
+# Fixed seed: signatures are persisted, so the permutations must never change
+_rng = np.random.RandomState(20240927)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+
+def _normalized_words(text):
+    return _WORD.findall(text.lower())
+
+
+def text_digest(text):
+    # Exact-duplicate key; insensitive to case, whitespace and punctuation differences
+    return hashlib.blake2b(" ".join(_normalized_words(text)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _shingle_hashes(words):
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    word_hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64, count=len(words))
+    if len(words) < SHINGLE_SIZE:
+        return np.unique(word_hashes)
+    # Polynomial rolling combination of SHINGLE_SIZE consecutive word hashes, truncated to 32 bits
+    count = len(words) - SHINGLE_SIZE + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        shingles = (shingles * np.uint64(1000003) + word_hashes[offset:offset + count]) & _MAX_HASH
+    return np.unique(shingles)
+
+
+def minhash_signature(text):
+    """MinHash signature (NUM_PERM 32-bit values) over word 5-gram shingles.
+
+    Computed once per document, in the worker that extracts the text, and
+    carried with the result as its fingerprint (see text_fingerprint).
+    """
+    shingles = _shingle_hashes(_normalized_words(text))
+    signature = np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    # (a * x + b) mod p over shingle chunks keeps the working matrix small
+    for start in range(0, len(shingles), _CHUNK):
+        chunk = shingles[start:start + _CHUNK]
+        hashed = (np.outer(chunk, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+        np.minimum(signature, hashed.min(axis=0), out=signature)
+    return tuple(int(value) for value in signature)
+
+
+def text_fingerprint(text):
+    # What the duplicate index keeps per document; JSON-serializable so it travels in the packed result
+    return {"digest": text_digest(text), "signature": list(minhash_signature(text))}
+
+
+def estimate_similarity(signature_a, signature_b):
+    # Fraction of agreeing MinHash values estimates the Jaccard similarity of the shingle sets
+    return float(np.mean(np.asarray(signature_a) == np.asarray(signature_b)))
+
+
+def _band_keys(signature):
+    return [f"{band}:{hash(tuple(signature[band * ROWS:(band + 1) * ROWS])) & 0xFFFFFFFFFFFF:x}" for band in range(BANDS)]
+
+
+class MinHashIndex:
+    """LSH index over document signatures.
+
+    A query only compares against documents sharing at least one band bucket
+    (and documents with the same exact digest), so lookups stay sub-linear as
+    the store grows.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.buckets = {}
+        self.digests = {}
+
+    def add(self, document_id, digest, signature, filename=None):
+        self.remove(document_id)
+        self.documents[document_id] = {"digest": digest, "signature": list(signature), "filename": filename}
+        self.digests.setdefault(digest, []).append(document_id)
+        for key in _band_keys(signature):
+            self.buckets.setdefault(key, []).append(document_id)
+
+    def add_entry(self, document_id, entry):
+        # Entries computed with other MinHash parameters cannot be compared and are left out
+        if len(entry["signature"]) == NUM_PERM:
+            self.add(document_id, entry["digest"], entry["signature"], entry.get("filename"))
+
+    def remove(self, document_id):
+        entry = self.documents.pop(document_id, None)
+        if entry is None:
+            return False
+        for mapping, keys in ((self.digests, [entry["digest"]]), (self.buckets, _band_keys(entry["signature"]))):
+            for key in keys:
+                ids = mapping.get(key, [])
+                if document_id in ids:
+                    ids.remove(document_id)
+                if not ids:
+                    mapping.pop(key, None)
+        return True
+
+    def query(self, digest, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+        # Returns [{"id", "filename", "similarity", "exact"}], best match first
+        exact = set(self.digests.get(digest, []))
+        candidates = set(exact)
+        for key in _band_keys(signature):
+            candidates.update(self.buckets.get(key, []))
+
+        matches = []
+        for document_id in candidates:
+            entry = self.documents[document_id]
+            similarity = 1.0 if document_id in exact else estimate_similarity(signature, entry["signature"])
+            if similarity >= threshold:
+                matches.append({
+                    "id": document_id,
+                    "filename": entry["filename"],
+                    "similarity": round(similarity, 3),
+                    "exact": document_id in exact,
+                })
+        return sorted(matches, key=lambda match: (not match["exact"], -match["similarity"]))
+
+    def report(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        # Groups of exact / near-duplicate documents, found through shared buckets only
+        parent = {}
+
+        def find(document_id):
+            while parent.get(document_id, document_id) != document_id:
+                document_id = parent[document_id]
+            return document_id
+
+        def union(a, b):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+        for ids in self.digests.values():
+            for other in ids[1:]:
+                union(ids[0], other)
+        checked = set()
+        for ids in self.buckets.values():
+            for i, a in enumerate(ids):
+                for b in ids[i + 1:]:
+                    pair = (a, b) if a < b else (b, a)
+                    if pair in checked or find(a) == find(b):
+                        continue
+                    checked.add(pair)
+                    if estimate_similarity(self.documents[a]["signature"], self.documents[b]["signature"]) >= threshold:
+                        union(a, b)
+
+        groups = {}
+        for document_id in self.documents:
+            groups.setdefault(find(document_id), []).append(document_id)
+        report = []
+        for ids in groups.values():
+            if len(ids) < 2:
+                continue
+            digests = {self.documents[document_id]["digest"] for document_id in ids}
+            report.append({
+                "documents": [{"id": document_id, "filename": self.documents[document_id]["filename"]} for document_id in ids],
+                "exact": len(digests) == 1,
+            })
+        return sorted(report, key=lambda group: -len(group["documents"]))
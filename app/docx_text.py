@@ -0,0 +1,175 @@
+# docx_text.py
+#
+# Word extraction. The document body is walked once, in order, yielding one
+# block per paragraph and per table row; table cells are tab-separated and
+# tables are set off by blank lines. Headers come first and footers last,
+# each distinct header/footer once even if several sections share it.
+#
+# Page boundaries become pages.PAGE_BREAK. Word records where pages began
+# when the file was last laid out (lastRenderedPageBreak); files never laid
+# out by Word only have their explicit page breaks.
+#
+# Legacy .doc files are converted with LibreOffice (soffice) when it is
+# installed, otherwise read with antiword.
+
+import os
+import shutil
+import subprocess
+import tempfile
+from docx import Document
+from docx.oxml.ns import qn
+from metrics import timed
+from pages import PAGE_BREAK
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONVERT_TIMEOUT = int(os.environ.get("TRANSFORMO_CONVERT_TIMEOUT", "120"))
+
+_P = qn("w:p")
+_TBL = qn("w:tbl")
+_TR = qn("w:tr")
+_TC = qn("w:tc")
+_SDT = qn("w:sdt")
+_SDT_CONTENT = qn("w:sdtContent")
+_T = qn("w:t")
+_TAB = qn("w:tab")
+_BR = qn("w:br")
+_CR = qn("w:cr")
+_TYPE = qn("w:type")
+_RENDERED_BREAK = qn("w:lastRenderedPageBreak")
+_V_MERGE = qn("w:vMerge")
+_VAL = qn("w:val")
+
+
+def _paragraph_text(p, rendered_breaks):
+    # Same text as python-docx's Paragraph.text without building run objects, plus page breaks
+    parts = []
+    for element in p.iter(_T, _TAB, _BR, _CR, _RENDERED_BREAK):
+        if element.tag == _T:
+            parts.append(element.text or "")
+        elif element.tag == _TAB:
+            parts.append("\t")
+        elif element.tag == _RENDERED_BREAK:
+            if rendered_breaks:
+                parts.append(PAGE_BREAK)
+        elif element.tag == _BR and element.get(_TYPE) == "page":
+            if not rendered_breaks:
+                parts.append(PAGE_BREAK)
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _cell_text(tc, rendered_breaks):
+    # Page breaks inside a table are dropped with its other line structure
+    text = " ".join(block for block in _iter_blocks(tc, rendered_breaks) if block)
+    return text.replace("\t", " ").replace("\n", " ").replace(PAGE_BREAK, " ")
+
+
+def _is_merge_continuation(tc):
+    # A vertically merged cell repeats the text of the cell above; it is left empty
+    tc_pr = tc.tcPr
+    if tc_pr is None:
+        return False
+    v_merge = tc_pr.find(_V_MERGE)
+    return v_merge is not None and v_merge.get(_VAL) in (None, "continue")
+
+
+def _iter_table(tbl, rendered_breaks):
+    yield ""
+    for tr in tbl.iterchildren(_TR):
+        cells = ["" if _is_merge_continuation(tc) else _cell_text(tc, rendered_breaks) for tc in tr.iterchildren(_TC)]
+        if any(cells):
+            yield "\t".join(cells)
+    yield ""
+
+
+def _iter_blocks(container, rendered_breaks=False):
+    for child in container.iterchildren():
+        if child.tag == _P:
+            yield _paragraph_text(child, rendered_breaks)
+        elif child.tag == _TBL:
+            yield from _iter_table(child, rendered_breaks)
+        elif child.tag == _SDT:
+            # Content controls wrap ordinary paragraphs and tables
+            content = child.find(_SDT_CONTENT)
+            if content is not None:
+                yield from _iter_blocks(content, rendered_breaks)
+
+
+def _iter_header_footer(document, kind):
+    seen = set()
+    for section in document.sections:
+        for part in (section.first_page_header, section.header, section.even_page_header) if kind == "header" else \
+                (section.first_page_footer, section.footer, section.even_page_footer):
+            if part.is_linked_to_previous:
+                continue
+            element = part._element
+            if id(element) in seen:
+                continue
+            seen.add(id(element))
+            yield from _iter_blocks(element)
+
+
+def iter_docx_blocks(document):
+    """Text blocks of a python-docx Document in reading order."""
+    body = document.element.body
+    rendered_breaks = next(body.iter(_RENDERED_BREAK), None) is not None
+    yield from _iter_header_footer(document, "header")
+    yield from _iter_blocks(body, rendered_breaks)
+    yield from _iter_header_footer(document, "footer")
+
+
+def docx_text(stream):
+    lines = []
+    for block in iter_docx_blocks(Document(stream)):
+        # Collapse runs of blank lines left by empty paragraphs and table boundaries
+        if block or (lines and lines[-1]):
+            lines.append(block)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def doc_converter():
+    # Name of the available legacy .doc converter, or None
+    for name in ("soffice", "libreoffice", "antiword"):
+        if shutil.which(name):
+            return name
+    return None
+
+
+def doc_text(upload):
+    """Text of a legacy .doc upload, converted with a local tool."""
+    converter = doc_converter()
+    if converter is None:
+        raise ValueError("Legacy .doc files need LibreOffice (soffice) or antiword installed.")
+
+    with tempfile.TemporaryDirectory(prefix="transformo-doc-") as workdir:
+        path = upload.path
+        if path is None:
+            path = os.path.join(workdir, "input.doc")
+            with upload.stream() as source, open(path, "wb") as target:
+                shutil.copyfileobj(source, target)
+
+        with timed(f"extract.doc.{converter}"):
+            if converter == "antiword":
+                completed = subprocess.run([shutil.which(converter), "-m", "UTF-8.txt", "-w", "0", path], capture_output=True,
+                                           timeout=CONVERT_TIMEOUT)
+                if completed.returncode != 0:
+                    raise ValueError(f"antiword could not read '{upload.name}': {completed.stderr.decode(errors='replace').strip()}")
+                return completed.stdout.decode("utf-8", errors="replace").strip()
+
+            # A private profile directory lets conversions run alongside a user's LibreOffice session
+            profile = "file://" + os.path.join(workdir, "profile")
+            completed = subprocess.run(
+                [shutil.which(converter), f"-env:UserInstallation={profile}", "--headless", "--convert-to", "docx",
+                 "--outdir", workdir, path],
+                capture_output=True, timeout=CONVERT_TIMEOUT,
+            )
+            converted = os.path.join(workdir, os.path.splitext(os.path.basename(path))[0] + ".docx")
+            if completed.returncode != 0 or not os.path.exists(converted):
+                raise ValueError(f"{converter} could not convert '{upload.name}': {completed.stderr.decode(errors='replace').strip()}")
+        with open(converted, "rb") as f:
+            return docx_text(f)
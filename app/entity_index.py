@@ -0,0 +1,134 @@
+# entity_index.py
+
+from collections import Counter
+from compact import unpack_result
+
+
+def _entity_key(text):
+    return " ".join(text.split())
+
+
+def document_entity_counts(packed):
+    """(label, entity text) -> mention count for a stored payload.
+
+    Reads the compact offset rows directly, so the entity list is never
+    materialized as dicts.
+    """
+    document = unpack_result(packed).get("document")
+    counts = Counter()
+    if document is not None:
+        for index, label_id in enumerate(document.ent_labels):
+            text = _entity_key(document.entity_text(index))
+            if text:
+                counts[(document.labels[label_id], text)] += 1
+    else:
+        # Payloads saved before the compact format keep a plain entity list
+        entities = packed.get("structured_data", {}).get("entities", [])
+        for entity in entities if isinstance(entities, list) else []:
+            text = _entity_key(entity.get("text", ""))
+            if text:
+                counts[(entity.get("label"), text)] += 1
+    return counts
+
+
+class EntityIndex:
+    """Entity -> document postings for the whole store.
+
+    ``postings[label][text]`` maps document ids to mention counts and
+    ``totals[label][text]`` keeps the corpus-wide sum, so corpus queries only
+    touch the entries they return. Each document keeps its own entity list so
+    a delete removes exactly what the save added.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.totals = {}
+        self.documents = {}
+
+    def add(self, document_id, filename, date, counts):
+        self.remove(document_id)
+        entities = []
+        for (label, text), count in counts.items():
+            self.postings.setdefault(label, {}).setdefault(text, {})[document_id] = count
+            totals = self.totals.setdefault(label, {})
+            totals[text] = totals.get(text, 0) + count
+            entities.append([label, text, count])
+        self.documents[document_id] = {"filename": filename, "date": date, "entities": entities}
+
+    def add_entry(self, document_id, entry):
+        # Only the per-document list is persisted; postings and totals are rebuilt from it
+        counts = {(label, text): count for label, text, count in entry["entities"]}
+        self.add(document_id, entry.get("filename"), entry.get("date"), counts)
+
+    def remove(self, document_id):
+        entry = self.documents.pop(document_id, None)
+        if entry is None:
+            return False
+        for label, text, count in entry["entities"]:
+            postings = self.postings[label]
+            postings[text].pop(document_id, None)
+            if not postings[text]:
+                del postings[text]
+            totals = self.totals[label]
+            totals[text] -= count
+            if totals[text] <= 0:
+                del totals[text]
+            if not postings:
+                del self.postings[label]
+                del self.totals[label]
+        return True
+
+    def labels(self):
+        return sorted(self.postings)
+
+    def label_summary(self):
+        # Per label: distinct entities, mentions and documents mentioning any of them
+        summary = []
+        for label in self.labels():
+            documents = set()
+            for ids in self.postings[label].values():
+                documents.update(ids)
+            summary.append({
+                "label": label,
+                "entities": len(self.postings[label]),
+                "mentions": sum(self.totals[label].values()),
+                "documents": len(documents),
+            })
+        return summary
+
+    def top_entities(self, label=None, limit=10):
+        labels = [label] if label else self.labels()
+        rows = [
+            {"label": name, "text": text, "mentions": mentions, "documents": len(self.postings[name][text])}
+            for name in labels
+            for text, mentions in self.totals.get(name, {}).items()
+        ]
+        return sorted(rows, key=lambda row: (-row["mentions"], -row["documents"], row["text"]))[:limit]
+
+    def documents_mentioning(self, text, label=None):
+        text = _entity_key(text)
+        labels = [label] if label else self.labels()
+        mentions = Counter()
+        for name in labels:
+            mentions.update(self.postings.get(name, {}).get(text, {}))
+        return [
+            {
+                "id": document_id,
+                "filename": self.documents[document_id]["filename"],
+                "date": self.documents[document_id]["date"],
+                "mentions": count,
+            }
+            for document_id, count in mentions.most_common()
+        ]
+
+    def search(self, query, label=None, limit=20):
+        # Case-insensitive substring match over entity texts
+        query = _entity_key(query).lower()
+        labels = [label] if label else self.labels()
+        rows = [
+            {"label": name, "text": text, "mentions": mentions, "documents": len(self.postings[name][text])}
+            for name in labels
+            for text, mentions in self.totals.get(name, {}).items()
+            if query in text.lower()
+        ]
+        return sorted(rows, key=lambda row: -row["mentions"])[:limit]
@@ -0,0 +1,258 @@
+# exporter.py
+
+import json
+import os
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from urllib.parse import quote
+import logging
+from compact import SpanList
+from formats import BINARY_FORMATS, iter_jsonl, write_binary
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CHARS = 64 * 1024
+PREVIEW_CHARS = 20000
+MAX_EXPORTS = 32
+
+EXPORT_FORMATS = {
+    "json": "application/json",
+    "xml": "application/xml",
+    "jsonl": "application/x-ndjson",
+}
+
+_encode_scalar = json.JSONEncoder(ensure_ascii=False).encode
+_lock = threading.Lock()
+_exports = OrderedDict()
+_server = None
+
+
+def _iter_json(value, indent, level):
+    if isinstance(value, dict):
+        if not value:
+            yield "{}"
+            return
+        inner = "\n" + " " * (indent * (level + 1))
+        yield "{"
+        separator = inner
+        for key, item in value.items():
+            yield separator
+            yield _encode_scalar(key if isinstance(key, str) else str(key))
+            yield ": "
+            yield from _iter_json(item, indent, level + 1)
+            separator = "," + inner
+        yield "\n" + " " * (indent * level) + "}"
+    elif isinstance(value, (list, tuple, SpanList)):
+        # SpanList items are materialized one at a time while writing
+        if not len(value):
+            yield "[]"
+            return
+        inner = "\n" + " " * (indent * (level + 1))
+        yield "["
+        separator = inner
+        for item in value:
+            yield separator
+            yield from _iter_json(item, indent, level + 1)
+            separator = "," + inner
+        yield "\n" + " " * (indent * level) + "]"
+    else:
+        yield _encode_scalar(value)
+
+
+def _escape_xml(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _iter_xml_element(tag, value, level):
+    pad = "  " * level
+    if isinstance(value, dict):
+        if not value:
+            yield f"{pad}<{tag}/>\n"
+            return
+        yield f"{pad}<{tag}>\n"
+        for key, item in value.items():
+            yield from _iter_xml_element(key, item, level + 1)
+        yield f"{pad}</{tag}>\n"
+    elif isinstance(value, (list, SpanList)):
+        if not len(value):
+            yield f"{pad}<{tag}/>\n"
+            return
+        yield f"{pad}<{tag}>\n"
+        for item in value:
+            yield from _iter_xml_element("item", item if isinstance(item, dict) else str(item), level + 1)
+        yield f"{pad}</{tag}>\n"
+    else:
+        text = str(value)
+        yield f"{pad}<{tag}>{_escape_xml(text)}</{tag}>\n" if text else f"{pad}<{tag}/>\n"
+
+
+def _chunked(pieces, size):
+    # Joins small pieces into chunks of roughly ``size`` characters
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def iter_json(data, indent=2, chunk_size=CHUNK_CHARS):
+    """Yields the JSON export of ``data`` in chunks.
+
+    The concatenated chunks equal ``json.dumps(data, indent=2, ensure_ascii=False)``.
+    """
+    return _chunked(_iter_json(data, indent, 0), chunk_size)
+
+
+def iter_xml(data, chunk_size=CHUNK_CHARS):
+    """Yields the XML export of ``data`` in chunks.
+
+    Same document layout as the ElementTree/minidom pretty printer used
+    before, written element by element.
+    """
+    return _chunked(chain(['<?xml version="1.0" ?>\n'], _iter_xml_element("document", data, 0)), chunk_size)
+
+
+def iter_export(result, export_format, chunk_size=CHUNK_CHARS):
+    data = result["structured_data"]
+    if export_format == "json":
+        return iter_json(data, chunk_size=chunk_size)
+    if export_format == "xml":
+        return iter_xml(data, chunk_size=chunk_size)
+    if export_format == "jsonl":
+        return _chunked(iter_jsonl(result), chunk_size)
+    raise ValueError(f"Unsupported export format: {export_format}")
+
+
+def export_preview(result, export_format, limit=PREVIEW_CHARS):
+    """First ``limit`` characters of an export and whether it was truncated.
+
+    Only the chunks needed for the preview are rendered.
+    """
+    preview = []
+    length = 0
+    chunks = iter_export(result, export_format, chunk_size=min(limit, CHUNK_CHARS))
+    for chunk in chunks:
+        preview.append(chunk)
+        length += len(chunk)
+        if length > limit:
+            return "".join(preview)[:limit], True
+    return "".join(preview), False
+
+
+def write_export(result, export_format, path=None):
+    # Streams an export to a file (a new temporary file by default) and returns its path
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="transformo-export-", suffix=f".{export_format}")
+        os.close(fd)
+    if export_format in BINARY_FORMATS:
+        with open(path, "wb") as f:
+            write_binary(result, export_format, f)
+        return path
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in iter_export(result, export_format):
+            f.write(chunk)
+    return path
+
+
+def iter_export_bytes(result, export_format):
+    # Encoded chunks of any export; binary formats are written to a temporary file first
+    if export_format not in BINARY_FORMATS:
+        for chunk in iter_export(result, export_format):
+            yield chunk.encode("utf-8")
+        return
+    path = write_export(result, export_format)
+    try:
+        with open(path, "rb") as f:
+            yield from iter(lambda: f.read(CHUNK_CHARS), b"")
+    finally:
+        os.remove(path)
+
+
+def export_size(result, export_format):
+    # Encoded size of an export, counted while streaming
+    size = 0
+    for chunk in iter_export(result, export_format):
+        size += len(chunk) if chunk.isascii() else len(chunk.encode("utf-8"))
+    return size
+
+
+def register_export(result, export_format, filename):
+    """Registers a result for download from the export server and returns its URL path.
+
+    The export is rendered chunk by chunk while the response is sent. Only
+    the most recent MAX_EXPORTS registrations are kept.
+    """
+    if export_format not in EXPORT_FORMATS and export_format not in BINARY_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    token = secrets.token_urlsafe(16)
+    with _lock:
+        _exports[token] = (result, export_format, filename)
+        while len(_exports) > MAX_EXPORTS:
+            _exports.popitem(last=False)
+    return f"/exports/{token}"
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        token = path[len("/exports/"):] if path.startswith("/exports/") else None
+        with _lock:
+            export = _exports.get(token)
+        if export is None:
+            self.send_error(404)
+            return
+        result, export_format, filename = export
+        self.send_response(200)
+        if export_format in BINARY_FORMATS:
+            self.send_header("Content-Type", BINARY_FORMATS[export_format])
+        else:
+            self.send_header("Content-Type", f"{EXPORT_FORMATS[export_format]}; charset=utf-8")
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for body in iter_export_bytes(result, export_format):
+                self.wfile.write(f"{len(body):X}\r\n".encode("ascii") + body + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"Export download of '{filename}' was interrupted by the client.")
+
+    def log_message(self, format, *args):
+        logger.debug("export endpoint: " + format, *args)
+
+
+def start_export_server(port=None, host="0.0.0.0"):
+    # Serves registered exports as chunked downloads when TRANSFORMO_EXPORT_PORT is set
+    global _server
+    if port is None:
+        port = os.environ.get("TRANSFORMO_EXPORT_PORT")
+        if not port:
+            return None
+    with _lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((host, int(port)), _ExportHandler)
+    thread = threading.Thread(target=_server.serve_forever, name="export-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving exports on {host}:{port}/exports")
+    return _server
+
+
+def export_url(path):
+    # TRANSFORMO_EXPORT_URL overrides the base URL when the server sits behind a proxy
+    base = os.environ.get("TRANSFORMO_EXPORT_URL")
+    if not base:
+        base = f"http://localhost:{os.environ.get('TRANSFORMO_EXPORT_PORT', '')}"
+    return base.rstrip("/") + path
@@ -1,36 +1,80 @@
 import mimetypes
 import pandas as pd
 import PyPDF2
-from docx import Document
-import io
+from docx_text import docx_text, doc_text
+from metrics import timed, increment
+from pages import join_pages
+from sniffer import sniff, check_size, check_pages
+from uploads import SpooledUpload, decode_text
+import logging
+
+logger = logging.getLogger(__name__)
+
+_FILE_KINDS = {
+    'application/pdf': 'pdf',
+    'application/msword': 'doc',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'text/plain': 'txt',
+    'application/vnd.ms-excel': 'xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
 
 def validate_document(file):
-    file_type, _ = mimetypes.guess_type(file.name)
+    with timed("validate"):
+        return _validate_document(file)
+
+def _validate_document(file):
+    # The detected type is cached on the upload so repeated validation doesn't sniff again
+    cached = getattr(file, 'detected_type', None)
+    if cached is not None:
+        return cached
+    upload = file if isinstance(file, SpooledUpload) else SpooledUpload.from_upload(file)
+    
+    check_size(upload)
+    file_type = sniff(upload)
+    if file_type is None:
+        increment("validate.rejected_type")
+        raise ValueError(f"Unsupported or unrecognized file content: {file.name}")
     
-    allowed_types = ['application/pdf', 'application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                     'text/plain', 'application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']
+    named_type, _ = mimetypes.guess_type(file.name)
+    if named_type != file_type:
+        logger.warning(f"'{file.name}' looks like {_FILE_KINDS[file_type]} content; its name suggests {named_type}.")
     
-    if file_type not in allowed_types:
-        raise ValueError(f"Unsupported file type: {file_type}")
-        
+    check_pages(upload, file_type)
+    file.detected_type = file_type
     return file_type
 
 def extract_text(file, file_type):
-    if file_type == 'application/pdf':
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    elif file_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-        doc = Document(file)
-        text = ' '.join([paragraph.text for paragraph in doc.paragraphs])
-    elif file_type == 'text/plain':
-        text = file.getvalue().decode('utf-8')
-    elif file_type in ['application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']:
-        df = pd.read_excel(file)
-        text = df.to_json()
-    else:
-        raise ValueError(f"Unsupported file type: {file_type}")
+    kind = _FILE_KINDS.get(file_type, 'unknown')
+    with timed(f"extract.{kind}"):
+        text = _extract_text(file, file_type)
+    increment(f"extract.{kind}.documents")
+    increment("extract.input_bytes", getattr(file, 'size', 0) or 0)
+    increment("extract.output_chars", len(text))
+    return text
+
+def _extract_text(file, file_type):
+    # Extractors read spooled uploads straight from disk; in-memory uploads are used without copying.
+    # Pages are separated by pages.PAGE_BREAK; text files and Word documents carry their own form feeds.
+    if not isinstance(file, SpooledUpload):
+        file = SpooledUpload.from_upload(file)
+    
+    if file_type == 'text/plain':
+        return decode_text(file)
+    if file_type == 'application/msword':
+        return doc_text(file)
+    
+    with file.stream() as stream:
+        if file_type == 'application/pdf':
+            reader = PyPDF2.PdfReader(stream)
+            text = join_pages(page.extract_text() or "" for page in reader.pages)
+        elif file_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+            text = docx_text(stream)
+        elif file_type in ['application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']:
+            df = pd.read_excel(stream)
+            text = df.to_json()
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
     
     return text
 
@@ -0,0 +1,212 @@
+# formats.py
+#
+# Compact machine-readable outputs for downstream analytics: JSON Lines
+# records, a Parquet table of entity/sentence spans and a MessagePack payload.
+
+import io
+import json
+from array import array
+from compact import SpanList, pack_result, unpack_result
+from pages import page_of
+
+# Try to import optional dependencies
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+_METADATA_KEY = b"transformo"
+_LITTLE_ENDIAN = array("I", [1]).tobytes()[0] == 1
+
+BINARY_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "msgpack": "application/msgpack",
+}
+
+
+def _header(result):
+    # Everything in the structured data except the span views, which become rows
+    fields = {key: value for key, value in result["structured_data"].items() if not isinstance(value, SpanList)}
+    return {"type": "document", "structured_data": fields, "options": result.get("options")}
+
+
+def _span_kinds(result):
+    # Only spans the selected template kept in the structured data are exported
+    return {value.kind for value in result["structured_data"].values() if isinstance(value, SpanList)}
+
+
+def iter_jsonl_records(result):
+    """One document header followed by one record per entity and sentence.
+
+    Records carry character offsets into the extracted text and the page they
+    start on, so consumers can join them back to the source without re-parsing.
+    """
+    yield _header(result)
+    document = result.get("document")
+    kinds = _span_kinds(result)
+    if document is None:
+        return
+    if "entities" in kinds:
+        labels = document.labels
+        for index, (start, end, label_id) in enumerate(zip(document.ent_starts, document.ent_ends, document.ent_labels)):
+            yield {"type": "entity", "text": document.entity_text(index), "label": labels[label_id], "start": start, "end": end,
+                   "page": document.page_of(start)}
+    if "sentences" in kinds:
+        for index, (start, end) in enumerate(zip(document.sent_starts, document.sent_ends)):
+            yield {"type": "sentence", "text": document.sentence(index), "start": start, "end": end,
+                   "page": document.page_of(start)}
+
+
+def iter_jsonl(result):
+    for record in iter_jsonl_records(result):
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def read_jsonl(lines):
+    # Inverse of iter_jsonl: (header, entities, sentences)
+    header, entities, sentences = None, [], []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        kind = record.pop("type")
+        if kind == "document":
+            header = record
+        elif kind == "entity":
+            entities.append(record)
+        elif kind == "sentence":
+            sentences.append(record)
+    return header, entities, sentences
+
+
+def spans_table(result):
+    """Entities and sentences as one Arrow table.
+
+    Columns are built straight from the offset arrays; ``kind`` and ``label``
+    are dictionary encoded. The document header is kept in the schema metadata.
+    """
+    if not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow is required for Parquet output. Install it with 'pip install pyarrow'.")
+    document = result.get("document")
+    kinds = _span_kinds(result) if document is not None else set()
+    starts, ends, texts, labels, kind_ids = array("I"), array("I"), [], [], array("B")
+    if "entities" in kinds:
+        starts.extend(document.ent_starts)
+        ends.extend(document.ent_ends)
+        texts.extend(document.entity_text(i) for i in range(len(document.ent_starts)))
+        labels.extend(document.labels[label_id] for label_id in document.ent_labels)
+        kind_ids.extend([0] * len(document.ent_starts))
+    if "sentences" in kinds:
+        starts.extend(document.sent_starts)
+        ends.extend(document.sent_ends)
+        texts.extend(document.sentence(i) for i in range(len(document.sent_starts)))
+        labels.extend([None] * len(document.sent_starts))
+        kind_ids.extend([1] * len(document.sent_starts))
+    page_index = document.page_starts if document is not None else array("I", [0])
+    table = pa.table({
+        "kind": pa.DictionaryArray.from_arrays(pa.array(kind_ids, pa.int8()), pa.array(["entity", "sentence"])),
+        "start": pa.array(starts, pa.uint32()),
+        "end": pa.array(ends, pa.uint32()),
+        "page": pa.array(_pages(page_index, starts), pa.uint32()),
+        "label": pa.array(labels, pa.string()).dictionary_encode(),
+        "text": pa.array(texts, pa.string()),
+    })
+    return table.replace_schema_metadata({_METADATA_KEY: json.dumps(_header(result), ensure_ascii=False)})
+
+
+def _pages(page_index, starts):
+    # Single-page documents (most of them) skip the per-span bisection
+    if len(page_index) == 1:
+        return array("I", [1]) * len(starts)
+    return array("I", (page_of(page_index, start) for start in starts))
+
+
+def write_parquet(result, sink):
+    pq.write_table(spans_table(result), sink, compression="zstd")
+
+
+def read_parquet(source):
+    # (header, table); header is the document record stored in the schema metadata
+    table = pq.read_table(source)
+    metadata = table.schema.metadata or {}
+    header = json.loads(metadata[_METADATA_KEY]) if _METADATA_KEY in metadata else None
+    return header, table
+
+
+def pack_msgpack(result):
+    """The stored result (see compact.pack_result) as MessagePack.
+
+    Offset rows are written as raw little-endian uint32 bytes instead of
+    lists of integers.
+    """
+    if not MSGPACK_AVAILABLE:
+        raise ImportError("msgpack is required for MessagePack output. Install it with 'pip install msgpack'.")
+    packed = pack_result(result)
+    rows = packed.get("compact")
+    if rows is not None:
+        packed["compact"] = {
+            "labels": rows["labels"],
+            "entities": _le_bytes(rows["entities"]),
+            "sentences": _le_bytes(rows["sentences"]),
+            "pages": _le_bytes(rows.get("pages", [0])),
+        }
+    return msgpack.packb(packed, use_bin_type=True)
+
+
+def unpack_msgpack(data):
+    packed = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    rows = packed.get("compact")
+    if rows is not None:
+        packed["compact"] = {
+            "labels": rows["labels"],
+            "entities": _from_le_bytes(rows["entities"]),
+            "sentences": _from_le_bytes(rows["sentences"]),
+            "pages": _from_le_bytes(rows["pages"]) if "pages" in rows else [0],
+        }
+    return unpack_result(packed)
+
+
+def _le_bytes(values):
+    values = array("I", values)
+    if values.itemsize != 4:
+        raise ValueError("array('I') must be 32 bits wide")
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le_bytes(data):
+    values = array("I")
+    values.frombytes(data)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tolist()
+
+
+def binary_formats():
+    # Binary formats whose optional dependency is installed
+    available = {"parquet": PARQUET_AVAILABLE, "msgpack": MSGPACK_AVAILABLE}
+    return [name for name in BINARY_FORMATS if available[name]]
+
+
+def write_binary(result, export_format, f):
+    if export_format == "parquet":
+        write_parquet(result, f)
+    elif export_format == "msgpack":
+        f.write(pack_msgpack(result))
+    else:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+
+def render_binary(result, export_format):
+    buffer = io.BytesIO()
+    write_binary(result, export_format, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,296 @@
+# incremental.py
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from compact import CompactDocument
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Blocks are paragraphs; paragraphs longer than MAX_BLOCK_CHARS are cut at
+# content-defined line breaks so an edit only changes the blocks around it
+MAX_BLOCK_CHARS = 4000
+_BOUNDARY_MODULUS = 8
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+_LINE_BREAK = re.compile(r'\n')
+_SENTENCE_ENDINGS = ('.', '!', '?', ':', ';')
+
+BLOCK_CACHE_SIZE = int(os.environ.get("TRANSFORMO_BLOCK_CACHE_SIZE", "20000"))
+# Shared by all worker processes; an empty value keeps the cache in memory only. When unset, the
+# cache is block_cache.db in the storage directory (database.STORAGE_DIR) at the time it is used
+BLOCK_CACHE_PATH = os.environ.get("TRANSFORMO_BLOCK_CACHE_PATH")
+# Puts between prunes of the shared cache down to its size limit
+_PRUNE_EVERY = 500
+
+
+def _split_long_block(text, start, end):
+    # Content-defined chunking: cut after lines that end a sentence and whose
+    # checksum hits the modulus, so boundaries depend only on nearby content.
+    # The last line break before the size limit is the fallback cut.
+    spans = []
+    block_start = line_start = start
+    last_break = None
+    for match in _LINE_BREAK.finditer(text, start, end):
+        cut = match.end()
+        line = text[line_start:cut].rstrip()
+        line_start = cut
+        if line.endswith(_SENTENCE_ENDINGS) and zlib.crc32(line.encode('utf-8', 'surrogatepass')) % _BOUNDARY_MODULUS == 0:
+            spans.append((block_start, cut))
+            block_start = cut
+            last_break = None
+            continue
+        if cut - block_start > MAX_BLOCK_CHARS and last_break is not None:
+            spans.append((block_start, last_break))
+            block_start = last_break
+        last_break = cut
+    while end - block_start > MAX_BLOCK_CHARS:
+        # No usable line breaks; cut at whitespace so tokens stay intact
+        cut = text.rfind(' ', block_start + 1, block_start + MAX_BLOCK_CHARS) + 1 or block_start + MAX_BLOCK_CHARS
+        spans.append((block_start, cut))
+        block_start = cut
+    if block_start < end:
+        spans.append((block_start, end))
+    return spans
+
+
+def split_blocks(text):
+    """Splits text into consecutive (start, end) blocks that cover it exactly.
+
+    Each block is a paragraph together with the blank lines that follow it.
+    """
+    spans = []
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        end = match.end()
+        spans.extend(_split_long_block(text, start, end) if end - start > MAX_BLOCK_CHARS else [(start, end)])
+        start = end
+    if start < len(text):
+        end = len(text)
+        spans.extend(_split_long_block(text, start, end) if end - start > MAX_BLOCK_CHARS else [(start, end)])
+    return spans
+
+
+def block_hash(block_text):
+    return hashlib.blake2b(block_text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class BlockResult:
+    # NLP output for one block, with offsets relative to the block start
+    __slots__ = ("entities", "labels", "sentences", "term_counts", "word_counts", "token_count")
+
+    def __init__(self, entities, labels, sentences, term_counts, word_counts, token_count):
+        self.entities = entities
+        self.labels = labels
+        self.sentences = sentences
+        self.term_counts = term_counts
+        self.word_counts = word_counts
+        self.token_count = token_count
+
+    @classmethod
+    def from_doc(cls, doc, term_counts):
+        entities = array("I")
+        labels = []
+        for ent in doc.ents:
+            entities.extend((ent.start_char, ent.end_char))
+            labels.append(ent.label_)
+        sentences = array("I")
+        for sent in doc.sents:
+            # A block's trailing blank lines would otherwise form a sentence of their own
+            if not sent.text.isspace():
+                sentences.extend((sent.start_char, sent.end_char))
+        word_counts = Counter(token.lower_ for token in doc if not token.is_stop and token.is_alpha)
+        return cls(entities, tuple(labels), sentences, term_counts, word_counts, len(doc))
+
+    def to_row(self):
+        # (entities, sentences, data) columns of the shared cache; the offset arrays are stored as raw bytes
+        data = {"labels": self.labels, "term_counts": self.term_counts, "word_counts": self.word_counts, "token_count": self.token_count}
+        return self.entities.tobytes(), self.sentences.tobytes(), json.dumps(data)
+
+    @classmethod
+    def from_row(cls, entities, sentences, data):
+        data = json.loads(data)
+        return cls(array("I", entities), tuple(data["labels"]), array("I", sentences), Counter(data["term_counts"]),
+                   Counter(data["word_counts"]), data["token_count"])
+
+
+class BlockCache:
+    """Two-tier cache of block hash -> BlockResult.
+
+    An in-process LRU sits in front of a SQLite file shared by every worker
+    process, so a revised document reuses its unchanged blocks whichever
+    worker it lands on, and a worker that is killed and replaced loses only
+    its front tier. Entries are keyed by ``namespace`` (the NLP model and
+    mode) as well as the block hash. The shared file is pruned to
+    ``max_entries`` least recently used blocks; if it cannot be used, the
+    cache carries on in memory. ``path`` defaults to BLOCK_CACHE_PATH, or to
+    block_cache.db in the current storage directory.
+    """
+
+    def __init__(self, namespace="", max_entries=BLOCK_CACHE_SIZE, path=BLOCK_CACHE_PATH):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        # (process id, path) the connection was opened for
+        self._opened = None
+        self._puts = 0
+
+    def get_many(self, keys):
+        # Results for ``keys`` in order, None where a block is not cached
+        with self._lock:
+            results = [self._entries.get(key) for key in keys]
+            for key, result in zip(keys, results):
+                if result is not None:
+                    self._entries.move_to_end(key)
+        missing = [key for key, result in zip(keys, results) if result is None]
+        if missing:
+            found = self._shared_get(missing)
+            if found:
+                with self._lock:
+                    for key, result in found.items():
+                        self._remember(key, result)
+                results = [result if result is not None else found.get(key) for key, result in zip(keys, results)]
+        return results
+
+    def put_many(self, items):
+        # ``items`` are (key, result) pairs
+        with self._lock:
+            for key, result in items:
+                self._remember(key, result)
+        self._shared_put(items)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def put(self, key, result):
+        self.put_many([(key, result)])
+
+    def clear(self):
+        # Clears this process's front tier only
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _shared_path(self):
+        if self.path is not None:
+            return self.path
+        import database
+        return os.path.join(database.STORAGE_DIR, "block_cache.db")
+
+    def _shared(self):
+        # Opened lazily in each process, and again whenever the storage directory changes; None when
+        # the shared tier is disabled or unusable
+        path = self._shared_path()
+        if not path:
+            return None
+        if self._opened != (os.getpid(), path):
+            if self._connection is not None and self._opened[0] == os.getpid():
+                self._connection.close()
+            self._opened = (os.getpid(), path)
+            self._connection = None
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                with connection:
+                    connection.execute("CREATE TABLE IF NOT EXISTS blocks (namespace TEXT NOT NULL, key BLOB NOT NULL, "
+                                       "entities BLOB NOT NULL, sentences BLOB NOT NULL, data TEXT NOT NULL, used REAL NOT NULL, "
+                                       "PRIMARY KEY (namespace, key))")
+                    connection.execute("CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used)")
+                self._connection = connection
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Shared block cache '{path}' unavailable; caching in memory only: {e}")
+        return self._connection
+
+    def _shared_get(self, keys):
+        with self._lock:
+            connection = self._shared()
+            if connection is None:
+                return {}
+            try:
+                found = {}
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    rows = connection.execute(
+                        f"SELECT key, entities, sentences, data FROM blocks WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                        (self.namespace, *chunk),
+                    )
+                    for key, entities, sentences, data in rows:
+                        found[bytes(key)] = BlockResult.from_row(entities, sentences, data)
+                if found:
+                    with connection:
+                        now = time.time()
+                        connection.executemany("UPDATE blocks SET used = ? WHERE namespace = ? AND key = ?",
+                                               [(now, self.namespace, key) for key in found])
+                return found
+            except sqlite3.Error as e:
+                logger.warning(f"Shared block cache read failed: {e}")
+                return {}
+
+    def _shared_put(self, items):
+        with self._lock:
+            connection = self._shared()
+            if connection is None or not items:
+                return
+            try:
+                now = time.time()
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO blocks (namespace, key, entities, sentences, data, used) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(self.namespace, key, *result.to_row(), now) for key, result in items],
+                    )
+                self._puts += len(items)
+                if self._puts >= _PRUNE_EVERY:
+                    self._puts = 0
+                    with connection:
+                        # Keeps the max_entries most recently used blocks across all namespaces
+                        connection.execute("DELETE FROM blocks WHERE used < (SELECT used FROM blocks ORDER BY used DESC "
+                                           "LIMIT 1 OFFSET ?)", (self.max_entries,))
+            except sqlite3.Error as e:
+                logger.warning(f"Shared block cache write failed: {e}")
+
+
+def merge_blocks(text, spans, results):
+    """Combines per-block results into one CompactDocument over the full text.
+
+    Returns the document (with merged word and keyword term counts) and the
+    token count.
+    """
+    document = CompactDocument(text)
+    word_counts = Counter()
+    term_counts = Counter()
+    token_count = 0
+    for (start, _), result in zip(spans, results):
+        entities = result.entities
+        for i, label in enumerate(result.labels):
+            document.add_entity(start + entities[2 * i], start + entities[2 * i + 1], label)
+        sentences = result.sentences
+        for i in range(0, len(sentences), 2):
+            document.add_sentence(start + sentences[i], start + sentences[i + 1])
+        word_counts.update(result.word_counts)
+        term_counts.update(result.term_counts)
+        token_count += result.token_count
+    document.word_counts = word_counts
+    document.term_counts = term_counts
+    return document, token_count
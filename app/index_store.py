@@ -0,0 +1,160 @@
+# index_store.py
+#
+# Persistent store of the corpus indexes (duplicate signatures, entity
+# postings, keyword document frequencies). An index is kept as one entry per
+# document in a SQLite file, and every change to an entry is also appended
+# to a change log. A save or delete therefore writes one entry and one log
+# line, however large the store is.
+#
+# Each process keeps the indexes it uses in memory. Before an index is used,
+# the log lines written since the process last looked (by it or by any other
+# process: the Streamlit server, the API, batch workers) are applied to it.
+# Writes run in IMMEDIATE transactions, so SQLite's file lock serializes them
+# across processes.
+#
+# An index object only needs ``documents`` (document id -> entry), ``add_entry``
+# and ``remove``; see MinHashIndex, EntityIndex and DocumentFrequencies.
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Log lines kept for processes catching up; a process that falls further behind reloads the index
+LOG_LIMIT = 10000
+
+
+class IndexStore:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are issued explicitly (BEGIN / BEGIN IMMEDIATE)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (name TEXT NOT NULL, document_id TEXT NOT NULL, "
+                                 "entry TEXT NOT NULL, PRIMARY KEY (name, document_id))")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS log (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                 "name TEXT NOT NULL, document_id TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._lock = threading.RLock()
+        # name -> (index, last applied log sequence number)
+        self._indexes = {}
+
+    def get(self, name, factory, rebuild):
+        """The index ``name``, brought up to date with the change log.
+
+        ``factory()`` returns an empty index. An index that was never built
+        is first filled from ``rebuild()``, which returns a complete one.
+        """
+        with self._lock:
+            cached = self._indexes.get(name)
+            if cached is not None:
+                index, seq = cached
+                with self._read():
+                    if seq >= self._meta("pruned"):
+                        self._indexes[name] = (index, self._apply_log(name, index, seq))
+                        return index
+            if not self._built(name):
+                self._rebuild(name, rebuild)
+            with self._read():
+                index = factory()
+                seq = self._last_seq()
+                for document_id, entry in self._connection.execute("SELECT document_id, entry FROM entries WHERE name = ?", (name,)):
+                    index.add_entry(document_id, json.loads(entry))
+            self._indexes[name] = (index, seq)
+            return index
+
+    def put(self, name, document_id, entry):
+        # Writes one document's entry, or removes it when ``entry`` is None, and logs the change
+        with self._lock:
+            with self._write():
+                if entry is None:
+                    self._connection.execute("DELETE FROM entries WHERE name = ? AND document_id = ?", (name, document_id))
+                else:
+                    self._connection.execute("INSERT OR REPLACE INTO entries (name, document_id, entry) VALUES (?, ?, ?)",
+                                             (name, document_id, json.dumps(entry)))
+                seq = self._connection.execute("INSERT INTO log (name, document_id) VALUES (?, ?)", (name, document_id)).lastrowid
+                if seq % LOG_LIMIT == 0:
+                    self._connection.execute("DELETE FROM log WHERE seq <= ?", (seq - LOG_LIMIT,))
+                    self._set_meta("pruned", seq - LOG_LIMIT)
+            # The caller already applied this change to its in-memory index; changes from other processes are replayed on the next get
+            cached = self._indexes.get(name)
+            if cached is not None and cached[1] == seq - 1:
+                self._indexes[name] = (cached[0], seq)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+            self._indexes.clear()
+
+    def _rebuild(self, name, rebuild):
+        logger.info(f"Building index '{name}' from stored documents.")
+        with self._read():
+            start = self._last_seq()
+        index = rebuild()
+        with self._write():
+            if self._built(name):
+                # Another process built it meanwhile
+                return
+            # Documents saved or deleted while rebuilding already have their current entry
+            changed = "SELECT document_id FROM log WHERE name = ? AND seq > ?"
+            self._connection.execute(f"DELETE FROM entries WHERE name = ? AND document_id NOT IN ({changed})", (name, name, start))
+            changed_ids = {row[0] for row in self._connection.execute(changed, (name, start))}
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (name, document_id, entry) VALUES (?, ?, ?)",
+                [(name, document_id, json.dumps(entry)) for document_id, entry in index.documents.items() if document_id not in changed_ids],
+            )
+            self._set_meta(f"built:{name}", 1)
+
+    def _apply_log(self, name, index, seq):
+        # Runs inside a read snapshot; returns the sequence number the index is now up to date with
+        rows = self._connection.execute(
+            "SELECT log.document_id, entries.entry FROM log LEFT JOIN entries "
+            "ON entries.name = log.name AND entries.document_id = log.document_id "
+            "WHERE log.name = ? AND log.seq > ? ORDER BY log.seq", (name, seq),
+        )
+        for document_id, entry in rows:
+            # Each line is joined with the entry as it is now, so replaying several lines for one document is harmless
+            if entry is None:
+                index.remove(document_id)
+            else:
+                index.add_entry(document_id, json.loads(entry))
+        return self._last_seq()
+
+    def _built(self, name):
+        return bool(self._meta(f"built:{name}"))
+
+    def _last_seq(self):
+        return self._connection.execute("SELECT COALESCE(MAX(seq), 0) FROM log").fetchone()[0]
+
+    def _meta(self, key):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_meta(self, key, value):
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _read(self):
+        # One snapshot for the statements of a read
+        return self._transaction("BEGIN")
+
+    def _write(self):
+        # Takes the database write lock up front, so concurrent writers in other processes wait instead of failing
+        return self._transaction("BEGIN IMMEDIATE")
+
+    @contextmanager
+    def _transaction(self, begin):
+        self._connection.execute(begin)
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
@@ -0,0 +1,133 @@
+# keywords.py
+#
+# Keyword extraction. Candidate terms are noun and proper-noun lemmas plus
+# adjective/noun + noun bigrams, found from part-of-speech tags over the
+# token arrays of a parsed Doc; no dependency parse is needed. Terms are
+# ranked by TF-IDF against document frequencies passed in by the caller,
+# normally a snapshot of the saved-document store (see
+# database.keyword_frequencies), which is updated as documents are saved and
+# deleted.
+
+import os
+from collections import Counter
+import numpy as np
+from spacy.attrs import IS_ALPHA, IS_STOP, LEMMA, POS
+from spacy.symbols import ADJ, NOUN, PROPN
+
+# Every candidate term is kept unless a limit is set
+KEYWORD_LIMIT = int(os.environ["TRANSFORMO_KEYWORD_LIMIT"]) if os.environ.get("TRANSFORMO_KEYWORD_LIMIT") else None
+
+_HEADS = np.array([NOUN, PROPN], dtype=np.uint64)
+_MODIFIERS = np.array([ADJ, NOUN, PROPN], dtype=np.uint64)
+
+
+def term_counts(doc):
+    """Counter of candidate keyword terms in a spaCy Doc."""
+    if len(doc) == 0:
+        return Counter()
+    rows = doc.to_array([POS, LEMMA, IS_STOP, IS_ALPHA])
+    pos, lemmas = rows[:, 0], rows[:, 1]
+    usable = (rows[:, 2] == 0) & (rows[:, 3] == 1)
+    heads = usable & np.isin(pos, _HEADS)
+    modifiers = usable & np.isin(pos, _MODIFIERS)
+
+    strings = doc.vocab.strings
+    counts = Counter()
+    unigrams, unigram_counts = np.unique(lemmas[heads], return_counts=True)
+    for lemma, count in zip(unigrams.tolist(), unigram_counts.tolist()):
+        counts[strings[lemma].lower()] += count
+
+    pairs = modifiers[:-1] & heads[1:]
+    if pairs.any():
+        starts = np.nonzero(pairs)[0]
+        bigrams, bigram_counts = np.unique(np.stack([lemmas[starts], lemmas[starts + 1]], axis=1), axis=0, return_counts=True)
+        for (first, second), count in zip(bigrams.tolist(), bigram_counts.tolist()):
+            counts[f"{strings[first]} {strings[second]}".lower()] += count
+    return counts
+
+
+def rank_keywords(counts, frequencies=None, limit=KEYWORD_LIMIT):
+    """Terms as (term, score), highest TF-IDF first; all of them unless ``limit`` is set.
+
+    ``frequencies`` is a DocumentFrequencies or FrequencySnapshot; without
+    one, or with an empty store, every term has the same IDF and terms rank
+    by frequency. Ties are broken alphabetically so the order is stable.
+    """
+    if not counts:
+        return []
+    terms = sorted(counts)
+    tf = np.fromiter((counts[term] for term in terms), dtype=np.float64, count=len(terms))
+    tf /= tf.sum()
+    if frequencies is not None and frequencies.document_count:
+        df = np.fromiter((frequencies.df.get(term, 0) for term in terms), dtype=np.float64, count=len(terms))
+        idf = np.log((1 + frequencies.document_count) / (1 + df)) + 1
+    else:
+        idf = 1.0
+    scores = tf * idf
+    # Stable sort on the alphabetical term order
+    order = np.argsort(-scores, kind="stable")[:limit]
+    return [(terms[i], round(float(scores[i]), 6)) for i in order.tolist()]
+
+
+class DocumentFrequencies:
+    """Number of saved documents containing each keyword term.
+
+    Each document keeps its own term list so a delete removes exactly what
+    the save added.
+    """
+
+    def __init__(self):
+        self.df = {}
+        self.documents = {}
+
+    @property
+    def document_count(self):
+        return len(self.documents)
+
+    def add(self, document_id, terms):
+        self.remove(document_id)
+        terms = sorted(set(terms))
+        for term in terms:
+            self.df[term] = self.df.get(term, 0) + 1
+        self.documents[document_id] = terms
+
+    def add_entry(self, document_id, terms):
+        self.add(document_id, terms)
+
+    def remove(self, document_id):
+        terms = self.documents.pop(document_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            remaining = self.df.get(term, 0) - 1
+            if remaining > 0:
+                self.df[term] = remaining
+            else:
+                self.df.pop(term, None)
+        return True
+
+    def snapshot(self):
+        return FrequencySnapshot(dict(self.df), self.document_count)
+
+    def top_terms(self, limit=20):
+        # Terms found in the most documents
+        return sorted(self.df.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class FrequencySnapshot:
+    # Document frequencies without the per-document term lists: all rank_keywords
+    # needs, and small enough to send to a worker process with each job
+    __slots__ = ("df", "document_count")
+
+    def __init__(self, df, document_count):
+        self.df = df
+        self.document_count = document_count
+
+
+def stored_terms(packed):
+    # Keyword terms of a stored payload; payloads saved before term counts were kept fall back to the keywords
+    counts = packed.get("term_counts")
+    if isinstance(counts, dict):
+        return list(counts)
+    keywords = (packed.get("structured_data") or {}).get("keywords")
+    return [keyword.lower() for keyword in keywords if isinstance(keyword, str)] if isinstance(keywords, list) else []
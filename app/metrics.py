@@ -0,0 +1,194 @@
+# metrics.py
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "transformo"
+MAX_TRACES = 100
+
+# Aggregates are plain dicts guarded by one lock; a stage update is a handful
+# of float additions, so this is cheap enough to leave on in production.
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_traces = deque(maxlen=MAX_TRACES)
+_local = threading.local()
+_server = None
+
+
+def _record_stage(stage, wall, cpu):
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "max_wall_seconds": 0.0}
+        stats["count"] += 1
+        stats["wall_seconds"] += wall
+        stats["cpu_seconds"] += cpu
+        if wall > stats["max_wall_seconds"]:
+            stats["max_wall_seconds"] = wall
+
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["stages"].append((stage, round(wall, 6), round(cpu, 6)))
+
+
+@contextmanager
+def timed(stage):
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        _record_stage(stage, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["counters"][name] = trace["counters"].get(name, 0) + value
+
+
+@contextmanager
+def document_trace(document):
+    # Traces are per thread so concurrent documents don't mix their stages
+    trace = {
+        "document": document,
+        "started": time.time(),
+        "stages": [],
+        "counters": {},
+        "error": None,
+    }
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    wall_start = time.perf_counter()
+    try:
+        yield trace
+    except Exception as e:
+        trace["error"] = str(e)
+        raise
+    finally:
+        trace["wall_seconds"] = round(time.perf_counter() - wall_start, 6)
+        _local.trace = previous
+        with _lock:
+            _traces.append(trace)
+
+
+def merge_trace(trace):
+    # Adds a trace recorded in another process (e.g. a batch worker) to this process's aggregates
+    for stage, wall, cpu in trace["stages"]:
+        _record_stage(stage, wall, cpu)
+    with _lock:
+        for name, value in trace["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+        _traces.append(trace)
+
+
+def get_stage_stats():
+    with _lock:
+        return {stage: dict(stats) for stage, stats in _stages.items()}
+
+
+def get_counters():
+    with _lock:
+        return dict(_counters)
+
+
+def get_recent_traces(limit=20):
+    with _lock:
+        return list(_traces)[-limit:][::-1]
+
+
+def reset_metrics():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _traces.clear()
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus():
+    stages = get_stage_stats()
+    counters = get_counters()
+    lines = []
+
+    for metric, key, help_text in (
+        ("stage_wall_seconds", "wall_seconds", "Wall-clock time spent per pipeline stage."),
+        ("stage_cpu_seconds", "cpu_seconds", "CPU time spent per pipeline stage."),
+    ):
+        name = f"{METRICS_PREFIX}_{metric}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        for stage, stats in sorted(stages.items()):
+            label = _escape_label(stage)
+            lines.append(f'{name}_sum{{stage="{label}"}} {stats[key]:.6f}')
+            lines.append(f'{name}_count{{stage="{label}"}} {stats["count"]}')
+
+    name = f"{METRICS_PREFIX}_stage_max_wall_seconds"
+    lines.append(f"# HELP {name} Slowest single run per pipeline stage.")
+    lines.append(f"# TYPE {name} gauge")
+    for stage, stats in sorted(stages.items()):
+        lines.append(f'{name}{{stage="{_escape_label(stage)}"}} {stats["max_wall_seconds"]:.6f}')
+
+    name = f"{METRICS_PREFIX}_events_total"
+    lines.append(f"# HELP {name} Byte, token and document counters.")
+    lines.append(f"# TYPE {name} counter")
+    for counter, value in sorted(counters.items()):
+        lines.append(f'{name}{{event="{_escape_label(counter)}"}} {value}')
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path=None):
+    path = path or os.environ.get("TRANSFORMO_METRICS_FILE")
+    if not path:
+        return None
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics endpoint: " + format, *args)
+
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    global _server
+    if port is None:
+        port = os.environ.get("TRANSFORMO_METRICS_PORT")
+        if not port:
+            return None
+    with _lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    thread = threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving Prometheus metrics on {host}:{port}/metrics")
+    return _server
@@ -0,0 +1,44 @@
+# pages.py
+#
+# Page structure of extracted text. Extractors separate pages with a form
+# feed (PAGE_BREAK), so a text carries its own page boundaries and the page
+# index is the sorted array of page start offsets. Saved documents keep
+# their page texts apart from the stored payload (see storage.py), so a
+# single page can be read without loading the rest of the text.
+
+from array import array
+from bisect import bisect_right
+
+PAGE_BREAK = "\f"
+
+
+def page_starts(text):
+    """Offsets at which each page of ``text`` starts; the first is always 0."""
+    starts = array("I", [0])
+    index = text.find(PAGE_BREAK)
+    while index >= 0:
+        starts.append(index + 1)
+        index = text.find(PAGE_BREAK, index + 1)
+    return starts
+
+
+def page_of(starts, offset):
+    # 1-based number of the page containing a character offset; a page break belongs to the page it opens
+    return bisect_right(starts, offset + 1)
+
+
+def page_span(starts, number, length):
+    # (start, end) of page ``number`` in a text of ``length`` characters, without its page break
+    if not 1 <= number <= len(starts):
+        raise IndexError(f"Page {number} is out of range (1-{len(starts)}).")
+    end = starts[number] - 1 if number < len(starts) else length
+    return starts[number - 1], end
+
+
+def split_pages(text):
+    return text.split(PAGE_BREAK)
+
+
+def join_pages(pages):
+    # Page texts from an extractor; stray form feeds inside a page would otherwise start a new one
+    return PAGE_BREAK.join(page.replace(PAGE_BREAK, "\n") for page in pages)
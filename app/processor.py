@@ -1,40 +1,118 @@
 import spacy
+import os
 import re
 from collections import Counter
-import json
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import uuid
+from metrics import timed, increment
+from sanitizer import clean_text
+from compact import CompactDocument, EntityList, SentenceList, unpack_result
+from exporter import export_size, iter_export, iter_json, iter_xml
+from formats import BINARY_FORMATS, render_binary
+from incremental import BlockCache, BlockResult, block_hash, merge_blocks, split_blocks
+from keywords import rank_keywords, term_counts
 
-nlp = spacy.load("en_core_web_sm")
+# "fast" skips the dependency parser: sentences come from the lighter sentence
+# recognizer and keywords from part-of-speech tags, which is all they need
+NLP_MODE = os.environ.get("TRANSFORMO_NLP_MODE", "full")
 
-def clean_text(text):
-    text = ''.join(char for char in text if char.isprintable())
-    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-    return text
+if NLP_MODE == "fast":
+    nlp = spacy.load("en_core_web_sm", exclude=["parser"])
+    if "senter" in nlp.disabled:
+        nlp.enable_pipe("senter")
+    elif not nlp.has_pipe("senter"):
+        nlp.add_pipe("sentencizer")
+else:
+    nlp = spacy.load("en_core_web_sm")
 
-def structure_text(text):
-    doc = nlp(text)
+# Block results depend on the model and mode, so the shared cache keeps them apart
+block_cache = BlockCache(namespace=f"{nlp.meta['name']}-{nlp.meta['version']}/{NLP_MODE}")
+
+def structure_text(text, incremental=False, frequencies=None):
+    # ``frequencies`` are the keyword document frequencies to rank against (see keywords.rank_keywords)
+    if incremental:
+        return _structure_text_incremental(text, frequencies)
+    
+    with timed("nlp.parse"):
+        doc = nlp(text)
+    increment("nlp.input_chars", len(text))
+    increment("nlp.tokens", len(doc))
+    
+    with timed("structure.collect"):
+        structured_data = _collect_structure(doc, frequencies)
+    increment("structure.entities", len(structured_data["entities"]))
+    increment("structure.sentences", len(structured_data["sentences"]))
+    return structured_data
+
+def _collect_structure(doc, frequencies=None):
+    # Entities and sentences are kept as offsets into the text and only turned
+    # into strings when exported
+    document = CompactDocument(doc.text)
+    for sent in doc.sents:
+        document.add_sentence(sent.start_char, sent.end_char)
+    for ent in doc.ents:
+        document.add_entity(ent.start_char, ent.end_char, ent.label_)
+    
+    # Word frequencies are gathered from the same parse so analytics never re-runs the pipeline
+    document.word_counts = Counter(token.lower_ for token in doc if not token.is_stop and token.is_alpha)
+    document.term_counts = term_counts(doc)
     
     structured_data = {
-        "entities": [],
-        "sentences": [],
-        "keywords": [],
+        "entities": EntityList(document),
+        "sentences": SentenceList(document),
+        "keywords": rank_document_keywords(document, frequencies),
         "word_count": len(doc),
-        "sentence_count": len(list(doc.sents)),
+        "sentence_count": len(document.sent_starts),
     }
     
-    for ent in doc.ents:
-        structured_data["entities"].append({
-            "text": clean_text(ent.text),
-            "label": ent.label_
-        })
-    
-    for sent in doc.sents:
-        structured_data["sentences"].append(clean_text(sent.text))
+    return structured_data
+
+def rank_document_keywords(document, frequencies=None):
+    # Without frequencies, keywords rank by term frequency alone, so the result does not depend on the store
+    with timed("keywords.rank"):
+        document.keyword_scores = rank_keywords(document.term_counts, frequencies)
+    return [clean_text(term) for term, _ in document.keyword_scores]
+
+# Entity labels behind each custom field / template group
+ENTITY_FIELDS = {
+    "persons": ("PERSON",),
+    "organizations": ("ORG",),
+    "locations": ("GPE", "LOC"),
+    "dates": ("DATE",),
+}
+
+def entity_texts(entities, labels):
+    if isinstance(entities, EntityList):
+        return entities.document.entity_texts(labels)
+    return [ent["text"] for ent in entities if ent["label"] in labels]
+
+def _structure_text_incremental(text, frequencies=None):
+    # Only blocks (paragraphs) not seen before are parsed; the rest come from the block cache
+    with timed("incremental.split"):
+        spans = split_blocks(text)
+        keys = [block_hash(text[start:end]) for start, end in spans]
+        results = block_cache.get_many(keys)
+    missing = [i for i, result in enumerate(results) if result is None]
+    increment("incremental.blocks_reused", len(spans) - len(missing))
+    increment("incremental.blocks_parsed", len(missing))
     
-    keywords = [clean_text(chunk.root.lemma_) for chunk in doc.noun_chunks]
-    structured_data["keywords"] = list(set(keywords))
+    with timed("nlp.parse"):
+        texts = (text[spans[i][0]:spans[i][1]] for i in missing)
+        for i, doc in zip(missing, nlp.pipe(texts)):
+            results[i] = BlockResult.from_doc(doc, term_counts(doc))
+        block_cache.put_many([(keys[i], results[i]) for i in missing])
+    increment("nlp.input_chars", sum(spans[i][1] - spans[i][0] for i in missing))
     
+    with timed("structure.collect"):
+        document, token_count = merge_blocks(text, spans, results)
+        structured_data = {
+            "entities": EntityList(document),
+            "sentences": SentenceList(document),
+            "keywords": rank_document_keywords(document, frequencies),
+            "word_count": token_count,
+            "sentence_count": len(document.sent_starts),
+        }
+    increment("structure.entities", len(structured_data["entities"]))
+    increment("structure.sentences", len(structured_data["sentences"]))
     return structured_data
 
 def apply_template(data, template):
@@ -52,9 +130,8 @@ def apply_template(data, template):
         }
     elif template == "specific_entities":
         return {
-            "persons": [ent["text"] for ent in data["entities"] if ent["label"] == "PERSON"],
-            "organizations": [ent["text"] for ent in data["entities"] if ent["label"] == "ORG"],
-            "locations": [ent["text"] for ent in data["entities"] if ent["label"] in ["GPE", "LOC"]]
+            field: entity_texts(data["entities"], ENTITY_FIELDS[field])
+            for field in ("persons", "organizations", "locations")
         }
     else:
         return data
@@ -62,17 +139,15 @@ def apply_template(data, template):
 def extract_custom_fields(structured_data, fields):
     result = {}
     for field in fields:
-        if field == "persons":
-            result[field] = [ent["text"] for ent in structured_data["entities"] if ent["label"] == "PERSON"]
-        elif field == "organizations":
-            result[field] = [ent["text"] for ent in structured_data["entities"] if ent["label"] == "ORG"]
-        elif field == "locations":
-            result[field] = [ent["text"] for ent in structured_data["entities"] if ent["label"] in ["GPE", "LOC"]]
-        elif field == "dates":
-            result[field] = [ent["text"] for ent in structured_data["entities"] if ent["label"] == "DATE"]
+        if field in ENTITY_FIELDS:
+            result[field] = entity_texts(structured_data["entities"], ENTITY_FIELDS[field])
     return result
 
 def analyze_document(structured_data, full_text):
+    with timed("analyze"):
+        return _analyze_document(structured_data, full_text)
+
+def _analyze_document(structured_data, full_text):
     analytics = {
         "word_count": structured_data["word_count"],
         "sentence_count": structured_data["sentence_count"],
@@ -81,51 +156,103 @@ def analyze_document(structured_data, full_text):
         "keyword_count": len(structured_data["keywords"]),
     }
     
-    doc = nlp(full_text)
-    analytics["most_common_entities"] = Counter([ent["label"] for ent in structured_data["entities"]]).most_common(5)
-    analytics["most_common_words"] = Counter([token.text.lower() for token in doc if not token.is_stop and token.is_alpha]).most_common(10)
+    entities = structured_data["entities"]
+    document = entities.document if isinstance(entities, EntityList) else None
+    
+    if document is not None:
+        analytics["most_common_entities"] = document.label_counts().most_common(5)
+    else:
+        analytics["most_common_entities"] = Counter([ent["label"] for ent in entities]).most_common(5)
+    
+    if document is not None and document.word_counts is not None:
+        word_counts = document.word_counts
+    else:
+        with timed("analyze.parse"):
+            doc = nlp(full_text)
+        word_counts = Counter([token.text.lower() for token in doc if not token.is_stop and token.is_alpha])
+    analytics["most_common_words"] = word_counts.most_common(10)
+    
+    if document is not None and document.keyword_scores is not None:
+        analytics["top_keywords"] = document.keyword_scores[:10]
     
     return analytics
 
+def utf8_size(text):
+    # Byte size of the encoded text; ASCII output (the common case) needs no encoding pass
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
 def generate_json_output(data):
-    return json.dumps(data, indent=2, ensure_ascii=False)
+    with timed("render.json"):
+        output = "".join(iter_json(data))
+    increment("render.json_chars", len(output))
+    return output
 
 def generate_xml_output(data):
-    def dict_to_xml(tag, d):
-        elem = ET.Element(tag)
-        for key, val in d.items():
-            child = ET.Element(key)
-            if isinstance(val, dict):
-                child = dict_to_xml(key, val)
-            elif isinstance(val, list):
-                for item in val:
-                    if isinstance(item, dict):
-                        child.append(dict_to_xml('item', item))
-                    else:
-                        ET.SubElement(child, 'item').text = str(item)
-            else:
-                child.text = str(val)
-            elem.append(child)
-        return elem
-
-    root = dict_to_xml('document', data)
-    xml_str = minidom.parseString(ET.tostring(root, encoding='unicode')).toprettyxml(indent="  ")
+    with timed("render.xml"):
+        xml_str = "".join(iter_xml(data))
+    increment("render.xml_chars", len(xml_str))
     return xml_str
 
-def process_document(extracted_text, template=None, custom_fields=None):
-    warnings = []
-    
+def generate_machine_readable_output(result, output_format="json"):
+    # Any export format for a processed result: str for text formats, bytes for binary ones
+    with timed(f"render.{output_format}"):
+        if output_format in BINARY_FORMATS:
+            return render_binary(result, output_format)
+        return "".join(iter_export(result, output_format))
+
+def _render_outputs(result, render_outputs):
+    # Without rendering, exports are streamed on demand (see exporter.py); sizes are only known once an export is rendered
+    if render_outputs:
+        result["json_output"] = generate_json_output(result["structured_data"])
+        result["xml_output"] = generate_xml_output(result["structured_data"])
+        result["output_sizes"] = {"json": utf8_size(result["json_output"]), "xml": utf8_size(result["xml_output"])}
+    else:
+        result["json_output"] = result["xml_output"] = None
+        result["output_sizes"] = dict(result.get("output_sizes") or {})
+    return result
+
+def output_size(result, export_format):
+    # Byte size of an export: the size recorded when it was rendered, or a streamed count the first time it is asked for
+    sizes = result.setdefault("output_sizes", {})
+    if export_format not in sizes:
+        with timed("render.sizes"):
+            sizes[export_format] = export_size(result, export_format)
+    return sizes[export_format]
+
+def process_document(extracted_text, template=None, custom_fields=None, incremental=False, render_outputs=True, frequencies=None):
     # Always process the full structured data
-    full_structured_data = structure_text(extracted_text)
+    full_structured_data = structure_text(extracted_text, incremental, frequencies)
+    return _build_result(extracted_text, full_structured_data, template, custom_fields, render_outputs, [])
+
+def partial_result(extracted_text, template=None, custom_fields=None, warning=None, render_outputs=True):
+    # Result for text whose NLP did not finish: word counts only, no entities, sentences or keywords
+    with timed("partial"):
+        document = CompactDocument(extracted_text)
+        words = re.findall(r"[^\W\d_]+", extracted_text)
+        document.word_counts = Counter(word for word in map(str.lower, words) if word not in nlp.Defaults.stop_words)
+        structured_data = {
+            "entities": EntityList(document),
+            "sentences": SentenceList(document),
+            "keywords": [],
+            "word_count": len(words),
+            "sentence_count": 0,
+        }
+    increment("partial.documents")
+    result = _build_result(extracted_text, structured_data, template, custom_fields, render_outputs, [warning] if warning else [])
+    result["partial"] = True
+    return result
+
+def _build_result(extracted_text, full_structured_data, template, custom_fields, render_outputs, warnings):
     full_analytics = analyze_document(full_structured_data, extracted_text)
     
     # Apply template or custom fields if specified
-    if template:
-        output_data = apply_template(full_structured_data, template)
-    elif custom_fields:
-        output_data = extract_custom_fields(full_structured_data, custom_fields)
-    else:
-        output_data = full_structured_data
+    with timed("template"):
+        if template:
+            output_data = apply_template(full_structured_data, template)
+        elif custom_fields:
+            output_data = extract_custom_fields(full_structured_data, custom_fields)
+        else:
+            output_data = full_structured_data
     
     # Always include analytics in the output
     output_data['analytics'] = full_analytics
@@ -135,17 +262,24 @@ def process_document(extracted_text, template=None, custom_fields=None):
         if value in (None, 0, [], {}):
             warnings.append(f"Warning: {key} has no value or is empty.")
     
-    json_output = generate_json_output(output_data)
-    xml_output = generate_xml_output(output_data)
-    
-    return {
+    return _render_outputs({
+        "result_id": uuid.uuid4().hex,
         "structured_data": output_data,
         "analytics": full_analytics,
-        "json_output": json_output,
-        "xml_output": xml_output,
         "extracted_text": extracted_text,
-        "warnings": warnings
-    }
+        "warnings": warnings,
+        "options": {"template": template, "custom_fields": custom_fields},
+        # Kept with saved documents to maintain the keyword document frequencies
+        "term_counts": dict(full_structured_data["entities"].document.term_counts or {}),
+        "document": full_structured_data["entities"].document
+    }, render_outputs)
+
+def restore_result(packed, render_outputs=True):
+    # Rebuilds a full processing result from a stored payload without running the NLP pipeline again
+    result = unpack_result(packed)
+    result.setdefault("warnings", [])
+    result.setdefault("result_id", uuid.uuid4().hex)
+    return _render_outputs(result, render_outputs)
 
 def ask_question_to_document(question, document_text):
     # Placeholder for LLM functionality
@@ -0,0 +1,132 @@
+# result_cache.py
+
+import os
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+from metrics import increment
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHE_BYTES = int(os.environ.get("TRANSFORMO_RESULT_CACHE_MB", "512")) * 1024 * 1024
+MAX_SESSION_BYTES = int(os.environ.get("TRANSFORMO_SESSION_CACHE_MB", "128")) * 1024 * 1024
+
+
+def estimate_result_bytes(result):
+    # Approximate: strings and offset arrays dominate a processed result
+    size = 0
+    for key in ("extracted_text", "json_output", "xml_output"):
+        value = result.get(key)
+        if isinstance(value, str):
+            size += sys.getsizeof(value)
+    document = result.get("document")
+    if document is not None:
+        for name in ("ent_starts", "ent_ends", "ent_labels", "sent_starts", "sent_ends"):
+            values = getattr(document, name)
+            size += len(values) * values.itemsize
+        # The text is shared with extracted_text; only the word counts are extra
+        if document.word_counts:
+            size += 100 * len(document.word_counts)
+    structured = result.get("structured_data")
+    if isinstance(structured, dict):
+        for value in structured.values():
+            if isinstance(value, (list, tuple)):
+                size += 64 * len(value)
+    return size + 4096
+
+
+class ResultCache:
+    """Size-bounded LRU of processed results shared by all sessions.
+
+    Sessions keep only the handle returned by ``put``. Each entry is charged
+    to the session that created it; a session over its own budget evicts its
+    own least recently used entries first, then the global budget evicts
+    across sessions.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, max_session_bytes=MAX_SESSION_BYTES):
+        self.max_bytes = max_bytes
+        self.max_session_bytes = max_session_bytes
+        self._entries = OrderedDict()
+        self._session_bytes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, result, session_id=None):
+        size = estimate_result_bytes(result)
+        handle = secrets.token_hex(8)
+        with self._lock:
+            self._entries[handle] = (result, size, session_id)
+            self._bytes += size
+            self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + size
+            self._evict_session(session_id, keep=handle)
+            self._evict(keep=handle)
+        return handle
+
+    def get(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                increment("result_cache.misses")
+                return None
+            self._entries.move_to_end(handle)
+        increment("result_cache.hits")
+        return entry[0]
+
+    def release(self, handle):
+        with self._lock:
+            self._remove(handle)
+
+    def release_session(self, session_id):
+        with self._lock:
+            for handle in [handle for handle, entry in self._entries.items() if entry[2] == session_id]:
+                self._remove(handle)
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            return self._session_bytes.get(session_id, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "sessions": dict(self._session_bytes),
+            }
+
+    def _remove(self, handle):
+        entry = self._entries.pop(handle, None)
+        if entry is None:
+            return
+        _, size, session_id = entry
+        self._bytes -= size
+        remaining = self._session_bytes.get(session_id, 0) - size
+        if remaining > 0:
+            self._session_bytes[session_id] = remaining
+        else:
+            self._session_bytes.pop(session_id, None)
+
+    def _evict_session(self, session_id, keep):
+        for handle in [handle for handle, entry in self._entries.items() if entry[2] == session_id and handle != keep]:
+            if self._session_bytes.get(session_id, 0) <= self.max_session_bytes:
+                return
+            self._remove(handle)
+            increment("result_cache.evictions")
+
+    def _evict(self, keep):
+        # The newest entry is kept even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            handle = next(iter(self._entries))
+            if handle == keep:
+                self._entries.move_to_end(handle)
+                continue
+            self._remove(handle)
+            increment("result_cache.evictions")
+        if self._bytes > self.max_bytes:
+            logger.warning(f"Result of {self._bytes} bytes exceeds the result cache budget of {self.max_bytes} bytes.")
+
+
+result_cache = ResultCache()
@@ -0,0 +1,29 @@
+# sanitizer.py
+
+import re
+
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+
+# Latin-1 control and whitespace characters (everything below U+00A1 that
+# str.isprintable() rejects) plus the escaped characters. This compact class is
+# what almost every document needs and keeps the regex engine on its fast path.
+_COMMON_SPECIALS = re.compile('[\x00-\x1f\x7f-\xa0\xad&<>]')
+
+
+def _replacement(match):
+    return _ESCAPES.get(match.group(), '')
+
+
+def _is_clean(text):
+    return text.isprintable() and '&' not in text and '<' not in text and '>' not in text
+
+
+def clean_text(text):
+    if _is_clean(text):
+        return text
+    cleaned = _COMMON_SPECIALS.sub(_replacement, text)
+    if not cleaned.isprintable():
+        # Rare: non-printable characters outside Latin-1 (zero-width spaces,
+        # line separators, ...) are filtered per character in C
+        cleaned = ''.join(filter(str.isprintable, cleaned))
+    return cleaned
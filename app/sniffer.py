@@ -0,0 +1,163 @@
+# sniffer.py
+#
+# Detects a document's type from its content rather than its file name. Only
+# the first HEAD_BYTES of the upload are inspected (plus the zip central
+# directory at the end of Office Open XML files), read through the upload's
+# zero-copy buffer, so a mislabelled or corrupt file is rejected before any
+# extractor opens it.
+
+import codecs
+import os
+import struct
+import zipfile
+import mimetypes
+from metrics import increment
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEAD_BYTES = 8192
+# The zip end-of-central-directory record is at most this far from the end of the file
+_ZIP_TAIL_BYTES = 65536 + 22
+
+MAX_DOCUMENT_BYTES = int(os.environ.get("TRANSFORMO_MAX_UPLOAD_MB", "100")) * 1024 * 1024
+MAX_PAGES = int(os.environ.get("TRANSFORMO_MAX_PAGES", "2000"))
+
+PDF = 'application/pdf'
+DOC = 'application/msword'
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+TXT = 'text/plain'
+XLS = 'application/vnd.ms-excel'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_ZIP_MAGIC = b"PK\x03\x04"
+_ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+_ZIP_EOCD = b"PK\x05\x06"
+
+
+def _zip_member_names(view, size):
+    # Names from the local headers in the head, then from the central directory
+    head = bytes(view[:HEAD_BYTES])
+    offset = 0
+    while offset + _ZIP_LOCAL_HEADER.size <= len(head) and head[offset:offset + 4] == _ZIP_MAGIC:
+        _, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack_from(head, offset)
+        start = offset + _ZIP_LOCAL_HEADER.size
+        yield head[start:start + name_length].decode("utf-8", errors="replace")
+        # Compressed sizes in local headers may be deferred to a data descriptor; stop after the first entry
+        # if the next header cannot be located
+        compressed_size = struct.unpack_from("<I", head, offset + 18)[0]
+        if compressed_size == 0:
+            break
+        offset = start + name_length + extra_length + compressed_size
+
+    tail_start = max(0, size - _ZIP_TAIL_BYTES)
+    tail = bytes(view[tail_start:size])
+    eocd = tail.rfind(_ZIP_EOCD)
+    if eocd < 0 or eocd + 22 > len(tail):
+        return
+    directory_size, directory_offset = struct.unpack_from("<II", tail, eocd + 12)
+    directory = bytes(view[directory_offset:directory_offset + directory_size])
+    offset = 0
+    while offset + 46 <= len(directory) and directory[offset:offset + 4] == b"PK\x01\x02":
+        name_length, extra_length, comment_length = struct.unpack_from("<HHH", directory, offset + 28)
+        yield directory[offset + 46:offset + 46 + name_length].decode("utf-8", errors="replace")
+        offset += 46 + name_length + extra_length + comment_length
+
+
+def _sniff_zip(view, size):
+    for name in _zip_member_names(view, size):
+        if name.startswith("word/"):
+            return DOCX
+        if name.startswith("xl/"):
+            return XLSX
+    return None
+
+
+def _sniff_ole2(head, extension_type):
+    # Word and Excel 97-2003 are both OLE2 containers; the stream names are in the directory sector, which
+    # for small files falls inside the head. Otherwise the extension decides between the two.
+    if "WordDocument".encode("utf-16-le") in head:
+        return DOC
+    if "Workbook".encode("utf-16-le") in head or "Book".encode("utf-16-le") in head:
+        return XLS
+    if extension_type in (DOC, XLS):
+        return extension_type
+    return None
+
+
+def _sniff_text(head, truncated):
+    if b"\x00" in head:
+        return None
+    try:
+        # A multi-byte character cut off at the end of the head is not an error
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=not truncated)
+    except UnicodeDecodeError:
+        return None
+    return TXT
+
+
+def sniff(upload):
+    """MIME type of an upload judged by its content, or None if unrecognized.
+
+    ``upload`` is a SpooledUpload. The file name is only used to tell Word
+    from Excel 97-2003 files when their content cannot.
+    """
+    extension_type, _ = mimetypes.guess_type(upload.name)
+    with upload.buffer() as view:
+        head = bytes(view[:HEAD_BYTES])
+        # PDF readers accept the header anywhere in the first 1 KB
+        if b"%PDF-" in head[:1024]:
+            return PDF
+        if head.startswith(_ZIP_MAGIC):
+            return _sniff_zip(view, upload.size)
+        if head.startswith(_OLE2_MAGIC):
+            return _sniff_ole2(head, extension_type)
+        return _sniff_text(head, upload.size > HEAD_BYTES)
+
+
+def count_pages(upload, file_type):
+    """Page count for PDF and DOCX uploads; None when it is not cheaply known.
+
+    PDF pages are counted from the page tree without reading their content;
+    DOCX uses the page count Word stores in docProps/app.xml.
+    """
+    if file_type == PDF:
+        import PyPDF2
+        with upload.stream() as stream:
+            return len(PyPDF2.PdfReader(stream).pages)
+    if file_type == DOCX:
+        with upload.stream() as stream, zipfile.ZipFile(stream) as archive:
+            try:
+                properties = archive.read("docProps/app.xml")
+            except KeyError:
+                return None
+        start = properties.find(b"<Pages>")
+        end = properties.find(b"</Pages>")
+        if start < 0 or end < 0:
+            return None
+        try:
+            return int(properties[start + len("<Pages>"):end])
+        except ValueError:
+            return None
+    return None
+
+
+def check_size(upload, max_bytes=MAX_DOCUMENT_BYTES):
+    if upload.size == 0:
+        raise ValueError(f"'{upload.name}' is empty.")
+    if upload.size > max_bytes:
+        increment("validate.rejected_size")
+        raise ValueError(f"'{upload.name}' is {upload.size} bytes; the limit is {max_bytes} bytes.")
+
+
+def check_pages(upload, file_type, max_pages=MAX_PAGES):
+    # Also rejects PDFs and DOCX files whose structure is corrupt
+    try:
+        pages = count_pages(upload, file_type)
+    except Exception as e:
+        increment("validate.rejected_corrupt")
+        raise ValueError(f"'{upload.name}' is not a readable {file_type} file: {e}")
+    if pages is not None and pages > max_pages:
+        increment("validate.rejected_pages")
+        raise ValueError(f"'{upload.name}' has {pages} pages; the limit is {max_pages} pages.")
@@ -0,0 +1,479 @@
+# storage.py
+#
+# Storage backends for saved documents. A document is stored as a record
+# {"id", "filename", "date", "data"} where "data" is the JSON payload. The
+# backend is chosen with TRANSFORMO_STORAGE:
+#
+#   filesystem  one JSON file per document in the storage directory (default)
+#   sqlite      a table in TRANSFORMO_SQLITE_PATH (default <storage dir>/documents.db)
+#   postgres    a table in the database at TRANSFORMO_POSTGRES_DSN
+#
+# A record may also carry "pages", the page texts of the document (see
+# pages.py). They are stored apart from the payload so get_page can read one
+# page without loading the others.
+#
+# SQL backends keep a pool of open connections, so a request never pays for
+# connecting, and reuse prepared statements; bulk saves are batched into one
+# transaction. A thread that finds every connection in use waits for one.
+# iter_handles streams over its own connection, so loading the documents it
+# yields from other threads never competes with it for the pool.
+#
+# list_metadata lists id, filename and date without reading any payload.
+
+import json
+import os
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+import logging
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get("TRANSFORMO_STORAGE_POOL_SIZE", "4"))
+# Rows fetched per round trip when streaming the whole store
+FETCH_SIZE = 256
+
+BACKENDS = ["filesystem", "sqlite", "postgres"]
+_COLUMNS = ("id", "filename", "date", "data")
+_METADATA_COLUMNS = ("id", "filename", "date")
+# Characters read from the head of a filesystem record to find its metadata
+_HEADER_CHARS = 4096
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Subdirectory of the filesystem store holding page files
+PAGE_DIR = "pages"
+
+
+def _leading_members(text, stop):
+    """Members of the JSON object at the start of ``text`` that precede member ``stop``.
+
+    Only those members are decoded. Raises ValueError if ``text`` ends, or the
+    object does, before ``stop``.
+    """
+    position = _WHITESPACE.match(text).end()
+    if not text.startswith("{", position):
+        raise ValueError("not a JSON object")
+    members = {}
+    while True:
+        key, position = _decoder.raw_decode(text, _WHITESPACE.match(text, position + 1).end())
+        position = _WHITESPACE.match(text, position).end()
+        if not text.startswith(":", position):
+            raise ValueError("expected ':'")
+        if key == stop:
+            return members
+        members[key], position = _decoder.raw_decode(text, _WHITESPACE.match(text, position + 1).end())
+        position = _WHITESPACE.match(text, position).end()
+        if not text.startswith(",", position):
+            raise ValueError(f"no '{stop}' member")
+
+
+def _page_rows(records):
+    # (document id, page number, text) for every page of the records
+    for record in records:
+        for number, text in enumerate(record.get("pages") or (), start=1):
+            yield record["id"], number, text
+
+
+class StorageBackend:
+    """Interface of a document store.
+
+    ``iter_handles`` yields cheap references to every stored document and
+    ``load`` turns one into a record, so callers can load many in parallel
+    (see database.iter_saved_documents).
+    """
+
+    name = None
+
+    def save(self, record):
+        raise NotImplementedError
+
+    def save_many(self, records):
+        for record in records:
+            self.save(record)
+
+    def get(self, document_id):
+        # The record (without its pages), or None if there is no such document
+        raise NotImplementedError
+
+    def get_page(self, document_id, number):
+        # Text of page ``number`` (1-based), or None if the document has no such page
+        raise NotImplementedError
+
+    def get_pages(self, document_id):
+        # All page texts in order; empty if the document was saved without pages
+        raise NotImplementedError
+
+    def list(self):
+        return [record for record in map(self.load, self.iter_handles()) if record is not None]
+
+    def list_metadata(self):
+        # {"id", "filename", "date"} of every document; backends override this to skip the payloads
+        return [{column: record[column] for column in _METADATA_COLUMNS} for record in self.list()]
+
+    def iter_handles(self):
+        raise NotImplementedError
+
+    def load(self, handle):
+        return handle
+
+    def delete(self, document_id):
+        # True if the document existed; its pages are deleted with it
+        raise NotImplementedError
+
+    def count(self):
+        return sum(1 for _ in self.iter_handles())
+
+    def close(self):
+        pass
+
+
+class FileSystemBackend(StorageBackend):
+    name = "filesystem"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.page_directory = os.path.join(directory, PAGE_DIR)
+        os.makedirs(self.page_directory, exist_ok=True)
+
+    def _path(self, document_id):
+        return os.path.join(self.directory, f"{document_id}.json")
+
+    def _page_path(self, document_id):
+        return os.path.join(self.page_directory, f"{document_id}.pages")
+
+    def save(self, record):
+        written = 0
+        pages = record.get("pages")
+        if pages is not None:
+            written += self._write_pages(record["id"], pages)
+        with open(self._path(record["id"]), "w") as f:
+            json.dump({column: record[column] for column in _COLUMNS}, f, indent=4)
+        return written + os.path.getsize(self._path(record["id"]))
+
+    def _write_pages(self, document_id, pages):
+        # A header line with the byte offset of every page, then the pages back to back
+        encoded = [page.encode("utf-8", "surrogatepass") for page in pages]
+        offsets = [0]
+        for page in encoded:
+            offsets.append(offsets[-1] + len(page))
+        with open(self._page_path(document_id), "wb") as f:
+            f.write(json.dumps(offsets).encode() + b"\n")
+            f.writelines(encoded)
+        return os.path.getsize(self._page_path(document_id))
+
+    def get_page(self, document_id, number):
+        try:
+            with open(self._page_path(document_id), "rb") as f:
+                header = f.readline()
+                offsets = json.loads(header)
+                if not 1 <= number < len(offsets):
+                    return None
+                f.seek(len(header) + offsets[number - 1])
+                return f.read(offsets[number] - offsets[number - 1]).decode("utf-8", "surrogatepass")
+        except FileNotFoundError:
+            return None
+
+    def get_pages(self, document_id):
+        try:
+            with open(self._page_path(document_id), "rb") as f:
+                offsets = json.loads(f.readline())
+                content = f.read()
+        except FileNotFoundError:
+            return []
+        return [content[start:end].decode("utf-8", "surrogatepass") for start, end in zip(offsets, offsets[1:])]
+
+    def get(self, document_id):
+        try:
+            with open(self._path(document_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def iter_handles(self):
+        # Index files live in a subdirectory and are never listed
+        return iter([os.path.join(self.directory, filename) for filename in os.listdir(self.directory) if filename.endswith(".json")])
+
+    def load(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            logger.warning(f"Corrupted file detected and skipped: {os.path.basename(path)}")
+        except Exception as e:
+            logger.error(f"Error reading file '{os.path.basename(path)}': {e}")
+        return None
+
+    def list_metadata(self):
+        return [metadata for metadata in map(self._load_metadata, self.iter_handles()) if metadata is not None]
+
+    def _load_metadata(self, path):
+        # save() writes id, filename and date before the payload, so only the head of the file is decoded
+        try:
+            with open(path, "r") as f:
+                members = _leading_members(f.read(_HEADER_CHARS), "data")
+            if all(column in members for column in _METADATA_COLUMNS):
+                return {column: members[column] for column in _METADATA_COLUMNS}
+        except ValueError:
+            pass
+        except Exception as e:
+            logger.error(f"Error reading file '{os.path.basename(path)}': {e}")
+            return None
+        # Another member order, or metadata longer than the head: read the whole file
+        record = self.load(path)
+        return {column: record.get(column) for column in _METADATA_COLUMNS} if record is not None else None
+
+    def delete(self, document_id):
+        try:
+            os.remove(self._page_path(document_id))
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(self._path(document_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+class _ConnectionPool:
+    # Fixed set of connections handed out one thread at a time; callers wait while all are in use
+    def __init__(self, connect, size):
+        self._idle = queue.LifoQueue()
+        self._connections = [connect() for _ in range(size)]
+        for connection in self._connections:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    _SAVE = "INSERT INTO documents (id, filename, date, data) VALUES (?, ?, ?, ?)"
+    _SAVE_PAGE = "INSERT INTO pages (document_id, page, text) VALUES (?, ?, ?)"
+    _GET = "SELECT id, filename, date, data FROM documents WHERE id = ?"
+    _GET_PAGE = "SELECT text FROM pages WHERE document_id = ? AND page = ?"
+    _GET_PAGES = "SELECT text FROM pages WHERE document_id = ? ORDER BY page"
+    _LIST = "SELECT id, filename, date, data FROM documents ORDER BY date"
+    _LIST_METADATA = "SELECT id, filename, date FROM documents ORDER BY date"
+    _DELETE = "DELETE FROM documents WHERE id = ?"
+    _DELETE_PAGES = "DELETE FROM pages WHERE document_id = ?"
+    _COUNT = "SELECT COUNT(*) FROM documents"
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._pool = _ConnectionPool(self._connect, pool_size)
+        with self._pool.connection() as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+                               "date TEXT NOT NULL, data TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS pages (document_id TEXT NOT NULL, page INTEGER NOT NULL, "
+                               "text TEXT NOT NULL, PRIMARY KEY (document_id, page))")
+
+    def _connect(self):
+        # sqlite3 keeps compiled statements per connection (cached_statements), so pooled connections reuse them
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=64)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def save(self, record):
+        self.save_many([record])
+        return len(record["data"]) + sum(map(len, record.get("pages") or ()))
+
+    def save_many(self, records):
+        with self._pool.connection() as connection, connection:
+            connection.executemany(self._SAVE, [tuple(record[column] for column in _COLUMNS) for record in records])
+            connection.executemany(self._SAVE_PAGE, _page_rows(records))
+
+    def get(self, document_id):
+        with self._pool.connection() as connection:
+            row = connection.execute(self._GET, (document_id,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def get_page(self, document_id, number):
+        with self._pool.connection() as connection:
+            row = connection.execute(self._GET_PAGE, (document_id, number)).fetchone()
+        return row[0] if row else None
+
+    def get_pages(self, document_id):
+        with self._pool.connection() as connection:
+            return [row[0] for row in connection.execute(self._GET_PAGES, (document_id,))]
+
+    def iter_handles(self):
+        # Not a pooled connection: the caller loads documents from the pool while this is open
+        connection = self._connect()
+        try:
+            cursor = connection.execute(self._LIST)
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(zip(_COLUMNS, row))
+        finally:
+            connection.close()
+
+    def list_metadata(self):
+        with self._pool.connection() as connection:
+            return [dict(zip(_METADATA_COLUMNS, row)) for row in connection.execute(self._LIST_METADATA)]
+
+    def delete(self, document_id):
+        with self._pool.connection() as connection, connection:
+            connection.execute(self._DELETE_PAGES, (document_id,))
+            return connection.execute(self._DELETE, (document_id,)).rowcount > 0
+
+    def count(self):
+        with self._pool.connection() as connection:
+            return connection.execute(self._COUNT).fetchone()[0]
+
+    def close(self):
+        self._pool.close()
+
+
+if PSYCOPG2_AVAILABLE:
+    class _PreparingConnection(psycopg2.extensions.connection):
+        # Remembers whether this session has prepared the document statements
+        prepared = False
+
+
+class PostgresBackend(StorageBackend):
+    name = "postgres"
+
+    _PREPARE = [
+        "PREPARE transformo_get (text) AS SELECT id, filename, date, data FROM documents WHERE id = $1",
+        "PREPARE transformo_get_page (text, integer) AS SELECT text FROM pages WHERE document_id = $1 AND page = $2",
+        "PREPARE transformo_delete (text) AS DELETE FROM documents WHERE id = $1",
+        "PREPARE transformo_delete_pages (text) AS DELETE FROM pages WHERE document_id = $1",
+    ]
+
+    def __init__(self, dsn, pool_size=POOL_SIZE):
+        if not PSYCOPG2_AVAILABLE:
+            raise ImportError("psycopg2 is required for PostgreSQL storage. Install it with 'pip install psycopg2-binary'.")
+        self.dsn = dsn
+        self._pool = _ConnectionPool(self._connect, pool_size)
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+                           "date TEXT NOT NULL, data TEXT NOT NULL)")
+            cursor.execute("CREATE TABLE IF NOT EXISTS pages (document_id TEXT NOT NULL, page INTEGER NOT NULL, "
+                           "text TEXT NOT NULL, PRIMARY KEY (document_id, page))")
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=_PreparingConnection)
+
+    @contextmanager
+    def _connection(self):
+        with self._pool.connection() as connection:
+            if not connection.prepared:
+                with connection.cursor() as cursor:
+                    for statement in self._PREPARE:
+                        cursor.execute(statement)
+                connection.commit()
+                connection.prepared = True
+            with connection:
+                yield connection
+
+    def save(self, record):
+        self.save_many([record])
+        return len(record["data"]) + sum(map(len, record.get("pages") or ()))
+
+    def save_many(self, records):
+        # One multi-row INSERT per FETCH_SIZE rows
+        with self._connection() as connection, connection.cursor() as cursor:
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO documents (id, filename, date, data) VALUES %s",
+                [tuple(record[column] for column in _COLUMNS) for record in records], page_size=FETCH_SIZE,
+            )
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO pages (document_id, page, text) VALUES %s", list(_page_rows(records)), page_size=FETCH_SIZE,
+            )
+
+    def get(self, document_id):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("EXECUTE transformo_get (%s)", (document_id,))
+            row = cursor.fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def get_page(self, document_id, number):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("EXECUTE transformo_get_page (%s, %s)", (document_id, number))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_pages(self, document_id):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT text FROM pages WHERE document_id = %s ORDER BY page", (document_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def iter_handles(self):
+        # A named (server-side) cursor streams the table instead of loading it at once. It runs on its
+        # own connection, not a pooled one: the caller loads documents from the pool while it is open
+        connection = self._connect()
+        try:
+            with connection, connection.cursor(name="transformo_list") as cursor:
+                cursor.itersize = FETCH_SIZE
+                cursor.execute("SELECT id, filename, date, data FROM documents ORDER BY date")
+                for row in cursor:
+                    yield dict(zip(_COLUMNS, row))
+        finally:
+            connection.close()
+
+    def list_metadata(self):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT id, filename, date FROM documents ORDER BY date")
+            return [dict(zip(_METADATA_COLUMNS, row)) for row in cursor.fetchall()]
+
+    def delete(self, document_id):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("EXECUTE transformo_delete_pages (%s)", (document_id,))
+            cursor.execute("EXECUTE transformo_delete (%s)", (document_id,))
+            return cursor.rowcount > 0
+
+    def count(self):
+        with self._connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM documents")
+            return cursor.fetchone()[0]
+
+    def close(self):
+        self._pool.close()
+
+
+def available_backends():
+    # Backends that can be used in this environment
+    backends = ["filesystem", "sqlite"]
+    if PSYCOPG2_AVAILABLE and os.environ.get("TRANSFORMO_POSTGRES_DSN"):
+        backends.append("postgres")
+    return backends
+
+
+def create_backend(kind, storage_dir):
+    if kind == "filesystem":
+        return FileSystemBackend(storage_dir)
+    if kind == "sqlite":
+        return SQLiteBackend(os.environ.get("TRANSFORMO_SQLITE_PATH") or os.path.join(storage_dir, "documents.db"))
+    if kind == "postgres":
+        dsn = os.environ.get("TRANSFORMO_POSTGRES_DSN")
+        if not dsn:
+            raise ValueError("Set TRANSFORMO_POSTGRES_DSN to use PostgreSQL storage.")
+        return PostgresBackend(dsn)
+    raise ValueError(f"Unknown storage backend: {kind}. Choose one of: {', '.join(BACKENDS)}")
@@ -0,0 +1,274 @@
+# supervisor.py
+#
+# Worker processes with per-job limits. Each worker runs one job at a time
+# and is watched by a supervisor thread in the parent; a job that runs past
+# its wall-clock deadline, is cancelled, or exhausts the worker's address
+# space limit has its worker killed and replaced. Jobs can report progress
+# with checkpoint(); the last checkpoint is attached to the error so callers
+# can return a partial result.
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+from metrics import increment
+import logging
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+JOB_TIMEOUT = float(os.environ.get("TRANSFORMO_JOB_TIMEOUT", "300"))
+WORKER_MEMORY_MB = int(os.environ.get("TRANSFORMO_WORKER_MEMORY_MB", "4096"))
+_POLL_SECONDS = 0.1
+
+# Set in worker processes only
+_connection = None
+
+
+class JobAborted(Exception):
+    """A job stopped before finishing; ``partial`` is its last checkpoint or None."""
+
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+
+class JobTimeout(JobAborted):
+    pass
+
+
+class JobCancelled(JobAborted):
+    pass
+
+
+class JobMemoryError(JobAborted):
+    pass
+
+
+class WorkerCrashed(JobAborted):
+    pass
+
+
+def checkpoint(value):
+    # Sends intermediate output to the supervisor; a no-op outside supervised workers
+    if _connection is not None:
+        _connection.send(("checkpoint", value))
+
+
+def _limit_memory(memory_mb):
+    if not memory_mb or not RESOURCE_AVAILABLE:
+        return
+    limit = memory_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker_main(conn, memory_mb, initializer):
+    global _connection
+    _limit_memory(memory_mb)
+    if initializer is not None:
+        initializer()
+    _connection = conn
+    conn.send(("ready", None))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        fn, args, kwargs = message
+        try:
+            conn.send(("done", fn(*args, **kwargs)))
+        except MemoryError:
+            # Part of the heap may be unusable; report and let the supervisor start a fresh worker
+            conn.send(("memory", None))
+            return
+        except Exception as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                # The exception itself could not be pickled
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _Job:
+    def __init__(self, future, fn, args, kwargs, timeout):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.cancel_requested = threading.Event()
+        self.partial = None
+
+
+class _Worker:
+    # A worker process and the parent's end of its pipe
+    def __init__(self, context, memory_mb, initializer):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, memory_mb, initializer), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SupervisedPool(Executor):
+    """Executor whose jobs run in killable worker processes.
+
+    ``submit`` accepts ``timeout`` (seconds, default TRANSFORMO_JOB_TIMEOUT)
+    besides the job's own arguments. ``cancel(future)`` stops a job whether
+    it is queued or already running.
+    """
+
+    def __init__(self, max_workers, timeout=JOB_TIMEOUT, memory_mb=WORKER_MEMORY_MB, initializer=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        # Runs once per worker before its first job, so start-up (e.g. loading models) isn't charged to a job's deadline
+        self.initializer = initializer
+        # spawn: forking a multi-threaded server is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._supervise, name=f"supervisor-{index}", daemon=True)
+            for index in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, /, *args, timeout=None, **kwargs):
+        if self._shutdown:
+            raise RuntimeError("Cannot submit to a pool that has been shut down.")
+        future = Future()
+        job = _Job(future, fn, args, kwargs, self.timeout if timeout is None else timeout)
+        with self._jobs_lock:
+            self._jobs[future] = job
+        future.add_done_callback(self._forget)
+        self._queue.put(job)
+        return future
+
+    def cancel(self, future):
+        # Queued jobs are cancelled outright; running ones have their worker killed
+        if future.cancel():
+            return True
+        with self._jobs_lock:
+            job = self._jobs.get(future)
+        if job is None:
+            return False
+        job.cancel_requested.set()
+        return True
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._shutdown = True
+        if cancel_futures:
+            with self._jobs_lock:
+                futures = list(self._jobs)
+            for future in futures:
+                self.cancel(future)
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _forget(self, future):
+        with self._jobs_lock:
+            self._jobs.pop(future, None)
+
+    def _start_worker(self):
+        return _Worker(self._context, self.memory_mb, self.initializer)
+
+    def _supervise(self):
+        # One thread per worker: hands it jobs and enforces their limits
+        worker = self._start_worker()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(5)
+                worker.stop()
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if not worker.process.is_alive():
+                worker = self._start_worker()
+            try:
+                outcome = self._run(job, worker)
+            except BaseException as e:
+                outcome = e
+            if isinstance(outcome, JobAborted):
+                increment(f"supervisor.{type(outcome).__name__}")
+                logger.warning(str(outcome))
+                worker.stop()
+                worker = self._start_worker()
+                job.future.set_exception(outcome)
+            elif isinstance(outcome, BaseException):
+                job.future.set_exception(outcome)
+            else:
+                job.future.set_result(outcome[0])
+
+    def _wait_until_ready(self, job, worker):
+        # A new worker reports once its initializer has run; returns a JobAborted if it never does
+        while not worker.ready:
+            if job.cancel_requested.is_set():
+                return JobCancelled("Processing was cancelled.")
+            try:
+                if not worker.conn.poll(_POLL_SECONDS):
+                    continue
+                kind, _ = worker.conn.recv()
+            except (OSError, EOFError):
+                return WorkerCrashed(f"The worker process failed to start (exit code {worker.process.exitcode}).")
+            worker.ready = kind == "ready"
+        return None
+
+    def _run(self, job, worker):
+        # Returns (result,), the job's exception, or a JobAborted
+        aborted = self._wait_until_ready(job, worker)
+        if aborted is not None:
+            return aborted
+        conn = worker.conn
+        try:
+            conn.send((job.fn, job.args, job.kwargs))
+        except (OSError, EOFError):
+            return WorkerCrashed("The worker process exited before the job started.")
+        deadline = time.monotonic() + job.timeout if job.timeout else None
+        while True:
+            if job.cancel_requested.is_set():
+                return JobCancelled("Processing was cancelled.", job.partial)
+            if deadline is not None and time.monotonic() >= deadline:
+                return JobTimeout(f"Processing exceeded the time limit of {job.timeout:g} seconds.", job.partial)
+            try:
+                if not conn.poll(_POLL_SECONDS):
+                    continue
+                kind, value = conn.recv()
+            except (OSError, EOFError):
+                return WorkerCrashed(f"The worker process exited unexpectedly (exit code {worker.process.exitcode}).", job.partial)
+            if kind == "checkpoint":
+                job.partial = value
+            elif kind == "done":
+                return (value,)
+            elif kind == "memory":
+                return JobMemoryError(f"Processing exceeded the memory limit of {self.memory_mb} MB.", job.partial)
+            else:
+                return value
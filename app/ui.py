@@ -1,21 +1,39 @@
 import streamlit as st
 import plotly.express as px
-import plotly.graph_objects as go
 import pandas as pd
-from extractor import validate_document, extract_text
-from processor import process_document, ask_question_to_document
-from database import save_to_database, get_saved_documents, delete_document
+from processor import output_size, restore_result, ask_question_to_document
+from database import save_to_database, get_saved_documents, delete_document, find_duplicates, dedup_report, corpus_entity_index
+from compact import materialize_result
+from formats import BINARY_FORMATS, PARQUET_AVAILABLE, binary_formats
+from corpus_export import export_corpus
+from batch import cancel_jobs, file_result, submit_batch, wait_for_batch
+from exporter import export_preview, export_url, register_export, start_export_server, write_export
+from metrics import merge_trace, get_stage_stats, get_counters, get_recent_traces, render_prometheus, reset_metrics, start_metrics_server, write_metrics_file
+from result_cache import result_cache
+from storage import BACKENDS, available_backends
+import database
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from collections import namedtuple
 from datetime import datetime
 import json
 from PIL import Image
 import io
 import requests
 import os
+import shutil
+import tempfile
+import time
+
+STORAGE_LABELS = {"filesystem": "Local Storage", "sqlite": "SQLite", "postgres": "PostgreSQL"}
+
+# Name and size of an uploaded file; kept in session state instead of the upload itself
+FileInfo = namedtuple("FileInfo", ["name", "size"])
 
 # Function to calculate file sizes
 def calculate_file_sizes(uploaded_file, result):
+    # The upload size is recorded at upload time; the JSON size is counted once, when first needed, and kept with the result
     original_size_mb = uploaded_file.size / (1024 * 1024)
-    extracted_size_mb = len(json.dumps(result['json_output'])) / (1024 * 1024)
+    extracted_size_mb = output_size(result, 'json') / (1024 * 1024)
     return original_size_mb, extracted_size_mb
 
 # Function to load and display the logo
@@ -40,6 +58,7 @@ def load_logo():
 # Main page setup function
 def setup_page():
     st.set_page_config(page_title="Transformo-Docs", layout="wide")
+    start_metrics_server()
     
     # Load and display logo
     logo = load_logo()
@@ -50,7 +69,9 @@ def setup_page():
         "Home": home_page,
         "Upload Document and Processing": document_processing_page,
         "Saved Documents Storage": saved_documents_page,
+        "Corpus Analytics": corpus_analytics_page,
         "Chat Interface": chat_interface_page,
+        "Performance": performance_page,
     }
     page = st.sidebar.radio("Navigate", list(pages.keys()))
     pages[page]()
@@ -119,7 +140,7 @@ def home_page():
 def document_processing_page():
     st.title("🔄 Document Processing")
     
-    uploaded_file = upload_document()
+    uploaded_files = upload_document()
     template = st.selectbox(
         "Choose a template for extraction",
         ["Default", "Data Only", "Analytics Only", "Specific Entities"],
@@ -130,74 +151,278 @@ def document_processing_page():
         ["Persons", "Organizations", "Locations", "Dates"],
         help="Choose specific entity types you want to extract from the document."
     )
+    incremental = st.checkbox(
+        "Incremental processing",
+        value=False,
+        help="Reuse NLP results for paragraphs that were already processed, e.g. when re-uploading a revised document."
+    )
+    reuse_duplicates = st.checkbox(
+        "Reuse saved results for duplicate documents",
+        value=True,
+        help="Skip processing when an identical document was already saved with the same template and fields."
+    )
     
-    result = None
+    template = template.lower().replace(" ", "_") if template != "Default" else None
+    custom_fields = [field.lower() for field in custom_fields] if custom_fields else None
+    options_key = (template, tuple(custom_fields or ()), incremental, reuse_duplicates)
+    if len(uploaded_files) > 1:
+        process_batch(uploaded_files, template, custom_fields, incremental, reuse_duplicates, options_key)
+        return
+    uploaded_file = uploaded_files[0] if uploaded_files else None
+    
+    # Streamlit reruns the page on every interaction; a document is only processed again when it or the options change
+    processed = st.session_state.get("processed")
     if uploaded_file is not None:
-        with st.spinner("Processing document..."):
-            try:
-                # Validate and extract text from the document
-                file_type = validate_document(uploaded_file)
-                extracted_text = extract_text(uploaded_file, file_type)
-                
-                # Process the document with selected template and custom fields
-                template = template.lower().replace(" ", "_") if template != "Default" else None
-                custom_fields = [field.lower() for field in custom_fields] if custom_fields else None
-                result = process_document(extracted_text, template, custom_fields)
-                
-                if result["warnings"]:
-                    st.warning("Processing completed with warnings:")
-                    for warning in result["warnings"]:
-                        st.write(warning)
-                else:
-                    st.success("Document processed successfully!")
-                
-                # Save result in session state
-                st.session_state.result = result
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-
-    if 'result' in st.session_state:
-        display_export_options(st.session_state.result, uploaded_file)
-        display_analytics(st.session_state.result)
-        display_graphs(st.session_state.result, uploaded_file)
-        display_database_options(st.session_state.result, uploaded_file.name)
+        processing_key = (upload_key(uploaded_file), options_key)
+        if st.session_state.get("cancelled") == processing_key:
+            st.info("Processing was cancelled. Upload the file again or change the options to restart it.")
+            return
+        if processed is None or processed["key"] != processing_key or result_cache.get(processed["handle"]) is None:
+            result = process_single(uploaded_file, template, custom_fields, incremental, reuse_duplicates, processing_key)
+            if result is not None:
+                # Session state keeps only a handle; the result lives in the shared server-side cache
+                if processed is not None:
+                    result_cache.release(processed["handle"])
+                processed = st.session_state.processed = {
+                    "key": processing_key,
+                    "handle": result_cache.put(result, session_id()),
+                    "file": FileInfo(uploaded_file.name, uploaded_file.size),
+                }
+    
+    if processed is not None:
+        result = result_cache.get(processed["handle"])
+        if result is None:
+            st.warning("The processed result was evicted from the server cache. Upload the document again to process it.")
+            return
+        if result["warnings"]:
+            st.warning("Processing completed with warnings:")
+            for warning in result["warnings"]:
+                st.write(warning)
+        else:
+            st.success("Document processed successfully!")
+        display_export_options(result, processed["file"])
+        display_analytics(result)
+        display_graphs(result, processed["file"])
+        display_database_options(result, processed["file"].name)
+        display_session_memory()
+
+# Function to identify an upload across reruns
+def upload_key(uploaded_file):
+    return (getattr(uploaded_file, "file_id", None), uploaded_file.name, uploaded_file.size)
+
+# Function to get the id of the current browser session, used for result cache accounting
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+# Function to show how much of the shared result cache this session uses
+def display_session_memory():
+    used = result_cache.session_bytes(session_id())
+    st.caption(f"Results of this session use {used / (1024 * 1024):.1f} MB of the server cache "
+               f"(limit {result_cache.max_session_bytes / (1024 * 1024):.0f} MB per session).")
+
+# Function to remember that the user cancelled processing; the next rerun stops the running script
+def cancel_processing(key):
+    st.session_state.cancelled = key
+
+# Function to process one upload in a supervised worker process, with a cancel button while it runs
+def process_single(uploaded_file, template, custom_fields, incremental, reuse_duplicates, processing_key):
+    status = st.empty()
+    cancel_slot = st.empty()
+    cancel_slot.button("Cancel processing", on_click=cancel_processing, args=(processing_key,))
+    # Large uploads are spooled to disk and handed to the worker by path
+    jobs = submit_batch([uploaded_file], template, custom_fields, incremental, reuse_duplicates)
+    started = time.perf_counter()
+    try:
+        wait_for_batch(jobs, on_poll=lambda: status.info(f"Processing {uploaded_file.name}... {time.perf_counter() - started:.0f} s"))
+        packed, trace, reused = file_result(jobs[0][3], uploaded_file.name, template, custom_fields)
+    except Exception as e:
+        st.error(f"Error: {str(e)}")
+        return None
+    finally:
+        # Also reached when a cancel click stops this script run; the worker is killed
+        cancel_jobs(jobs)
+        for _, _, upload, _ in jobs:
+            upload.close()
+        status.empty()
+        cancel_slot.empty()
+    merge_trace(trace)
+    write_metrics_file()
+    # Nothing is recomputed here: export sizes are counted on demand and the duplicate lookup
+    # uses the fingerprint the worker computed (partial results have none)
+    result = restore_result(packed, render_outputs=False)
+    if reused:
+        st.info(f"Reused the saved result of '{reused}', an identical document.")
+    if result.get("fingerprint") is not None:
+        show_duplicates(find_duplicates(fingerprint=result["fingerprint"]))
+    return result
+
+# Function to list saved documents that duplicate the current one
+def show_duplicates(duplicates):
+    if not duplicates:
+        return
+    with st.expander(f"Similar saved documents ({len(duplicates)})"):
+        st.dataframe(pd.DataFrame([
+            {
+                "Filename": match["filename"],
+                "Similarity": f"{match['similarity']:.0%}",
+                "Match": "Exact" if match["exact"] else "Near-duplicate",
+            }
+            for match in duplicates
+        ]))
 
 # Function to handle document upload
 def upload_document():
     st.subheader("📤 Upload Document")
-    if 'uploaded_file' not in st.session_state:
-        st.session_state.uploaded_file = None
+    uploaded_files = st.file_uploader("Choose files", type=["pdf", "doc", "docx", "txt", "xlsx"], accept_multiple_files=True)
     
-    uploaded_file = st.file_uploader("Choose a file", type=["pdf", "docx", "txt", "xlsx"])
+    if uploaded_files:
+        if len(uploaded_files) == 1:
+            st.info(f"File '{uploaded_files[0].name}' uploaded successfully. Choose a template and custom fields for extraction.")
+        else:
+            st.info(f"{len(uploaded_files)} files uploaded successfully. They are processed in parallel.")
     
-    if uploaded_file is not None:
-        st.session_state.uploaded_file = uploaded_file
-        st.info(f"File '{uploaded_file.name}' uploaded successfully. Choose a template and custom fields for extraction.")
+    # Uploads are not kept in session state; processed results are referenced by cache handle instead
+    return uploaded_files or []
+
+# Function to process several uploaded files in parallel worker processes
+def process_batch(uploaded_files, template, custom_fields, incremental, reuse_duplicates, options_key):
+    # Streamlit reruns the page on every interaction; a batch is only processed again when files or options change
+    batch_key = (tuple(upload_key(file) for file in uploaded_files), options_key)
+    batch = st.session_state.get("batch")
+    if st.session_state.get("cancelled") == batch_key:
+        st.info("Processing was cancelled. Upload the files again or change the options to restart it.")
+        return
+    if batch is None or batch["key"] != batch_key:
+        st.subheader("⚙️ Processing")
+        cancel_slot = st.empty()
+        cancel_slot.button("Cancel processing", on_click=cancel_processing, args=(batch_key,))
+        overall = st.progress(0, text="Starting workers...")
+        bars = [st.progress(0, text=f"{file.name} - queued") for file in uploaded_files]
+        elapsed = st.empty()
+        started = time.perf_counter()
+        jobs = submit_batch(uploaded_files, template, custom_fields, incremental, reuse_duplicates)
+        finished = []
+        
+        def on_update(index, state):
+            name = jobs[index][0]
+            if state == "running":
+                bars[index].progress(50, text=f"{name} - processing")
+            elif state == "done":
+                failed = jobs[index][3].exception() is not None
+                bars[index].progress(100, text=f"{name} - {'failed' if failed else 'done'}")
+                finished.append(index)
+                overall.progress(len(finished) / len(jobs), text=f"{len(finished)} of {len(jobs)} files processed")
+        
+        items, errors = [], []
+        try:
+            wait_for_batch(jobs, on_update, on_poll=lambda: elapsed.caption(f"{time.perf_counter() - started:.0f} s elapsed"))
+            for name, size, _, future in jobs:
+                try:
+                    packed, trace, reused = file_result(future, name, template, custom_fields)
+                except Exception as e:
+                    errors.append({"File": name, "Error": str(e)})
+                    continue
+                merge_trace(trace)
+                handle = result_cache.put(restore_result(packed, render_outputs=False), session_id())
+                items.append({"file": FileInfo(name, size), "handle": handle, "reused": reused})
+        finally:
+            cancel_jobs(jobs)
+            for _, _, upload, _ in jobs:
+                upload.close()
+            cancel_slot.empty()
+            elapsed.empty()
+        write_metrics_file()
+        if batch is not None:
+            for item in batch["items"]:
+                result_cache.release(item["handle"])
+        batch = st.session_state.batch = {"key": batch_key, "items": items, "errors": errors}
+    
+    display_batch_results(batch)
+
+# Function to display aggregated batch results, per-file errors and per-file details
+def display_batch_results(batch):
+    errors = list(batch["errors"])
+    results = []
+    for item in batch["items"]:
+        result = result_cache.get(item["handle"])
+        if result is None:
+            errors.append({"File": item["file"].name, "Error": "Result evicted from the server cache; upload the file again."})
+        else:
+            results.append((item, result))
+    st.subheader("📋 Batch Results")
+    if results:
+        st.success(f"{len(results)} of {len(batch['items']) + len(batch['errors'])} files processed successfully.")
+    summary = pd.DataFrame([
+        {
+            "File": item["file"].name,
+            "Words": result["analytics"]["word_count"],
+            "Sentences": result["analytics"]["sentence_count"],
+            "Entities": result["analytics"]["entity_count"],
+            "Keywords": result["analytics"]["keyword_count"],
+            "Warnings": len(result["warnings"]),
+            "Reused From": item["reused"] or "",
+        }
+        for item, result in results
+    ])
+    if not summary.empty:
+        st.dataframe(summary, use_container_width=True)
+        totals = summary[["Words", "Sentences", "Entities", "Keywords"]].sum()
+        st.write(f"**Total:** {totals['Words']} words, {totals['Sentences']} sentences, {totals['Entities']} entities")
+    if errors:
+        st.error(f"{len(errors)} files failed:")
+        st.dataframe(pd.DataFrame(errors), use_container_width=True)
+    if not results:
+        return
     
-    return st.session_state.uploaded_file
+    if st.button("Save All to Local Storage"):
+        for item, result in results:
+            save_to_database(result, item["file"].name)
+        st.success(f"{len(results)} documents saved to local storage successfully!")
+    
+    selected = st.selectbox("Show details for", range(len(results)), format_func=lambda i: results[i][0]["file"].name)
+    item, result = results[selected]
+    display_export_options(result, item["file"])
+    display_analytics(result)
+    display_graphs(result, item["file"])
+    display_session_memory()
 
 # Function to display export options
 def display_export_options(result, uploaded_file):
     st.subheader("💾 Export Options")
-    export_format = st.selectbox("Choose export format", ["JSON", "XML"])
-    
-    if export_format == "JSON":
-        download_content = result['json_output']
-        file_extension = "json"
-    else:
-        download_content = result['xml_output']
-        file_extension = "xml"
-
+    formats = {"JSON": "json", "XML": "xml", "JSON Lines": "jsonl"}
+    formats.update({name: extension for name, extension in (("Parquet", "parquet"), ("MessagePack", "msgpack")) if extension in binary_formats()})
+    export_format = st.selectbox("Choose export format", list(formats.keys()))
+    file_extension = formats[export_format]
     download_filename = f"{uploaded_file.name}_processed.{file_extension}"
-    st.download_button(
-        label=f"Download {export_format} File",
-        data=download_content,
-        file_name=download_filename,
-        mime=f"application/{file_extension}"
-    )
+    
+    # Exports are streamed chunk by chunk and never built as one string
+    if start_export_server():
+        url = export_url(register_export(result, file_extension, download_filename))
+        st.markdown(f"[Download {export_format} File]({url})")
+    # Without the export server the file is only written once a download is asked for, not on every rerun
+    elif st.button(f"Prepare {export_format} Download", key=f"prepare_{result['result_id']}_{file_extension}"):
+        export_path = write_export(result, file_extension)
+        try:
+            result.setdefault("output_sizes", {})[file_extension] = os.path.getsize(export_path)
+            with open(export_path, "rb") as f:
+                st.download_button(
+                    label=f"Download {export_format} File",
+                    data=f,
+                    file_name=download_filename,
+                    mime=BINARY_FORMATS.get(file_extension, f"application/{file_extension}")
+                )
+        finally:
+            os.remove(export_path)
 
     with st.expander("View Processed Output"):
-        st.code(download_content, language=file_extension.lower())
+        if file_extension in BINARY_FORMATS:
+            st.write(f"{export_format} is a binary format; download the file to inspect it.")
+            return
+        preview, truncated = export_preview(result, file_extension)
+        if truncated:
+            st.caption(f"Showing the first {len(preview):,} characters. Download the file for the full output.")
+        st.code(preview, language="json" if file_extension == "jsonl" else file_extension)
 
 # Function to display analytics
 def display_analytics(result):
@@ -219,6 +444,10 @@ def display_analytics(result):
     with col2:
         st.markdown("### 🔑 Keywords")
         st.write(f"**Keyword Count:** {result['analytics']['keyword_count']}")
+        if result['analytics'].get('top_keywords'):
+            st.write("**Top Keywords (TF-IDF):**")
+            for keyword, score in result['analytics']['top_keywords']:
+                st.write(f"- {keyword}: {score:.4f}")
 
         st.markdown("### 📊 Word Frequency")
         st.write("**Most Common Words:**")
@@ -226,94 +455,143 @@ def display_analytics(result):
             st.write(f"- {word}: {count}")
 
     with st.expander("📝 Document Preview"):
-        preview_text = result['extracted_text'][:500] + "..." if len(result['extracted_text']) > 500 else result['extracted_text']
-        st.text_area("First 500 characters", preview_text, height=200)
-
-# Function to display graphs
-def display_graphs(result, uploaded_file):
-    st.subheader("📈 Visualizations")
-    col1, col2 = st.columns(2)
-
-    with col1:
-        # Word Frequency Graph
-        word_freq = result['analytics']['most_common_words'][:10]  # Top 10 words
-        fig = px.bar(
-            x=[word for word, _ in word_freq],
-            y=[count for _, count in word_freq],
-            labels={'x': 'Word', 'y': 'Frequency'},
-            title='Top 10 Most Frequent Words'
-        )
-        st.plotly_chart(fig, use_container_width=True)
-
-    with col2:
-        # Named Entities Graph
-        entity_freq = result['analytics']['most_common_entities'][:10]  # Top 10 entities
-        fig = px.bar(
-            x=[entity for entity, _ in entity_freq],
-            y=[count for _, count in entity_freq],
-            labels={'x': 'Entity', 'y': 'Frequency'},
-            title='Top 10 Most Common Named Entities'
+        if result.get("document") is None:
+            preview_text = result['extracted_text'][:500] + "..." if len(result['extracted_text']) > 500 else result['extracted_text']
+            st.text_area("First 500 characters", preview_text, height=200)
+        else:
+            display_page_viewer(result)
+
+# Function to show one page of a processed document; the entity picker jumps to the page an entity is on
+def display_page_viewer(result):
+    document = result["document"]
+    page_key = f"page_{result['result_id']}"
+    entity_key = f"entity_{result['result_id']}"
+    st.session_state.setdefault(page_key, 1)
+    
+    # One entry per distinct entity, at its first mention
+    first_mentions = {}
+    for index, label_id in enumerate(document.ent_labels):
+        first_mentions.setdefault((document.entity_text(index), label_id), index)
+    if first_mentions:
+        st.selectbox(
+            "Jump to entity",
+            [None] + sorted(first_mentions.values(), key=lambda i: (document.entity_text(i).lower(), i)),
+            format_func=lambda i: "-" if i is None else f"{document.entity_text(i)} ({document.labels[document.ent_labels[i]]}), page {document.page_of(document.ent_starts[i])}",
+            key=entity_key,
+            on_change=jump_to_entity,
+            args=(document, entity_key, page_key),
         )
-        st.plotly_chart(fig, use_container_width=True)
-
-    # Basic Metrics Graph
+    if document.page_count > 1:
+        st.number_input("Page", min_value=1, max_value=document.page_count, step=1, key=page_key)
+    number = min(st.session_state[page_key], document.page_count)
+    entities, _ = document.page_spans(number)
+    display_page(number, document.page_count, document.page_text(number), entities)
+
+# Function to move the page viewer to the page of the selected entity
+def jump_to_entity(document, entity_key, page_key):
+    index = st.session_state[entity_key]
+    if index is not None:
+        st.session_state[page_key] = document.page_of(document.ent_starts[index])
+
+# Function to render a page of text and the entities found on it
+def display_page(number, page_count, text, entities):
+    st.text_area(f"Page {number} of {page_count}", text, height=300, disabled=True)
+    if entities:
+        st.caption("Entities on this page: " + ", ".join(f"{entity['text']} ({entity['label']})" for entity in entities))
+
+# Function to build chart specs once per result; Streamlit reruns reuse the cached plain-dict figures
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_chart_specs(result_id, _analytics):
+    def bar_chart(title, x, y, x_title, y_title):
+        return {
+            "data": [{"type": "bar", "x": x, "y": y}],
+            "layout": {"title": {"text": title}, "xaxis": {"title": {"text": x_title}}, "yaxis": {"title": {"text": y_title}}},
+        }
+    
+    word_freq = _analytics['most_common_words'][:10]  # Top 10 words
+    entity_freq = _analytics['most_common_entities'][:10]  # Top 10 entities
     metrics = {
-        'Word Count': result['analytics']['word_count'],
-        'Sentence Count': result['analytics']['sentence_count'],
-        'Avg Sentence Length': round(result['analytics']['average_sentence_length'], 2)
+        'Word Count': _analytics['word_count'],
+        'Sentence Count': _analytics['sentence_count'],
+        'Avg Sentence Length': round(_analytics['average_sentence_length'], 2)
+    }
+    return {
+        "Word Frequency": bar_chart('Top 10 Most Frequent Words', [word for word, _ in word_freq], [count for _, count in word_freq], 'Word', 'Frequency'),
+        "Named Entities": bar_chart('Top 10 Most Common Named Entities', [entity for entity, _ in entity_freq], [count for _, count in entity_freq], 'Entity', 'Frequency'),
+        "Basic Metrics": {
+            "data": [{"type": "bar", "name": metric, "x": [metric], "y": [value]} for metric, value in metrics.items()],
+            "layout": {"title": {"text": 'Basic Document Metrics'}, "barmode": "group"},
+        },
     }
-    fig = go.Figure(data=[
-        go.Bar(name=metric, x=[metric], y=[value])
-        for metric, value in metrics.items()
-    ])
-    fig.update_layout(title_text='Basic Document Metrics', barmode='group')
-    st.plotly_chart(fig, use_container_width=True)
-
-    # File Size Comparison Graph
-    original_size, extracted_size = calculate_file_sizes(uploaded_file, result)
-    size_diff = original_size - extracted_size
-    size_diff_percentage = (size_diff / original_size) * 100
 
-    fig = go.Figure(data=[
-        go.Bar(name='Original Size', x=['Document Size'], y=[original_size]),
-        go.Bar(name='Extracted Size', x=['Document Size'], y=[extracted_size])
-    ])
-    fig.update_layout(title_text='Document Size Comparison (MB)', barmode='group')
-    st.plotly_chart(fig, use_container_width=True)
+# Function to build the size comparison chart; the export size behind it is only counted when this chart is shown
+def build_size_chart(original_size, extracted_size):
+    return {
+        "data": [
+            {"type": "bar", "name": 'Original Size', "x": ['Document Size'], "y": [original_size]},
+            {"type": "bar", "name": 'Extracted Size', "x": ['Document Size'], "y": [extracted_size]},
+        ],
+        "layout": {"title": {"text": 'Document Size Comparison (MB)'}, "barmode": "group"},
+    }
 
-    st.info(f"Size reduction: {size_diff:.2f} MB ({size_diff_percentage:.2f}%)")
+# Function to display graphs
+def display_graphs(result, uploaded_file):
+    st.subheader("📈 Visualizations")
+    specs = build_chart_specs(result['result_id'], result['analytics'])
+    
+    # Only the selected chart is sent to the browser
+    chart = st.radio("Chart", ["Hidden"] + list(specs.keys()) + ["Document Size"], horizontal=True, key=f"chart_{result['result_id']}")
+    if chart in specs:
+        st.plotly_chart(specs[chart], use_container_width=True)
+    if chart == "Document Size":
+        original_size, extracted_size = calculate_file_sizes(uploaded_file, result)
+        st.plotly_chart(build_size_chart(original_size, extracted_size), use_container_width=True)
+        size_diff = original_size - extracted_size
+        size_diff_percentage = (size_diff / original_size) * 100 if original_size else 0.0
+        st.info(f"Size reduction: {size_diff:.2f} MB ({size_diff_percentage:.2f}%)")
     
     # Keyword Information
-    st.subheader("🔑 Keyword Information")
-    st.write(f"**Total Keywords:** {result['analytics']['keyword_count']}")
-    st.write("**Top Keywords:**")
-    keyword_data = pd.DataFrame(result['analytics']['most_common_words'], columns=['Keyword', 'Count'])
-    st.dataframe(keyword_data)
+    with st.expander("🔑 Keyword Information"):
+        st.write(f"**Total Keywords:** {result['analytics']['keyword_count']}")
+        st.write("**Top Keywords:**")
+        keyword_data = pd.DataFrame(result['analytics']['most_common_words'], columns=['Keyword', 'Count'])
+        st.dataframe(keyword_data)
 
 # Function to display database options
 def display_database_options(result, filename):
     st.subheader("💽 Database Options")
-    st.info("Choose a database to save the processed document. Currently, only local storage is available.")
-    database_options = ["Local Storage", "MongoDB (Disabled)", "PostgreSQL (Disabled)", "MySQL (Disabled)"]
-    selected_db = st.selectbox("Select Database", database_options)
+    active = STORAGE_LABELS[database.STORAGE_BACKEND]
+    st.info(f"Documents are saved to {active}. The store is chosen with the TRANSFORMO_STORAGE environment variable.")
+    database_options = [STORAGE_LABELS[backend] for backend in BACKENDS] + ["MongoDB (Disabled)", "MySQL (Disabled)"]
+    selected_db = st.selectbox("Select Database", database_options, index=database_options.index(active))
     
-    if selected_db == "Local Storage":
-        if st.button("Save to Local Storage"):
+    if selected_db == active:
+        if st.button(f"Save to {active}"):
             save_to_database(result, filename)
-            st.success("Document saved to local storage successfully!")
+            st.success(f"Document saved to {active} successfully!")
+    elif selected_db in STORAGE_LABELS.values():
+        backend = next(backend for backend, label in STORAGE_LABELS.items() if label == selected_db)
+        if backend in available_backends():
+            st.warning(f"Restart the app with TRANSFORMO_STORAGE={backend} to save to {selected_db}.")
+        else:
+            st.warning(f"{selected_db} is not configured. Install psycopg2 and set TRANSFORMO_POSTGRES_DSN to use it.")
     else:
         st.warning("Selected database option is currently disabled.")
 
 # Function for saved documents page
 def saved_documents_page():
     st.title("💾 Saved Documents")
-    st.info("This page displays all documents saved in the local storage.")
+    st.info(f"This page displays all documents saved in {STORAGE_LABELS[database.STORAGE_BACKEND]}.")
     
     documents = get_saved_documents()
     if not documents:
         st.warning("No saved documents found.")
         return
     
+    display_dedup_report()
+    display_corpus_export()
+    display_saved_page_viewer(documents)
+    
     df = pd.DataFrame(documents)
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date', ascending=False)
@@ -324,12 +602,12 @@ def saved_documents_page():
             st.write(f"**{row['filename']}** - {row['date'].strftime('%Y-%m-%d %H:%M:%S')}")
         with col2:
             if st.button("Preview", key=f"preview_{row['id']}"):
-                st.json(row['data'])
+                st.json(materialize_result(database.load_payload(row)))
         with col3:
             if st.button("Download", key=f"download_{row['id']}"):
                 st.download_button(
                     label="Download JSON",
-                    data=row['data'],
+                    data=json.dumps(materialize_result(database.load_payload(row)), indent=2, ensure_ascii=False),
                     file_name=f"{row['filename']}_processed.json",
                     mime="application/json"
                 )
@@ -339,6 +617,99 @@ def saved_documents_page():
                 st.experimental_rerun()
 
 
+# Function to read saved documents page by page; only the page shown is loaded from storage
+def display_saved_page_viewer(documents):
+    with st.expander("Page Viewer"):
+        by_id = {document["id"]: document for document in documents}
+        document_id = st.selectbox("Document", list(by_id), format_func=lambda i: f"{by_id[i]['filename']} - {by_id[i]['date'][:19]}",
+                                   key="saved_page_document")
+        page_count = json.loads(by_id[document_id]["data"]).get("page_count", 1)
+        number = st.number_input("Page", min_value=1, max_value=max(page_count, 1), step=1, key=f"saved_page_{document_id}")
+        try:
+            page = database.get_document_page(document_id, number)
+        except Exception as e:
+            st.error(f"Could not load page {number}: {e}")
+            return
+        display_page(page["page"], page["page_count"], page["text"], page["entities"])
+
+# Function to export all saved documents as one dataset
+def display_corpus_export():
+    with st.expander("Export All Documents"):
+        st.write("Exports documents, entities and sentences as tables partitioned by save date, packed in a ZIP archive.")
+        formats = {"JSON Lines": "jsonl"}
+        if PARQUET_AVAILABLE:
+            formats = {"Parquet": "parquet", **formats}
+        export_format = st.selectbox("Dataset format", list(formats.keys()))
+        if st.button("Export Corpus"):
+            with st.spinner("Exporting documents..."), tempfile.TemporaryDirectory() as export_dir:
+                summary = export_corpus(os.path.join(export_dir, "corpus"), formats[export_format])
+                archive = shutil.make_archive(os.path.join(export_dir, "corpus"), "zip", summary["output_dir"])
+                rows = summary["rows"]
+                st.success(f"Exported {rows['documents']} documents, {rows['entities']} entities and {rows['sentences']} sentences.")
+                with open(archive, "rb") as f:
+                    st.download_button(
+                        label="Download Corpus",
+                        data=f,
+                        file_name=f"transformo_corpus_{datetime.now().strftime('%Y%m%d')}.zip",
+                        mime="application/zip"
+                    )
+
+# Function to show groups of duplicate documents in the store
+def display_dedup_report():
+    report = dedup_report()
+    with st.expander(f"Duplicate Report ({len(report)} groups)"):
+        if not report:
+            st.write("No duplicate documents found.")
+        for group in report:
+            kind = "Identical" if group["exact"] else "Near-duplicates"
+            st.write(f"**{kind}:** " + ", ".join(document["filename"] for document in group["documents"]))
+
+# Function for corpus-level entity analytics, answered from the entity index
+def corpus_analytics_page():
+    st.title("🗂️ Corpus Analytics")
+    st.info("Entities aggregated across all saved documents.")
+    
+    index = corpus_entity_index()
+    summary = index.label_summary()
+    if not summary:
+        st.warning("No entities found in saved documents.")
+        return
+    
+    st.subheader("🏷️ Entity Types")
+    summary_df = pd.DataFrame(summary).rename(columns={
+        "label": "Label", "entities": "Distinct Entities", "mentions": "Mentions", "documents": "Documents"
+    })
+    st.dataframe(summary_df, use_container_width=True)
+    
+    st.subheader("🔝 Top Entities")
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        label = st.selectbox("Entity type", ["All"] + index.labels())
+    with col2:
+        limit = st.slider("Number of entities", 5, 50, 10)
+    label = None if label == "All" else label
+    top = index.top_entities(label, limit)
+    if top:
+        top_df = pd.DataFrame(top)
+        fig = px.bar(top_df, x="text", y="mentions", color="label", title="Most Mentioned Entities")
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(top_df.rename(columns={
+            "label": "Label", "text": "Entity", "mentions": "Mentions", "documents": "Documents"
+        }), use_container_width=True)
+    
+    st.subheader("🔍 Find Documents")
+    query = st.text_input("Entity name", help="Matches entity names containing this text.")
+    if query:
+        matches = index.search(query, label)
+        if not matches:
+            st.write("No matching entities.")
+        for match in matches:
+            with st.expander(f"{match['text']} ({match['label']}) - {match['documents']} documents"):
+                documents = index.documents_mentioning(match["text"], match["label"])
+                st.dataframe(pd.DataFrame(documents).rename(columns={
+                    "id": "ID", "filename": "Filename", "date": "Date", "mentions": "Mentions"
+                }), use_container_width=True)
+
 # Function for chat interface page
 def chat_interface_page():
     st.title("💬 Chat with Your Document")
@@ -358,7 +729,7 @@ def chat_interface_page():
     user_query = st.text_input("Ask a question about the document:")
 
     if user_query:
-        document_text = json.loads(selected_data['data'])['extracted_text']
+        document_text = database.load_payload(selected_data)['extracted_text']
         answer = ask_question_to_document(user_query, document_text)
         st.session_state["chat_history"].append({"question": user_query, "answer": answer})
 
@@ -372,6 +743,62 @@ def chat_interface_page():
         st.session_state["chat_history"] = []
         st.success("Chat history cleared!")
 
+# Function for the performance metrics page
+def performance_page():
+    st.title("⏱️ Performance")
+    st.info("Per-stage timings and counters collected by this server process since it started.")
+
+    stages = get_stage_stats()
+    if not stages:
+        st.warning("No metrics recorded yet. Process a document first.")
+    else:
+        stage_df = pd.DataFrame([
+            {
+                "Stage": stage,
+                "Runs": stats["count"],
+                "Total Wall (s)": round(stats["wall_seconds"], 4),
+                "Total CPU (s)": round(stats["cpu_seconds"], 4),
+                "Mean Wall (ms)": round(stats["wall_seconds"] / stats["count"] * 1000, 2),
+                "Max Wall (ms)": round(stats["max_wall_seconds"] * 1000, 2),
+            }
+            for stage, stats in sorted(stages.items())
+        ])
+        st.subheader("🧩 Stages")
+        st.dataframe(stage_df, use_container_width=True)
+
+    counters = get_counters()
+    if counters:
+        st.subheader("🔢 Counters")
+        st.dataframe(pd.DataFrame(sorted(counters.items()), columns=["Counter", "Value"]), use_container_width=True)
+
+    traces = get_recent_traces()
+    if traces:
+        st.subheader("🧾 Recent Documents")
+        for trace in traces:
+            title = f"{trace['document']} - {trace['wall_seconds'] * 1000:.1f} ms"
+            if trace["error"]:
+                title += " (failed)"
+            with st.expander(title):
+                st.dataframe(pd.DataFrame(trace["stages"], columns=["Stage", "Wall (s)", "CPU (s)"]), use_container_width=True)
+                if trace["counters"]:
+                    st.json(trace["counters"])
+
+    cache = result_cache.stats()
+    st.subheader("🗃️ Result Cache")
+    st.write(f"**Entries:** {cache['entries']} - **Size:** {cache['bytes'] / (1024 * 1024):.1f} MB of {cache['max_bytes'] / (1024 * 1024):.0f} MB")
+    if cache["sessions"]:
+        st.dataframe(pd.DataFrame([
+            {"Session": session or "-", "Size (MB)": round(size / (1024 * 1024), 2), "Current": session == session_id()}
+            for session, size in sorted(cache["sessions"].items(), key=lambda item: -item[1])
+        ]), use_container_width=True)
+
+    with st.expander("Prometheus Export"):
+        st.code(render_prometheus(), language="text")
+
+    if st.button("Reset Metrics"):
+        reset_metrics()
+        st.experimental_rerun()
+
 # Main function to run the Streamlit app
 def main():
     setup_page()
@@ -0,0 +1,114 @@
+# uploads.py
+
+import codecs
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledUpload:
+    """An uploaded document that is either kept in memory or spooled to disk.
+
+    Extractors read it through a seekable binary stream (``stream()``), and
+    ``buffer()`` gives a zero-copy view of the raw bytes.
+    """
+
+    # Set by extractor.validate_document from the file's content
+    detected_type = None
+
+    def __init__(self, name, size, fileobj=None, path=None, owns_file=False):
+        self.name = name
+        self.size = size
+        self.path = path
+        self.owns_file = owns_file
+        self._fileobj = fileobj
+
+    @classmethod
+    def from_upload(cls, file, threshold=float('inf')):
+        # Uploads larger than ``threshold`` bytes are spooled to a temporary file; by default they stay in memory
+        if not hasattr(file, "getbuffer"):
+            file.seek(0)
+            return cls.from_chunks(file.name, iter(lambda: file.read(CHUNK_SIZE), b""))
+
+        # Streamlit's UploadedFile is a BytesIO; getbuffer() avoids the copy getvalue() makes
+        size = getattr(file, "size", None)
+        if size is None:
+            with file.getbuffer() as view:
+                size = view.nbytes
+        if size <= threshold:
+            return cls(file.name, size, fileobj=file)
+
+        with file.getbuffer() as view:
+            return cls.from_chunks(file.name, (view[i:i + CHUNK_SIZE] for i in range(0, len(view), CHUNK_SIZE)))
+
+    @classmethod
+    def from_chunks(cls, name, chunks):
+        suffix = os.path.splitext(name)[1]
+        fd, path = tempfile.mkstemp(prefix="transformo-", suffix=suffix)
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        logger.debug(f"Spooled upload '{name}' ({size} bytes) to '{path}'.")
+        return cls(name, size, path=path, owns_file=True)
+
+    @classmethod
+    def from_path(cls, path, name=None):
+        # Wraps a file that is already on disk without copying it; close() leaves it in place
+        return cls(name or os.path.basename(path), os.path.getsize(path), path=path)
+
+    @property
+    def spooled(self):
+        return self.path is not None
+
+    @contextmanager
+    def stream(self):
+        if self.spooled:
+            with open(self.path, "rb") as f:
+                yield f
+        else:
+            self._fileobj.seek(0)
+            yield self._fileobj
+
+    @contextmanager
+    def buffer(self):
+        if not self.spooled:
+            with self._fileobj.getbuffer() as view:
+                yield view
+            return
+        if self.size == 0:
+            yield memoryview(b"")
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+
+    def close(self):
+        if self.owns_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def decode_text(upload, encoding="utf-8"):
+    # Incremental decoding over the zero-copy buffer; no intermediate bytes copy of the upload
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with upload.buffer() as view:
+        parts = [decoder.decode(view[i:i + CHUNK_SIZE]) for i in range(0, len(view), CHUNK_SIZE)]
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
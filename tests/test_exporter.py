@@ -0,0 +1,77 @@
+import io
+import json
+import random
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+import pytest
+
+from benchmark import _check_round_trip, generate_paragraphs, temporary_store
+from compact import json_default
+from exporter import iter_json, iter_xml
+
+
+def _legacy_xml(data):
+    # The ElementTree/minidom export the streaming writer replaced
+    def dict_to_xml(tag, d):
+        elem = ET.Element(tag)
+        for key, val in d.items():
+            child = ET.Element(key)
+            if isinstance(val, dict):
+                child = dict_to_xml(key, val)
+            elif isinstance(val, list):
+                for item in val:
+                    if isinstance(item, dict):
+                        child.append(dict_to_xml('item', item))
+                    else:
+                        ET.SubElement(child, 'item').text = str(item)
+            else:
+                child.text = str(val)
+            elem.append(child)
+        return elem
+
+    root = dict_to_xml('document', data)
+    return minidom.parseString(ET.tostring(root, encoding='unicode')).toprettyxml(indent="  ")
+
+
+@pytest.fixture(scope="module")
+def result():
+    from pages import join_pages
+    from processor import process_document
+
+    blocks = generate_paragraphs(random.Random(0), 30)
+    blocks[0] += ' Quotes "R&D" <tags>, an empty field and unicode: São Paulo, Müller.'
+    text = join_pages("\n\n".join(blocks[i:i + 10]) for i in range(0, len(blocks), 10))
+    with temporary_store():
+        return process_document(text, render_outputs=False)
+
+
+def test_json_export_matches_json_dumps(result):
+    data = result["structured_data"]
+    expected = json.dumps(data, indent=2, ensure_ascii=False, default=json_default)
+    assert "".join(iter_json(data, chunk_size=100)) == expected
+
+
+def test_xml_export_matches_minidom(result):
+    data = result["structured_data"]
+    materialized = json.loads(json.dumps(data, default=json_default))
+    materialized["empty"] = ""
+    materialized["nested"] = {"quote": 'a "b" & <c>', "items": [1, "two", {"three": 3}]}
+    assert "".join(iter_xml(materialized, chunk_size=100)) == _legacy_xml(materialized)
+
+
+def test_exports_round_trip(result):
+    from formats import binary_formats, read_jsonl, read_parquet, unpack_msgpack
+    from processor import generate_machine_readable_output
+
+    decoders = {
+        "json": json.loads,
+        # ElementTree rejects a str with an encoding declaration, so XML is parsed as bytes
+        "xml": lambda output: ET.fromstring(output.encode("utf-8")),
+        "jsonl": lambda output: read_jsonl(output.splitlines()),
+        "parquet": lambda output: read_parquet(io.BytesIO(output)),
+        "msgpack": unpack_msgpack,
+    }
+    for export_format in ["json", "xml", "jsonl"] + binary_formats():
+        output = generate_machine_readable_output(result, export_format)
+        _check_round_trip(export_format, result, decoders[export_format](output))
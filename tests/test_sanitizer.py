@@ -0,0 +1,28 @@
+import random
+
+import pytest
+
+from benchmark import _legacy_clean_text, generate_paragraphs
+from sanitizer import clean_text
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "plain text",
+    "R&D <b>bold</b> > less",
+    "tab\tnew\nline\rcarriage\x00nul\x7fdel\xa0nbsp\xadshy",
+    "zero\u200bwidth line\u2028paragraph\u2029bom\ufeff",
+    "accents éü and CJK 漢字 stay",
+])
+def test_clean_text_matches_legacy(text):
+    assert clean_text(text) == _legacy_clean_text(text)
+
+
+def test_clean_text_matches_legacy_on_spans():
+    rng = random.Random(0)
+    text = "\n\n".join(p.replace(". ", ".\u2028", 2) + " <b>R&D</b>\t\u200b" for p in generate_paragraphs(rng, 50))
+    position = 0
+    while position < len(text):
+        end = min(len(text), position + rng.randint(1, 200))
+        assert clean_text(text[position:end]) == _legacy_clean_text(text[position:end])
+        position = end